@@ -28,7 +28,12 @@ type AnyPlotProps = AnyPlotVisProps | TableDisplayProps;
 function AnyVisCanvas(props: AnyPlotProps) {
   let visCanvas = null;
   if ('lineData' in props && props.lineData.length !== 0) {
-    visCanvas = <LineVisCanvas lineData={props.lineData} />;
+    visCanvas = (
+      <LineVisCanvas
+        lineData={props.lineData}
+        updateViewport={props.updateViewport}
+      />
+    );
   } else if ('values' in props) {
     if ('heatmapScale' in props) {
       visCanvas = (
@@ -36,6 +41,7 @@ function AnyVisCanvas(props: AnyPlotProps) {
           xValues={props.plotConfig.xValues}
           yValues={props.plotConfig.yValues}
           values={props.values}
+          updateViewport={props.updateViewport}
         />
       );
     } else {
@@ -44,6 +50,7 @@ function AnyVisCanvas(props: AnyPlotProps) {
           xValues={props.plotConfig.xValues}
           yValues={props.plotConfig.yValues}
           values={props.values}
+          updateViewport={props.updateViewport}
         />
       );
     }
@@ -3,21 +3,33 @@ import { decode, encode } from '@msgpack/msgpack';
 import { useCallback, useEffect, useRef, useState } from 'react';
 import useWebSocket, { ReadyState } from 'react-use-websocket';
 import { toast } from 'react-toastify';
+import type { Domain } from '@h5web/lib';
 
-import type { BatonProps, PlotConfig } from './models';
+import type { BatonProps, NDT, PlotConfig } from './models';
 import AnyPlot from './AnyPlot';
 import {
   appendLineData,
+  cacheRecent,
   calculateMultiXDomain,
   calculateMultiYDomain,
   createPlotConfig,
   createLineData,
   createImageData,
+  createNdArray,
   createScatterData,
   createSurfaceData,
   createTableData,
+  extensionCodec,
+  getRecent,
   isHeatmapData,
   measureInteraction,
+  patchImageValues,
+  pyramidAxis,
+  pyramidLevel,
+  regionContains,
+  unionDomains,
+  upsampleImageValues,
+  visiblePixels,
 } from './utils';
 import type {
   CLineData,
@@ -26,6 +38,9 @@ import type {
   CScatterData,
   CSurfaceData,
   CPlotConfig,
+  MP_NDArray,
+  PyramidInfo,
+  Region,
 } from './utils';
 import {
   cloneSelection,
@@ -39,19 +54,35 @@ import type { AnyPlotProps } from './AnyPlot';
 import type { LineData, LineParams } from './LinePlot';
 import type { HeatmapData } from './HeatmapPlot';
 import type { ScatterData } from './ScatterPlot';
+import type { Viewport } from './ViewportListener';
 
 type DecodedMessage =
   | MultiLineMessage
+  | UpdateLinesMessage
+  | ClearLinesMessage
   | ImageMessage
+  | ImageFrameMessage
+  | StackFrameMessage
+  | ImagePatchMessage
+  | ImageTileMessage
   | ScatterMessage
   | SurfaceMessage
   | TableMessage
+  | LineParamsMessage
+  | ScatterParamsMessage
   | SelectionsMessage
   | ClearSelectionsMessage
   | ClearPlotMessage
   | BatonMessage
   | BatonRequestMessage;
 
+/**
+ * Maximum number of stack frames kept. This is twice the number of frames that
+ * the server assumes a client keeps (MAX_PACKED_FRAMES) so any frame it skips
+ * sending is available
+ */
+const MAX_STACK_FRAMES = 32;
+
 const defaultPlotConfig = {
   xScale: undefined,
   yScale: undefined,
@@ -139,6 +170,34 @@ interface ClientLineParametersMessage {
   lineParams: LineParams;
 }
 
+/**
+ * A client frame message
+ */
+interface ClientFrameMessage {
+  /** The index of frame of image stack to show */
+  frame: number;
+}
+
+/**
+ * A client viewport message
+ */
+interface ClientViewportMessage {
+  /** The width of line plot in pixels */
+  pixelWidth: number;
+  /** The visible range of x axis (undefined for all) */
+  xRange?: Domain;
+}
+
+/**
+ * A client request for tiles of a multi-resolution image
+ */
+interface ClientTilesRequestMessage {
+  /** The level of tiles */
+  level: number;
+  /** The columns and rows (start and stop) of region in full resolution */
+  region: Region;
+}
+
 /**
  * A client scatter parameters message
  */
@@ -147,11 +206,32 @@ interface ClientScatterParametersMessage {
   pointSize: number;
 }
 
+/**
+ * A line parameters message
+ */
+interface LineParamsMessage extends _PlotMessage {
+  /** The key of line to update */
+  key: string;
+  /** The new line parameters */
+  lineParams: LineParams;
+}
+
+/**
+ * A scatter parameters message
+ */
+interface ScatterParamsMessage extends _PlotMessage {
+  /** The new data point size */
+  pointSize: number;
+}
+
 type ClientMessage =
   | ClientStatusMessage
   | ClientSelectionMessage
   | ClientLineParametersMessage
   | ClientScatterParametersMessage
+  | ClientFrameMessage
+  | ClientViewportMessage
+  | ClientTilesRequestMessage
   | ClearSelectionsMessage
   | BatonRequestMessage
   | BatonDonateMessage;
@@ -182,12 +262,114 @@ interface MultiLineMessage extends _DataMessage {
   mlData: CLineData[];
 }
 
+/**
+ * A message to update lines by key
+ */
+interface UpdateLinesMessage extends _PlotMessage {
+  /** Append points to lines */
+  append: boolean;
+  /** The lines that replace or append to lines with the same key */
+  updateLines: CLineData[];
+}
+
+/**
+ * A message to remove lines by key
+ */
+interface ClearLinesMessage extends _PlotMessage {
+  /** The keys of lines to remove */
+  lineKeys: string[];
+}
+
+/**
+ * An image stack
+ */
+interface StackInfo {
+  /** The stack ID */
+  stackId: string;
+  /** The number of frames */
+  frames: number;
+  /** The index of frame shown */
+  frame: number;
+}
+
 /**
  * An image data message
  */
 interface ImageMessage extends _DataMessage {
   /** The image data */
   imData: CImageData;
+  /** The image stack of which image is a frame */
+  stack?: StackInfo;
+  /** The multi-resolution image of which image is the overview */
+  pyramid?: PyramidInfo;
+}
+
+/**
+ * An image stack frame message
+ */
+interface ImageFrameMessage extends _PlotMessage {
+  /** The stack ID */
+  stackId: string;
+  /** The index of frame */
+  frame: number;
+  /** The values of frame */
+  frameValues: MP_NDArray;
+}
+
+/**
+ * A message to show frame of image stack
+ */
+interface StackFrameMessage extends _PlotMessage {
+  /** The stack ID */
+  stackId: string;
+  /** The index of frame */
+  frame: number;
+}
+
+/**
+ * An image patch message
+ */
+interface ImagePatchMessage extends _PlotMessage {
+  /** The column and row of patch's first pixel */
+  offset: [number, number];
+  /** The values of patch */
+  patchValues: MP_NDArray;
+  /** The new heatmap domain */
+  domain?: Domain;
+}
+
+/**
+ * An image tile message
+ */
+interface ImageTileMessage extends _PlotMessage {
+  /** The level of tile */
+  level: number;
+  /** The column and row of tile's first pixel in level */
+  offset: [number, number];
+  /** The values of tile */
+  tileValues: MP_NDArray;
+}
+
+/**
+ * An image shown at the finest level of its pyramid that has been needed
+ */
+interface TiledImage {
+  /** The pyramid of image where level is that of values */
+  pyramid: PyramidInfo;
+  /** The level of overview */
+  overviewLevel: number;
+  /** The x axis values of overview (undefined for pixel edges) */
+  xOverview?: NDT;
+  /** The y axis values of overview (undefined for pixel edges) */
+  yOverview?: NDT;
+  /** The values composed of overview and tiles */
+  values: NDT;
+  /** The x axis values of level */
+  xValues: NDT;
+  /** The y axis values of level */
+  yValues: NDT;
+  /** The regions whose tiles have been requested */
+  requested: Region[];
 }
 
 /**
@@ -245,9 +427,15 @@ function ConnectedPlot({
   const [linePlotConfig, setLinePlotConfig] =
     useState<PlotConfig>(defaultPlotConfig);
   const [scatterData, setScatterData] = useState<ScatterData>();
+  const [stackInfo, setStackInfo] = useState<StackInfo | null>(null);
+  const stackFrames = useRef(new Map<number, NDT>());
+  const lineDomains = useRef<[Domain, Domain] | null>(null);
+  const viewport = useRef<ClientViewportMessage | null>(null);
+  const tiledImage = useRef<TiledImage | null>(null);
+  const imageViewport = useRef<Viewport | null>(null);
 
   const mountState = useRef('');
-  const plotServerURL = `ws://${hostname}:${port}/plot/${uuid}/${plotId}`;
+  const plotServerURL = `ws://${hostname}:${port}/plot/${uuid}/${plotId}?arrays=ext&tiles=true`;
   const { sendMessage, lastMessage, readyState, getWebSocket } = useWebSocket(
     plotServerURL,
     {
@@ -335,10 +523,111 @@ function ConnectedPlot({
         console.log('%s: WebSocket set binaryType', plotId);
       }
       sendStatusMessage('ready');
+      if (viewport.current) {
+        // new connection starts without viewport
+        sendClientMessage(viewport.current);
+      }
     }
-  }, [getWebSocket, plotId, readyState, sendStatusMessage]);
+  }, [
+    getWebSocket,
+    plotId,
+    readyState,
+    sendClientMessage,
+    sendStatusMessage,
+  ]);
+
+  const updateViewport = useCallback(
+    (visible: Viewport) => {
+      if (!lineDomains.current) {
+        return;
+      }
+      const [x0, x1] = visible.xVisibleDomain;
+      const [d0, d1] = lineDomains.current[0];
+      const zoomed = x0 > d0 || x1 < d1;
+      const old = viewport.current;
+      if (
+        old &&
+        old.pixelWidth === visible.pixelWidth &&
+        (zoomed
+          ? old.xRange?.[0] === x0 && old.xRange[1] === x1
+          : old.xRange === undefined)
+      ) {
+        return;
+      }
+      const message: ClientViewportMessage = {
+        pixelWidth: visible.pixelWidth,
+        xRange: zoomed ? [x0, x1] : undefined,
+      };
+      viewport.current = message;
+      sendClientMessage(message);
+    },
+    [sendClientMessage]
+  );
+
+  const updateImageViewport = useCallback(
+    (visible: Viewport) => {
+      imageViewport.current = visible;
+      const tiled = tiledImage.current;
+      if (!tiled) {
+        return;
+      }
+      const { shape, levels } = tiled.pyramid;
+      const [x0, x1] = visiblePixels(
+        visible.xVisibleDomain,
+        tiled.xValues,
+        shape[1]
+      );
+      const [y0, y1] = visiblePixels(
+        visible.yVisibleDomain,
+        tiled.yValues,
+        shape[0]
+      );
+      if (x0 >= x1 || y0 >= y1) {
+        return; // image is not visible
+      }
+      const region: Region = [x0, y0, x1, y1];
+      const level = pyramidLevel(
+        levels,
+        region,
+        visible.pixelWidth,
+        visible.pixelHeight
+      );
+      if (level > tiled.pyramid.level || level === tiled.overviewLevel) {
+        return; // values are fine enough
+      }
+      if (level < tiled.pyramid.level) {
+        const factor = 2 ** level;
+        tiled.values = upsampleImageValues(
+          tiled.values,
+          2 ** (tiled.pyramid.level - level),
+          Math.ceil(shape[0] / factor),
+          Math.ceil(shape[1] / factor)
+        );
+        const { overviewLevel, xOverview, yOverview } = tiled;
+        tiled.xValues = pyramidAxis(shape[1], level, xOverview, overviewLevel);
+        tiled.yValues = pyramidAxis(shape[0], level, yOverview, overviewLevel);
+        tiled.pyramid = { ...tiled.pyramid, level };
+        tiled.requested = [];
+        const { values, xValues, yValues } = tiled;
+        console.log('%s: showing image at level %d', plotId, level);
+        setPlotProps((old) => {
+          if (!old || !('values' in old)) {
+            return old;
+          }
+          const plotConfig = { ...old.plotConfig, xValues, yValues };
+          return { ...old, values, plotConfig };
+        });
+      }
+      if (!tiled.requested.some((r) => regionContains(r, region))) {
+        tiled.requested.push(region);
+        sendClientMessage({ level, region });
+      }
+    },
+    [plotId, sendClientMessage]
+  );
 
   const clearLineData = () => {
+    lineDomains.current = null;
     setLineData([]);
     setLinePlotConfig(defaultPlotConfig);
     setPlotProps(null);
@@ -439,8 +728,14 @@ function ConnectedPlot({
     multilineData: LineData[],
     newPlotConfig?: PlotConfig
   ) => {
-    const xDomain = calculateMultiXDomain(multilineData);
-    const yDomain = calculateMultiYDomain(multilineData);
+    let xDomain = calculateMultiXDomain(multilineData);
+    let yDomain = calculateMultiYDomain(multilineData);
+    if (viewport.current?.xRange && lineDomains.current) {
+      // server only sends lines within zoomed range so keep their full extent
+      xDomain = unionDomains(xDomain, lineDomains.current[0]);
+      yDomain = unionDomains(yDomain, lineDomains.current[1]);
+    }
+    lineDomains.current = [xDomain, yDomain];
     console.log(
       '%s: setting line state with domains',
       plotId,
@@ -456,6 +751,7 @@ function ConnectedPlot({
       yDomain,
       plotConfig,
       updateLineParams,
+      updateViewport,
     });
   };
 
@@ -487,23 +783,152 @@ function ConnectedPlot({
     }
   };
 
+  const updateKeyedLines = (message: UpdateLinesMessage) => {
+    const all = [...lineData];
+    for (const l of message.updateLines) {
+      const line = createLineData(l);
+      if (line === null) {
+        continue;
+      }
+      const old = all.findIndex((a) => a.key === line.key);
+      if (old === -1) {
+        all.push(line);
+      } else {
+        all[old] = message.append ? appendLineData(all[old], line) : line;
+      }
+    }
+    console.log('%s: updated lines by key', plotId);
+    updateLineData(all);
+  };
+
+  const clearKeyedLines = (message: ClearLinesMessage) => {
+    const keys = message.lineKeys;
+    console.log('%s: remove lines', plotId, keys);
+    updateLineData(lineData.filter((l) => !keys.includes(l.key)));
+  };
+
+  const patchLineParams = (message: LineParamsMessage) => {
+    const old = lineData.findIndex((l) => l.key === message.key);
+    if (old === -1) {
+      console.log('%s: line with key', plotId, message.key, 'not found');
+      return;
+    }
+    console.log('%s: patching line params', plotId, message.key);
+    const all = [...lineData];
+    all[old] = { ...all[old], lineParams: message.lineParams };
+    updateLineData(all);
+  };
+
   const plotNewImageData = (message: ImageMessage) => {
     const imageData = createImageData(message.imData);
     const imagePlotConfig = createPlotConfig(message.plotConfig);
+    const stack = message.stack ?? null;
+    if (stack && stack.stackId !== stackInfo?.stackId) {
+      stackFrames.current.clear();
+    }
+    if (stack) {
+      cacheRecent(
+        stackFrames.current,
+        stack.frame,
+        imageData.values,
+        MAX_STACK_FRAMES
+      );
+    }
+    setStackInfo(stack);
+    const pyramid = message.pyramid ?? null;
+    if (pyramid) {
+      const { shape, level } = pyramid;
+      const { xValues, yValues } = imagePlotConfig;
+      tiledImage.current = {
+        pyramid,
+        overviewLevel: level,
+        xOverview: xValues,
+        yOverview: yValues,
+        values: imageData.values,
+        xValues: pyramidAxis(shape[1], level, xValues),
+        yValues: pyramidAxis(shape[0], level, yValues),
+        requested: [],
+      };
+      imagePlotConfig.xValues = tiledImage.current.xValues;
+      imagePlotConfig.yValues = tiledImage.current.yValues;
+    } else {
+      tiledImage.current = null;
+    }
+    const updateViewport = pyramid ? updateImageViewport : undefined;
     if (isHeatmapData(imageData)) {
       const heatmapData = imageData as HeatmapData;
       console.log('%s: new heatmap data', plotId, Object.keys(heatmapData));
       setPlotProps({
         ...heatmapData,
         plotConfig: imagePlotConfig,
+        updateViewport,
       });
     } else {
       console.log('%s: new image data', plotId, Object.keys(imageData));
       setPlotProps({
         ...imageData,
         plotConfig: imagePlotConfig,
+        updateViewport,
       });
     }
+    if (pyramid && imageViewport.current) {
+      updateImageViewport(imageViewport.current); // for new overview
+    }
+  };
+
+  const patchTile = (message: ImageTileMessage) => {
+    const tiled = tiledImage.current;
+    if (!tiled || message.level !== tiled.pyramid.level) {
+      console.log('%s: ignoring tile at level %d', plotId, message.level);
+      return;
+    }
+    // values at finer level than overview are a copy so write tile into them
+    const values = patchImageValues(
+      tiled.values,
+      message.tileValues,
+      message.offset,
+      false
+    );
+    tiled.values = values;
+    setPlotProps((old) => (old && 'values' in old ? { ...old, values } : old));
+  };
+
+  const keepFrame = (message: ImageFrameMessage) => {
+    if (message.stackId === stackInfo?.stackId) {
+      const values = createNdArray(message.frameValues)[0];
+      cacheRecent(stackFrames.current, message.frame, values, MAX_STACK_FRAMES);
+    }
+  };
+
+  const showFrame = (frame: number) => {
+    const values = getRecent(stackFrames.current, frame);
+    if (values === undefined) {
+      console.log('%s: frame %d not available', plotId, frame);
+      return;
+    }
+    setStackInfo((old) => old && { ...old, frame });
+    setPlotProps((old) => old && { ...old, values });
+  };
+
+  const selectFrame = (frame: number) => {
+    showFrame(frame);
+    sendClientMessage({ frame });
+  };
+
+  const patchImageData = (message: ImagePatchMessage) => {
+    console.log('%s: patching image at', plotId, message.offset);
+    setPlotProps((old) => {
+      if (!old || !('values' in old)) {
+        return old;
+      }
+      const values = patchImageValues(
+        old.values,
+        message.patchValues,
+        message.offset
+      );
+      const domain = message.domain ?? undefined;
+      return domain ? { ...old, values, domain } : { ...old, values };
+    });
   };
 
   const plotNewScatterData = (message: ScatterMessage) => {
@@ -518,6 +943,16 @@ function ConnectedPlot({
     });
   };
 
+  const patchScatterParams = (message: ScatterParamsMessage) => {
+    if (scatterData === undefined) {
+      return;
+    }
+    console.log('%s: patching point size', plotId, message.pointSize);
+    const newScatterData = { ...scatterData, pointSize: message.pointSize };
+    setScatterData(newScatterData);
+    setPlotProps((old) => old && { ...old, pointSize: message.pointSize });
+  };
+
   const plotNewSurfaceData = (message: SurfaceMessage) => {
     const surfaceData = createSurfaceData(message.suData);
     console.log('%s: new surface data', plotId, Object.keys(surfaceData));
@@ -604,7 +1039,7 @@ function ConnectedPlot({
     }
 
     // eslint-disable-next-line
-    const decodedMessage = decode(data) as DecodedMessage;
+    const decodedMessage = decode(data, { extensionCodec }) as DecodedMessage;
     console.log('%s: decodedMessage', plotId, Object.keys(decodedMessage));
 
     const interaction = measureInteraction();
@@ -617,12 +1052,28 @@ function ConnectedPlot({
       plotMultilineData(decodedMessage);
     } else if ('imData' in decodedMessage) {
       plotNewImageData(decodedMessage);
+    } else if ('frameValues' in decodedMessage) {
+      keepFrame(decodedMessage);
+    } else if ('stackId' in decodedMessage) {
+      showFrame(decodedMessage.frame);
+    } else if ('tileValues' in decodedMessage) {
+      patchTile(decodedMessage);
+    } else if ('patchValues' in decodedMessage) {
+      patchImageData(decodedMessage);
     } else if ('scData' in decodedMessage) {
       plotNewScatterData(decodedMessage);
     } else if ('suData' in decodedMessage) {
       plotNewSurfaceData(decodedMessage);
     } else if ('taData' in decodedMessage) {
       displayNewTableData(decodedMessage);
+    } else if ('updateLines' in decodedMessage) {
+      updateKeyedLines(decodedMessage);
+    } else if ('lineKeys' in decodedMessage) {
+      clearKeyedLines(decodedMessage);
+    } else if ('lineParams' in decodedMessage) {
+      patchLineParams(decodedMessage);
+    } else if ('pointSize' in decodedMessage) {
+      patchScatterParams(decodedMessage);
     } else if ('selectionIds' in decodedMessage) {
       clearSelections(decodedMessage);
     } else if ('setSelections' in decodedMessage) {
@@ -674,6 +1125,22 @@ function ConnectedPlot({
     return <h2>Awaiting command from plot server</h2>;
   }
 
+  if (stackInfo) {
+    return (
+      <>
+        <AnyPlot {...currentProps} />
+        <input
+          type="range"
+          min={0}
+          max={stackInfo.frames - 1}
+          value={stackInfo.frame}
+          disabled={!batonProps.hasBaton}
+          onChange={(e) => selectFrame(Number(e.target.value))}
+        />
+      </>
+    );
+  }
+
   return <AnyPlot {...currentProps} />;
 }
 
@@ -20,15 +20,22 @@ import {
   usePlotCustomizationContext,
 } from './PlotCustomizationContext';
 import { AnyToolbar } from './PlotToolbar';
+import ViewportListener, { type Viewport } from './ViewportListener';
 import { useEffect } from 'react';
 
 interface Props {
   xValues?: NDT;
   yValues?: NDT;
   values: NDT;
+  updateViewport?: (viewport: Viewport) => void;
 }
 
-export function HeatmapVisCanvas({ xValues, yValues, values }: Props) {
+export function HeatmapVisCanvas({
+  xValues,
+  yValues,
+  values,
+  updateViewport,
+}: Props) {
   const {
     title,
     showGrid,
@@ -78,6 +85,9 @@ export function HeatmapVisCanvas({ xValues, yValues, values }: Props) {
       interactions={interactionsConfig}
       flipYAxis
     >
+      {updateViewport && (
+        <ViewportListener onViewportChange={updateViewport} />
+      )}
       {canSelect && (
         <SelectionComponent
           modifierKey={[] as ModifierKey[]}
@@ -108,7 +118,10 @@ interface HeatmapData extends ImageData {
 /**
  * Props for `HeatmapPlot` component
  */
-interface HeatmapPlotProps extends PlotBaseProps, HeatmapData {}
+interface HeatmapPlotProps extends PlotBaseProps, HeatmapData {
+  /** Handles change of visible part of plot */
+  updateViewport?: (viewport: Viewport) => void;
+}
 
 type HeatmapPlotCustomizationProps = Omit<HeatmapPlotProps, 'values'>;
 
@@ -131,6 +144,7 @@ function HeatmapPlot(props: HeatmapPlotProps) {
           xValues={props.plotConfig.xValues}
           yValues={props.plotConfig.yValues}
           values={props.values}
+          updateViewport={props.updateViewport}
         />
       </PlotCustomizationContextProvider>
     </div>
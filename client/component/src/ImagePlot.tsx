@@ -8,11 +8,13 @@ import {
   usePlotCustomizationContext,
 } from './PlotCustomizationContext';
 import { AnyToolbar } from './PlotToolbar';
+import ViewportListener, { type Viewport } from './ViewportListener';
 import { useLayoutEffect, useRef, useState } from 'react';
 interface Props {
   xValues?: NDT;
   yValues?: NDT;
   values: NDT;
+  updateViewport?: (viewport: Viewport) => void;
 }
 
 // From h5web/packages/lib/src/vis/utils.ts
@@ -38,7 +40,12 @@ function getAxisOffsets(
   };
 }
 
-export function ImageVisCanvas({ xValues, yValues, values }: Props) {
+export function ImageVisCanvas({
+  xValues,
+  yValues,
+  values,
+  updateViewport,
+}: Props) {
   const {
     title,
     showGrid,
@@ -72,6 +79,9 @@ export function ImageVisCanvas({ xValues, yValues, values }: Props) {
       interactions={interactionsConfig}
       flipYAxis
     >
+      {updateViewport && (
+        <ViewportListener onViewportChange={updateViewport} />
+      )}
       {canSelect && (
         <SelectionComponent
           modifierKey={[] as ModifierKey[]}
@@ -106,6 +116,8 @@ interface ImagePlotProps extends PlotBaseProps, ImageData {
    * Has no effect if the aspect is not equal.
    */
   tightAxes?: boolean;
+  /** Handles change of visible part of plot */
+  updateViewport?: (viewport: Viewport) => void;
 }
 
 type ImagePlotCustomizationProps = Omit<ImagePlotProps, 'values'>;
@@ -206,6 +218,7 @@ function ImagePlot(props: ImagePlotProps) {
           xValues={props.plotConfig.xValues}
           yValues={props.plotConfig.yValues}
           values={props.values}
+          updateViewport={props.updateViewport}
         />
       </PlotCustomizationContextProvider>
     </div>
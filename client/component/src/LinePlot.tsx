@@ -20,6 +20,7 @@ import {
   usePlotCustomizationContext,
 } from './PlotCustomizationContext';
 import { AnyToolbar } from './PlotToolbar';
+import ViewportListener, { type Viewport } from './ViewportListener';
 
 /**
  * Represent line data
@@ -71,6 +72,8 @@ interface LinePlotProps extends PlotBaseProps {
   yDomain?: Domain;
   /** Handles updating line params */
   updateLineParams?: (key: string, params: LineParams) => void;
+  /** Handles change of visible part of plot */
+  updateViewport?: (viewport: Viewport) => void;
 }
 
 type LinePlotCustomizationProps = Omit<LinePlotProps, 'lineData'>;
@@ -128,6 +131,7 @@ function createDataCurve(
 
 interface Props {
   lineData: LineData[];
+  updateViewport?: (viewport: Viewport) => void;
 }
 export function LineVisCanvas(props: Props) {
   const {
@@ -153,7 +157,7 @@ export function LineVisCanvas(props: Props) {
     updateSelection,
     selections,
   } = usePlotCustomizationContext();
-  const lineData = props.lineData;
+  const { lineData, updateViewport } = props;
 
   const initLineParams = useMemo(() => {
     const all = new Map<string, LineParams>();
@@ -209,6 +213,9 @@ export function LineVisCanvas(props: Props) {
       <DefaultInteractions {...interactionsConfig} />
       <ResetZoomButton />
       <TooltipMesh renderTooltip={tooltipText} />
+      {updateViewport && (
+        <ViewportListener onViewportChange={updateViewport} />
+      )}
       {lineData.map((d, index) => {
         const lp = allLineParams.get(d.key) ?? d.lineParams;
         return createDataCurve(d, lp, index);
@@ -243,7 +250,10 @@ function LinePlot(props: LinePlotProps) {
     >
       <PlotCustomizationContextProvider {...props}>
         <AnyToolbar>{props.customToolbarChildren}</AnyToolbar>
-        <LineVisCanvas lineData={props.lineData} />
+        <LineVisCanvas
+          lineData={props.lineData}
+          updateViewport={props.updateViewport}
+        />
       </PlotCustomizationContextProvider>
     </div>
   );
@@ -0,0 +1,61 @@
+import {
+  type Domain,
+  useVisCanvasContext,
+  useVisibleDomains,
+} from '@h5web/lib';
+import { useEffect } from 'react';
+
+/** Delay in milliseconds before reporting viewport after zooming or panning */
+const VIEWPORT_DELAY = 200;
+
+/**
+ * Represent the visible part of a plot
+ */
+interface Viewport {
+  /** The width of canvas in pixels */
+  pixelWidth: number;
+  /** The height of canvas in pixels */
+  pixelHeight: number;
+  /** The visible x domain */
+  xVisibleDomain: Domain;
+  /** The visible y domain */
+  yVisibleDomain: Domain;
+}
+
+/**
+ * Props for the `ViewportListener` component
+ */
+interface ViewportListenerProps {
+  /** Handles change of viewport once zooming or panning has settled */
+  onViewportChange: (viewport: Viewport) => void;
+}
+
+/**
+ * Report the viewport of the enclosing `VisCanvas`
+ * @param {ViewportListenerProps} props - component props
+ * @returns {null} Nothing is rendered
+ */
+function ViewportListener({ onViewportChange }: ViewportListenerProps) {
+  const { canvasSize } = useVisCanvasContext();
+  const { xVisibleDomain, yVisibleDomain } = useVisibleDomains();
+  const { width, height } = canvasSize;
+  const [x0, x1] = xVisibleDomain;
+  const [y0, y1] = yVisibleDomain;
+
+  useEffect(() => {
+    const timer = setTimeout(() => {
+      onViewportChange({
+        pixelWidth: Math.round(width),
+        pixelHeight: Math.round(height),
+        xVisibleDomain: [x0, x1],
+        yVisibleDomain: [y0, y1],
+      });
+    }, VIEWPORT_DELAY);
+    return () => clearTimeout(timer);
+  }, [width, height, x0, x1, y0, y1, onViewportChange]);
+
+  return null;
+}
+
+export default ViewportListener;
+export type { Viewport, ViewportListenerProps };
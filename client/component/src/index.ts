@@ -46,6 +46,9 @@ export type {
   TableDisplayProps,
 } from './TableDisplay';
 
+export { default as ViewportListener } from './ViewportListener';
+export type { Viewport, ViewportListenerProps } from './ViewportListener';
+
 export { InteractionModeType } from './utils';
 
 export { default as AxialSelection } from './selections/AxialSelection';
@@ -1,19 +1,32 @@
+import { decode, encode, ExtData } from '@msgpack/msgpack';
 import ndarray, { type TypedArray } from 'ndarray';
 import { randomLcg, randomNormal, randomUniform } from 'd3-random';
 import {
   appendLineData,
+  cacheRecent,
   calculateMultiXDomain,
   calculateMultiYDomain,
   calculateHistogramCounts,
   createPlotConfig,
   createImageData,
   createLineData,
+  createNdArray,
   createScatterData,
   createTableData,
+  decodeNdArrayExt,
+  extensionCodec,
+  getRecent,
   isHeatmapData,
   isValidPositiveNumber,
   nanMinMax,
   MP_NDArray,
+  patchImageValues,
+  pyramidAxis,
+  pyramidLevel,
+  regionContains,
+  unionDomains,
+  upsampleImageValues,
+  visiblePixels,
 } from './utils';
 
 import type { PlotConfig, NDT } from './models';
@@ -24,6 +37,7 @@ import type {
   CScatterData,
   CTableData,
   HistogramCounts,
+  Region,
 } from './utils';
 import type { Aspect, Domain } from '@h5web/lib';
 import { describe, expect, it, test } from 'vitest';
@@ -632,6 +646,38 @@ describe('checks calculateMultiYDomain', () => {
   );
 });
 
+describe('checks unionDomains', () => {
+  it.each([
+    [[0, 1] as Domain, [2, 3] as Domain, [0, 3] as Domain],
+    [[-1, 5] as Domain, [2, 3] as Domain, [-1, 5] as Domain],
+    [[2, 3] as Domain, [-1, 2.5] as Domain, [-1, 3] as Domain],
+  ])(
+    'calls unionDomains on %p and %p expecting %p',
+    (a: Domain, b: Domain, expected: Domain) => {
+      compareArrays(unionDomains(a, b), expected);
+    }
+  );
+});
+
+describe('checks cacheRecent', () => {
+  it('evicts least recently used entries', () => {
+    const cache = new Map<number, string>();
+    for (let i = 0; i < 4; i++) {
+      cacheRecent(cache, i, `${i}`, 3);
+    }
+    expect([...cache.keys()]).toEqual([1, 2, 3]);
+    expect(getRecent(cache, 1)).toBe('1');
+    expect(getRecent(cache, 0)).toBeUndefined();
+    cacheRecent(cache, 4, '4', 3);
+    expect([...cache.keys()]).toEqual([3, 1, 4]);
+    cacheRecent(cache, 3, 'three', 2);
+    expect([...cache.entries()]).toEqual([
+      [4, '4'],
+      [3, 'three'],
+    ]);
+  });
+});
+
 describe('checks appendLineData', () => {
   const lineA = {
     key: 'A',
@@ -856,3 +902,114 @@ describe('checks calculateHistogramCounts', () => {
     }
   );
 });
+
+describe('checks image pyramid helpers', () => {
+  it('upsamples image values', () => {
+    const values = ndarray(new Uint8Array([1, 2, 3, 4]), [2, 2]);
+    const upsampled = upsampleImageValues(values, 2, 3, 4);
+    expect(upsampled.shape).toStrictEqual([3, 4]);
+    expect(upsampled.data).toBeInstanceOf(Uint8Array);
+    compareArrays(
+      Array.from(upsampled.data),
+      [1, 1, 2, 2, 1, 1, 2, 2, 3, 3, 4, 4]
+    );
+
+    const rgb = ndarray(new Uint8Array([1, 2, 3]), [1, 1, 3]);
+    const upsampledRgb = upsampleImageValues(rgb, 2, 2, 2);
+    expect(upsampledRgb.shape).toStrictEqual([2, 2, 3]);
+    compareArrays(
+      Array.from(upsampledRgb.data),
+      [1, 2, 3, 1, 2, 3, 1, 2, 3, 1, 2, 3]
+    );
+  });
+
+  it('writes tiles into image values', () => {
+    const values = ndarray(new Float64Array(6), [2, 3]);
+    const tile = {
+      nd: true,
+      dtype: '<f8',
+      shape: [1, 2],
+      data: new Float64Array([5, 6]).buffer,
+    } as MP_NDArray;
+    const patched = patchImageValues(values, tile, [1, 1], false);
+    expect(patched).not.toBe(values);
+    expect(patched.data).toBe(values.data);
+    compareArrays(Array.from(values.data), [0, 0, 0, 0, 5, 6]);
+  });
+
+  it.each([
+    [5, 0, undefined, undefined, [0, 1, 2, 3, 4, 5]],
+    [5, 1, undefined, undefined, [0, 2, 4, 5]],
+    [5, 2, undefined, undefined, [0, 4, 5]],
+    [5, 0, [10, 14, 15], 2, [10, 11, 12, 13, 14, 15]],
+    [8, 1, [1, 5], 2, [0, 2, 4, 6]],
+  ])(
+    'calls pyramidAxis for size %p at level %p with overview %p at level %p',
+    (
+      size: number,
+      level: number,
+      overview: number[] | undefined,
+      overviewLevel: number | undefined,
+      expected: number[]
+    ) => {
+      const axis = overview && ndarray(new Float64Array(overview));
+      const result = pyramidAxis(size, level, axis, overviewLevel);
+      compareArrays(Array.from(result.data), expected);
+    }
+  );
+
+  it('finds visible pixels and level', () => {
+    const axis = ndarray(new Float64Array([0, 50, 100]));
+    expect(visiblePixels([-10, 20.5], axis, 200)).toStrictEqual([0, 41]);
+    expect(visiblePixels([80, 10], axis, 200)).toStrictEqual([20, 160]);
+    expect(visiblePixels([150, 200], axis, 200)).toStrictEqual([200, 200]);
+
+    expect(pyramidLevel(5, [0, 0, 400, 100], 100, 100)).toBe(2);
+    expect(pyramidLevel(5, [0, 0, 150, 10], 100, 100)).toBe(0);
+    expect(pyramidLevel(2, [0, 0, 4000, 10], 100, 100)).toBe(1);
+  });
+
+  it.each([
+    [[0, 0, 10, 10], [2, 2, 8, 8], true],
+    [[0, 0, 10, 10], [0, 0, 10, 10], true],
+    [[0, 0, 10, 10], [5, 5, 11, 8], false],
+  ])(
+    'calls regionContains on %p and %p expecting %p',
+    (outer: number[], inner: number[], expected: boolean) => {
+      expect(regionContains(outer as Region, inner as Region)).toBe(expected);
+    }
+  );
+});
+
+describe('checks decoding of ndarray extension type', () => {
+  const header = encode(['<f8', [2, 2]]);
+  const makePayload = (padding: number) => {
+    const payload = new Uint8Array(1 + header.length + padding + 32);
+    payload[0] = header.length;
+    payload.set(header, 1);
+    const data = new Uint8Array(new Float64Array([1, 2, 3, 4]).buffer);
+    payload.set(data, 1 + header.length + padding);
+    return payload;
+  };
+
+  it('views aligned data without copying', () => {
+    const padding = 7 - (header.length % 8);
+    const payload = makePayload(padding);
+    const result = decodeNdArrayExt(payload);
+    expect(result.dtype).toBe('<f8');
+    expect(result.shape).toStrictEqual([2, 2]);
+    expect((result.data as Uint8Array).buffer).toBe(payload.buffer);
+    const values = createNdArray(result)[0];
+    expect(values.shape).toStrictEqual([2, 2]);
+    compareArrays(Array.from(values.data), [1, 2, 3, 4]);
+  });
+
+  it('decodes message with unaligned data', () => {
+    const message = encode({ values: new ExtData(1, makePayload(0)) });
+    const decoded = decode(message, { extensionCodec }) as {
+      values: MP_NDArray;
+    };
+    const values = createNdArray(decoded.values)[0];
+    compareArrays(Array.from(values.data), [1, 2, 3, 4]);
+  });
+});
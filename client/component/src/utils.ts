@@ -1,3 +1,4 @@
+import { decode, ExtensionCodec } from '@msgpack/msgpack';
 import ndarray from 'ndarray';
 import type { TypedArray } from 'ndarray';
 import concatRows from 'ndarray-concat-rows';
@@ -38,8 +39,60 @@ interface MP_NDArray {
   data: ArrayBufferLike | Uint8Array;
 }
 
+/** MessagePack extension type code for ndarrays (see fastapi_utils.py) */
+const NDARRAY_EXT_TYPE = 1;
+
+/**
+ * Decode ndarray packed as extension type
+ *
+ * The payload is the length of a header, the header of dtype and shape, any
+ * padding and then the data which is aligned in the message so it is viewed
+ * without copying
+ * @param {Uint8Array} payload - payload of extension type
+ * @returns {MP_NDArray} ndarray
+ */
+function decodeNdArrayExt(payload: Uint8Array): MP_NDArray {
+  const n = payload[0];
+  const [dtype, shape] = decode(payload.subarray(1, n + 1)) as [
+    string,
+    number[],
+  ];
+  const count = shape.reduce((v, l) => v * l, 1);
+  const itemSize = Number(dtype.slice(2)); // e.g. '<f8'
+  let data = payload.subarray(payload.length - count * itemSize);
+  if (data.byteOffset % itemSize !== 0) {
+    data = data.slice(); // message is not at start of its buffer
+  }
+  return { nd: true, dtype, shape, data };
+}
+
+/**
+ * Extension codec for decoding messages with ndarrays packed as extension types
+ */
+const extensionCodec = new ExtensionCodec();
+extensionCodec.register({
+  type: NDARRAY_EXT_TYPE,
+  encode: () => null, // only decoded
+  decode: decodeNdArrayExt,
+});
+
 type MinMax = (x: NDT) => [number, number];
 
+/**
+ * Represent a tiled multi-resolution image (see PyramidInfo in messages.py)
+ */
+interface PyramidInfo {
+  /** The number of rows and columns of full resolution image */
+  shape: [number, number];
+  /** The number of levels where level 0 is full resolution */
+  levels: number;
+  /** The level of image values */
+  level: number;
+}
+
+/** Columns and rows (start and stop) of a region of an image */
+type Region = [number, number, number, number];
+
 /**
  * Represent plot configuration.
  */
@@ -231,6 +284,54 @@ function calculateMultiYDomain(multilineData: LineData[]): Domain {
   return [Math.min(...mins), Math.max(...maxs)];
 }
 
+/**
+ * Find the smallest domain that contains both domains
+ * @param {Domain} a - a domain
+ * @param {Domain} b - another domain
+ * @returns {Domain} union of domains
+ */
+function unionDomains(a: Domain, b: Domain): Domain {
+  return [Math.min(a[0], b[0]), Math.max(a[1], b[1])];
+}
+
+/**
+ * Put value in map used as least-recently-used cache, evicting oldest entries
+ * @param {Map<K, V>} cache - map in order of use
+ * @param {K} key - key
+ * @param {V} value - value
+ * @param {number} maxSize - maximum number of entries
+ */
+function cacheRecent<K, V>(
+  cache: Map<K, V>,
+  key: K,
+  value: V,
+  maxSize: number
+) {
+  cache.delete(key);
+  cache.set(key, value);
+  for (const oldest of cache.keys()) {
+    if (cache.size <= maxSize) {
+      break;
+    }
+    cache.delete(oldest);
+  }
+}
+
+/**
+ * Get value from map used as least-recently-used cache, marking it as used
+ * @param {Map<K, V>} cache - map in order of use
+ * @param {K} key - key
+ * @returns {V | undefined} value if cached
+ */
+function getRecent<K, V>(cache: Map<K, V>, key: K): V | undefined {
+  const value = cache.get(key);
+  if (value !== undefined) {
+    cache.delete(key);
+    cache.set(key, value);
+  }
+  return value;
+}
+
 function createImageData(
   data: CImageData | CHeatmapData
 ): ImageData | HeatmapData {
@@ -254,6 +355,197 @@ function createImageData(
   }
 }
 
+/**
+ * Create copy of image values with patch written at given offset (or write
+ * patch into values and return new view of them)
+ * @param {NDT} values - image values
+ * @param {MP_NDArray} patch - values of patch
+ * @param {[number, number]} offset - column and row of patch's first pixel
+ * @param {boolean} [copy] - if false, write patch into values
+ * @returns {NDT} patched values
+ */
+function patchImageValues(
+  values: NDT,
+  patch: MP_NDArray,
+  offset: [number, number],
+  copy = true
+): NDT {
+  const p = createNdArray(patch)[0];
+  const patched = copy ? ndarray(values.data.slice(), values.shape) : values;
+  const [x0, y0] = offset;
+  const [rows, cols] = p.shape;
+  const channels = p.shape.length > 2 ? p.shape[2] : 0;
+  for (let r = 0; r < rows; r++) {
+    for (let c = 0; c < cols; c++) {
+      if (channels === 0) {
+        patched.set(y0 + r, x0 + c, p.get(r, c));
+      } else {
+        for (let k = 0; k < channels; k++) {
+          patched.set(y0 + r, x0 + c, k, p.get(r, c, k));
+        }
+      }
+    }
+  }
+  return copy ? patched : ndarray(values.data, values.shape);
+}
+
+/**
+ * Upsample image values by repeating each pixel
+ * @param {NDT} values - image values
+ * @param {number} ratio - number of repeats of each pixel in rows and columns
+ * @param {number} rows - number of rows of upsampled image
+ * @param {number} cols - number of columns of upsampled image
+ * @returns {NDT} upsampled values
+ */
+function upsampleImageValues(
+  values: NDT,
+  ratio: number,
+  rows: number,
+  cols: number
+): NDT {
+  const channels = values.shape.length > 2 ? values.shape[2] : 0;
+  const shape = channels === 0 ? [rows, cols] : [rows, cols, channels];
+  const Data = values.data.constructor as TypedArrayConstructor;
+  const upsampled = ndarray(
+    new Data(rows * cols * Math.max(channels, 1)),
+    shape
+  );
+  for (let r = 0; r < rows; r++) {
+    const vr = Math.floor(r / ratio);
+    for (let c = 0; c < cols; c++) {
+      const vc = Math.floor(c / ratio);
+      if (channels === 0) {
+        upsampled.set(r, c, values.get(vr, vc));
+      } else {
+        for (let k = 0; k < channels; k++) {
+          upsampled.set(r, c, k, values.get(vr, vc, k));
+        }
+      }
+    }
+  }
+  return upsampled;
+}
+
+/**
+ * Interpolate axis values at fractional index (extrapolating from ends)
+ * @param {NDT} axis - axis values
+ * @param {number} t - fractional index
+ * @returns {number} interpolated value
+ */
+function interpolateAxis(axis: NDT, t: number): number {
+  if (axis.size < 2) {
+    return axis.get(0);
+  }
+  const i = Math.min(Math.max(Math.floor(t), 0), axis.size - 2);
+  const a = axis.get(i);
+  return a + (t - i) * (axis.get(i + 1) - a);
+}
+
+/**
+ * Create axis values for a level of an image pyramid
+ *
+ * Without overview axis values, the axis values are the edges of pixels in
+ * full resolution pixels so finer levels keep the same coordinates
+ * @param {number} size - number of pixels along axis of full resolution image
+ * @param {number} level - level of pyramid
+ * @param {NDT} [axis] - axis values (pixel edges or centres) of overview
+ * @param {number} [overviewLevel] - level of overview
+ * @returns {NDT} axis values of level
+ */
+function pyramidAxis(
+  size: number,
+  level: number,
+  axis?: NDT,
+  overviewLevel = level
+): NDT {
+  const factor = 2 ** level;
+  const pixels = Math.ceil(size / factor);
+  if (axis === undefined) {
+    const edges = new Float64Array(pixels + 1);
+    for (let i = 0; i <= pixels; i++) {
+      edges[i] = Math.min(i * factor, size);
+    }
+    return ndarray(edges);
+  }
+  const ratio = 2 ** (overviewLevel - level);
+  if (ratio === 1) {
+    return axis;
+  }
+  const isEdges = axis.size === Math.ceil(size / 2 ** overviewLevel) + 1;
+  const n = isEdges ? pixels + 1 : pixels;
+  const refined = new Float64Array(n);
+  for (let j = 0; j < n; j++) {
+    const t = isEdges ? j / ratio : (j + 0.5) / ratio - 0.5;
+    refined[j] = interpolateAxis(axis, t);
+  }
+  if (isEdges) {
+    refined[n - 1] = axis.get(axis.size - 1);
+  }
+  return ndarray(refined);
+}
+
+/**
+ * Find the full resolution pixels of an axis that are visible
+ * @param {Domain} visible - visible domain of axis
+ * @param {NDT} axis - axis values of image
+ * @param {number} size - number of pixels along axis of full resolution image
+ * @returns {[number, number]} start and stop of pixels
+ */
+function visiblePixels(
+  visible: Domain,
+  axis: NDT,
+  size: number
+): [number, number] {
+  const a0 = axis.get(0);
+  const scale = size / (axis.get(axis.size - 1) - a0 || 1);
+  const p0 = (visible[0] - a0) * scale;
+  const p1 = (visible[1] - a0) * scale;
+  const clamp = (p: number) => Math.min(Math.max(p, 0), size);
+  return [
+    clamp(Math.floor(Math.min(p0, p1))),
+    clamp(Math.ceil(Math.max(p0, p1))),
+  ];
+}
+
+/**
+ * Find the coarsest level of an image pyramid that has at least one pixel
+ * per screen pixel
+ * @param {number} levels - number of levels
+ * @param {Region} region - visible region in full resolution pixels
+ * @param {number} pixelWidth - width of canvas in screen pixels
+ * @param {number} pixelHeight - height of canvas in screen pixels
+ * @returns {number} level
+ */
+function pyramidLevel(
+  levels: number,
+  region: Region,
+  pixelWidth: number,
+  pixelHeight: number
+): number {
+  const [x0, y0, x1, y1] = region;
+  const ratio = Math.max(
+    (x1 - x0) / Math.max(pixelWidth, 1),
+    (y1 - y0) / Math.max(pixelHeight, 1)
+  );
+  const level = ratio > 1 ? Math.floor(Math.log2(ratio)) : 0;
+  return Math.min(level, levels - 1);
+}
+
+/**
+ * Check if a region contains another
+ * @param {Region} outer - region
+ * @param {Region} inner - other region
+ * @returns {boolean} true if other region is inside region
+ */
+function regionContains(outer: Region, inner: Region): boolean {
+  return (
+    outer[0] <= inner[0] &&
+    outer[1] <= inner[1] &&
+    outer[2] >= inner[2] &&
+    outer[3] >= inner[3]
+  );
+}
+
 function createSurfaceData(data: CSurfaceData): SurfaceData {
   const ii = data.heightValues;
   const i = createNdArray(ii);
@@ -600,18 +892,23 @@ enum InteractionModeType {
 
 export {
   appendLineData,
+  cacheRecent,
   calculateMultiXDomain,
   calculateMultiYDomain,
   createPlotConfig,
   createLineData,
   createImageData,
+  createNdArray,
   createScatterData,
   createSurfaceData,
   createTableData,
   calculateHistogramCounts,
+  decodeNdArrayExt,
+  extensionCodec,
   createHistogramParams,
   createInteractionsConfig,
   getAspectType,
+  getRecent,
   InteractionModeType,
   isHeatmapData,
   isNumber,
@@ -620,6 +917,13 @@ export {
   isValidPositiveNumber,
   measureInteraction,
   nanMinMax,
+  patchImageValues,
+  pyramidAxis,
+  pyramidLevel,
+  regionContains,
+  unionDomains,
+  upsampleImageValues,
+  visiblePixels,
 };
 
 export type {
@@ -632,4 +936,6 @@ export type {
   CTableData,
   HistogramCounts,
   MP_NDArray,
+  PyramidInfo,
+  Region,
 };
@@ -3,21 +3,35 @@ from __future__ import annotations
 import logging
 import os
 import pathlib
+from contextlib import asynccontextmanager
 
 import uvicorn
-from fastapi import FastAPI, WebSocket
+from fastapi import FastAPI, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware  # comment this on deployment
 from fastapi.openapi.utils import get_openapi
 from fastapi.staticfiles import StaticFiles
-from pydantic import TypeAdapter
+from pydantic import TypeAdapter, ValidationError
 
 from davidia import __version__
 
-from davidia.models.messages import EndPointMessage
+from davidia.models.messages import BatchMessage, EndPointMessage
 from davidia.models.selections import AnySelection
 from davidia.server.benchmarks import BenchmarkParams
-from davidia.server.fastapi_utils import message_unpack
-from davidia.server.plotserver import PlotServer, handle_client
+from davidia.server.compression import Compression
+from davidia.server.derivations import Derivation
+from davidia.server.fastapi_utils import ArrayFormat, message_unpack
+from davidia.server.monitoring import LoopLagMonitor, LoopLagStats
+from davidia.server.reductions import Reduction
+from davidia.server.roi import RoiStats
+from davidia.server.plotserver import (
+    PlotServer,
+    decode_end_point_message,
+    handle_client,
+    handle_producer,
+    handle_region_subscriber,
+)
+from davidia.server.shared import SharedBlocks
+from davidia.server.queues import QueuePolicy, QueueStats
 
 logger = logging.getLogger("main")
 
@@ -30,8 +44,22 @@ _EP_SCHEMA = _epta.json_schema(
 _EP_NESTED_MODELS = _EP_SCHEMA.pop("$defs")
 
 
-def _create_bare_app(add_benchmark=False):
-    app = FastAPI()
+def _create_bare_app(
+    add_benchmark=False,
+    queue_policy: QueuePolicy | None = None,
+    data_dir: pathlib.Path | None = None,
+    shared_memory: bool = False,
+):
+    loop_lag = LoopLagMonitor()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        loop_lag.start()
+        yield
+        await loop_lag.stop()
+        ps.reducer.shutdown()
+
+    app = FastAPI(lifespan=lifespan)
 
     def customize_openapi():
         if app.openapi_schema:
@@ -49,17 +77,54 @@ def _create_bare_app(add_benchmark=False):
     app.add_middleware(
         CORSMiddleware, allow_origins=origins
     )  # comment this on deployment
-    ps = PlotServer()
+    ps = PlotServer(queue_policy)
     setattr(app, "_plot_server", ps)
+    setattr(app, "_loop_lag", loop_lag)
 
     @app.websocket("/plot/{uuid}/{plot_id}")
-    async def websocket(websocket: WebSocket, uuid: str, plot_id: str):
+    async def websocket(
+        websocket: WebSocket,
+        uuid: str,
+        plot_id: str,
+        arrays: ArrayFormat = ArrayFormat.dict,
+        compression: Compression = Compression.none,
+        tiles: bool = False,
+    ):
         """End point for plot server to web UI communication.
 
-        PlotMessages are passed between client/server
+        PlotMessages are passed between client/server. Clients that can view
+        aligned array buffers can request the ext array format with
+        ?arrays=ext and non-browser clients can request compression of large
+        messages with ?compression=lz4 (or zstd). Clients that request tiles
+        of large images with ?tiles=true are sent overviews of image pyramids
+        instead of full resolution images
+        """
+        if compression != Compression.none and "origin" in websocket.headers:
+            # browsers (which send an origin) cannot decompress messages
+            logger.warning("Ignoring %s compression for browser client", compression)
+            compression = Compression.none
+        await websocket.accept()
+        await handle_client(ps, plot_id, websocket, uuid, arrays, compression, tiles)
+
+    @app.websocket("/push/{plot_id}")
+    async def push(websocket: WebSocket, plot_id: str, ack: bool = False):
+        """End point for streaming data to plot.
+
+        Producers send a stream of packed EndPointMessages which are acknowledged
+        with PushAckMessages if ?ack=true
+        """
+        await websocket.accept()
+        await handle_producer(ps, plot_id, websocket, ack)
+
+    @app.websocket("/regions/{plot_id}")
+    async def regions(websocket: WebSocket, plot_id: str):
+        """End point for subscribing to regions of plot.
+
+        A packed SelectionsMessage of all current regions is sent when
+        subscribed and whenever regions change
         """
         await websocket.accept()
-        await handle_client(ps, plot_id, websocket, uuid)
+        await handle_region_subscriber(ps, plot_id, websocket)
 
     @app.post(
         "/push_data",
@@ -85,9 +150,48 @@ def _create_bare_app(add_benchmark=False):
             logger.error("No data posted!")
             return "None"
         await ps.update(data)
-        await ps.send_next_message()
         return "data sent"
 
+    @app.post("/push_shared")
+    async def push_shared(request: Request) -> str:
+        """
+        Push data whose arrays are in shared memory or .npy files to plot
+
+        The body is a packed EndPointMessage whose large arrays reference
+        shared memory blocks created by a producer on the same host. The plot
+        server takes ownership of the blocks and unlinks them when the plot's
+        data is replaced. Arrays can also reference .npy files in the server's
+        data directory, which are memory-mapped. Each kind of reference must
+        be enabled when the server is started
+        """
+        if not shared_memory and data_dir is None:
+            raise HTTPException(status_code=403, detail="Shared data is not enabled")
+        shared = SharedBlocks(shared_memory)
+        try:
+            data = decode_end_point_message(await request.body(), shared, data_dir)
+        except (ValueError, ValidationError) as e:
+            shared.release()
+            logger.warning("Could not use shared data", exc_info=True)
+            raise HTTPException(status_code=400, detail=str(e)) from e
+        await ps.update(data, shared)
+        return "data sent"
+
+    @app.post("/push_batch")
+    @message_unpack
+    async def push_batch(data: BatchMessage) -> str:
+        """
+        Push batch of data to plots
+
+        Parameters
+        ----------
+        data - batch of plot data for one or more plots
+        """
+        if data is None:
+            logger.error("No batch posted!")
+            return "None"
+        await ps.update_batch(data.messages)
+        return f"{len(data.messages)} messages sent"
+
     @app.put("/clear_data/{plot_id}")
     async def clear_data(plot_id: str) -> str:
         """
@@ -100,6 +204,36 @@ def _create_bare_app(add_benchmark=False):
         await ps.clear_plots_and_queues(plot_id)
         return "data cleared"
 
+    @app.put("/select_frame/{plot_id}")
+    async def select_frame(plot_id: str, frame: int) -> str:
+        """
+        Show frame of image stack in plot with ID
+
+        Parameters
+        ----------
+        plot_id - ID of plot
+        frame - index of frame
+        """
+        await ps.select_frame(plot_id, frame)
+        return "frame selected"
+
+    @app.put("/reduce_stack/{plot_id}")
+    async def reduce_stack(plot_id: str, reduction: Reduction, target: str) -> str:
+        """
+        Reduce image stack in plot with ID over its frames and show result
+
+        Parameters
+        ----------
+        plot_id - ID of plot with image stack
+        reduction - reduction of frames (sum, mean, max or min)
+        target - ID of plot to show reduced image
+        """
+        try:
+            await ps.reduce_stack(plot_id, reduction, target)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e)) from e
+        return "stack reduced"
+
     @app.get("/get_plot_ids")
     def get_plot_ids() -> list[str]:
         """
@@ -111,6 +245,35 @@ def _create_bare_app(add_benchmark=False):
         """
         return ps.get_plot_ids()
 
+    @app.get("/get_queue_stats")
+    def get_queue_stats() -> list[QueueStats]:
+        """
+        Get statistics of queues of messages to clients
+
+        Returns
+        -------
+        List of queue statistics
+        """
+        return ps.get_queue_stats()
+
+    @app.get("/get_loop_lag")
+    def get_loop_lag(reset: bool = False) -> LoopLagStats:
+        """
+        Get statistics of how long event loop has been blocked
+
+        Parameters
+        ----------
+        reset - reset statistics after getting them
+
+        Returns
+        -------
+        Event loop lag statistics
+        """
+        stats = loop_lag.stats
+        if reset:
+            loop_lag.reset()
+        return stats
+
     @app.get("/get_regions/{plot_id}")
     async def get_regions(plot_id: str) -> list[AnySelection]:
         """
@@ -122,6 +285,61 @@ def _create_bare_app(add_benchmark=False):
         """
         return await ps.get_regions(plot_id)
 
+    @app.get("/get_roi_stats/{plot_id}")
+    async def get_roi_stats(
+        plot_id: str, selection_id: str | None = None
+    ) -> list[RoiStats]:
+        """
+        Get statistics of heatmap or scatter data in regions
+
+        Parameters
+        ----------
+        plot_id - ID of plot
+        selection_id - ID of region (if not given, all regions)
+
+        Returns
+        -------
+        List of statistics for each region
+        """
+        try:
+            return await ps.get_roi_stats(plot_id, selection_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e)) from e
+
+    @app.post("/add_derivation")
+    @message_unpack
+    async def add_derivation(derivation: Derivation) -> str:
+        """
+        Add line derived from region of plot that is shown in target plot
+
+        Parameters
+        ----------
+        derivation - plot and region, type of derived data and target plot
+
+        Returns
+        -------
+        ID of derivation
+        """
+        if derivation is None:
+            raise HTTPException(status_code=400, detail="Invalid derivation")
+        try:
+            return await ps.add_derivation(derivation)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e)) from e
+
+    @app.put("/remove_derivation/{derivation_id}")
+    async def remove_derivation(derivation_id: str) -> str:
+        """
+        Remove derivation and its line
+
+        Parameters
+        ----------
+        derivation_id - ID of derivation
+        """
+        if not await ps.remove_derivation(derivation_id):
+            raise HTTPException(status_code=404, detail="Derivation not found")
+        return "derivation removed"
+
     if add_benchmark:
 
         @app.post("/benchmark/{plot_id}")
@@ -197,13 +415,46 @@ def create_parser():
     parser.add_argument(
         "-P", "--port", help="Set the port number for server", type=int, default=80
     )
+    parser.add_argument(
+        "-q",
+        "--queue-size",
+        help="Set the maximum number of messages queued for each client (0 for no limit)",
+        type=int,
+        default=QueuePolicy().max_size,
+    )
+    parser.add_argument(
+        "--no-coalesce",
+        help="Do not replace queued data messages with newer ones",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-d",
+        "--data-dir",
+        help="Allow pushed data to reference .npy files in given directory",
+        default=None,
+    )
+    parser.add_argument(
+        "-s",
+        "--shared-memory",
+        help="Allow pushed data to reference shared memory blocks on this host",
+        action="store_true",
+    )
     return parser
 
 
-def create_app(client_path=CLIENT_BUILD_PATH, benchmark=False):
+def create_app(
+    client_path=CLIENT_BUILD_PATH,
+    benchmark=False,
+    queue_policy: QueuePolicy | None = None,
+    data_dir: pathlib.Path | None = None,
+    shared_memory: bool = False,
+):
     _setup_logger()
     app = _create_bare_app(
-        benchmark or os.getenv("DVD_BENCHMARK", "off").lower() == "on"
+        benchmark or os.getenv("DVD_BENCHMARK", "off").lower() == "on",
+        queue_policy,
+        data_dir,
+        shared_memory,
     )
     if client_path:
         if client_path.is_dir():
@@ -211,8 +462,22 @@ def create_app(client_path=CLIENT_BUILD_PATH, benchmark=False):
     return app
 
 
-def run_app(client_path=CLIENT_BUILD_PATH, benchmark=False, host="127.0.0.1", port=80):
-    app = create_app(client_path=client_path, benchmark=benchmark)
+def run_app(
+    client_path=CLIENT_BUILD_PATH,
+    benchmark=False,
+    host="127.0.0.1",
+    port=80,
+    queue_policy: QueuePolicy | None = None,
+    data_dir: pathlib.Path | None = None,
+    shared_memory: bool = False,
+):
+    app = create_app(
+        client_path=client_path,
+        benchmark=benchmark,
+        queue_policy=queue_policy,
+        data_dir=data_dir,
+        shared_memory=shared_memory,
+    )
     uvicorn.run(app, host=host, port=port, log_level="info", access_log=False)
 
 
@@ -224,6 +489,11 @@ def main():
         benchmark=args.benchmark,
         host=args.host,
         port=args.port,
+        queue_policy=QueuePolicy(
+            max_size=args.queue_size, coalesce=not args.no_coalesce
+        ),
+        data_dir=pathlib.Path(args.data_dir) if args.data_dir else None,
+        shared_memory=args.shared_memory,
     )
 
 
@@ -151,10 +151,19 @@ class ImageData(DvDNpModel):
 
     values: DvDNDArray
     aspect: Aspect | float | int | None = None
+    tile_size: int | None = None
+    "An optional parameter which if given makes the plot server build a multi-resolution pyramid of tiles of this size"
     model_config = ConfigDict(
         extra="forbid"
     )  # need this to prevent any dict validating as all fields have default values
 
+    @field_validator("tile_size")
+    @classmethod
+    def tile_size_is_positive(cls, v: int | None) -> int | None:
+        if v is not None and v < 1:
+            raise ValueError("tile_size must be positive", v)
+        return v
+
 
 def validate_colour_map(v: ColourMap | str) -> ColourMap:
     if isinstance(v, str):
@@ -276,16 +285,215 @@ class MultiLineMessage(_PlotDataMessage):
         )
 
 
+class UpdateLinesMessage(DvDNpModel, _BasePlotMessage):
+    """
+    Class for representing an update of lines in a multi-line plot by key
+
+    Attributes
+    ----------
+    update_lines : list[LineData]
+        Lines that replace (or are appended to) current lines with the same key
+        or else are added
+    append : bool
+        Append points of lines to current lines
+    """
+
+    update_lines: list[LineData]
+    append: bool = False
+
+
+class ClearLinesMessage(_BasePlotMessage):
+    """
+    Class for representing a removal of lines from a multi-line plot
+
+    Attributes
+    ----------
+    line_keys : list[str]
+        Keys of lines to remove
+    """
+
+    line_keys: list[str]
+
+
 class ScatterMessage(_PlotDataMessage):
     """Class for representing a scatter message."""
 
     sc_data: ScatterData
 
 
+class PyramidInfo(DvDModel):
+    """
+    Class for representing a tiled multi-resolution image
+
+    Attributes
+    ----------
+    shape : tuple[int, int]
+        Number of rows and columns of full resolution image
+    levels : int
+        Number of levels where level 0 is full resolution and each level is
+        half the size of the previous level
+    level : int
+        Level of image values in message
+    """
+
+    shape: tuple[int, int]
+    levels: int
+    level: int
+
+
+class StackInfo(DvDModel):
+    """
+    Class for representing a stack of images of which one frame is shown
+
+    Attributes
+    ----------
+    stack_id : str
+        ID of stack (clients keep frames of a stack until it changes)
+    frames : int
+        Number of frames
+    frame : int
+        Index of frame shown
+    """
+
+    stack_id: str
+    frames: int
+    frame: int
+
+
 class ImageMessage(_PlotDataMessage):
     """Class for representing an image message."""
 
     im_data: ImageData | HeatmapData
+    pyramid: PyramidInfo | None = None
+    stack: StackInfo | None = None
+
+
+class ImageStackMessage(_PlotDataMessage):
+    """
+    Class for representing a stack of images that are shown one frame at a time
+
+    Attributes
+    ----------
+    stack_data : ImageData | HeatmapData
+        Data whose values have frames as their first dimension
+    frame : int
+        Index of frame to show
+    """
+
+    stack_data: ImageData | HeatmapData
+    frame: int = 0
+
+
+class ImageFrameMessage(DvDNpModel, _BasePlotMessage):
+    """
+    Class for representing values of a frame of an image stack for clients to keep
+
+    Attributes
+    ----------
+    stack_id : str
+        ID of stack
+    frame : int
+        Index of frame
+    frame_values : DvDNDArray
+        Values of frame
+    """
+
+    stack_id: str
+    frame: int
+    frame_values: DvDNDArray
+
+
+class StackFrameMessage(_BasePlotMessage):
+    """
+    Class for representing a change of frame of an image stack shown by clients
+
+    Attributes
+    ----------
+    stack_id : str
+        ID of stack
+    frame : int
+        Index of frame to show (its values are sent before)
+    """
+
+    stack_id: str
+    frame: int
+
+
+class ImageTileMessage(DvDNpModel, _BasePlotMessage):
+    """
+    Class for representing a tile of a level of a multi-resolution image
+
+    Attributes
+    ----------
+    level : int
+        Level of tile
+    offset : tuple[int, int]
+        Column and row of tile's first pixel in level
+    tile_values : DvDNDArray
+        Values of tile
+    """
+
+    level: int
+    offset: tuple[int, int]
+    tile_values: DvDNDArray
+
+
+class LineParamsMessage(_BasePlotMessage):
+    """
+    Class for representing an update of the parameters of a line
+
+    Clients patch the line with the key in their current data
+
+    Attributes
+    ----------
+    plot_id : str
+        ID of plot
+    key : str
+        Key of line
+    line_params : LineParams
+        New parameters of line
+    """
+
+    plot_id: str
+    key: str
+    line_params: LineParams
+
+
+class ScatterParamsMessage(_BasePlotMessage):
+    """
+    Class for representing an update of the parameters of scatter data
+
+    Clients patch their current scatter data
+
+    Attributes
+    ----------
+    plot_id : str
+        ID of plot
+    point_size : Float
+        New size of points
+    """
+
+    plot_id: str
+    point_size: Float
+
+
+class ImagePatchMessage(DvDNpModel, _BasePlotMessage):
+    """
+    Class for representing a patch of values written into a plot's image
+
+    Attributes
+    ----------
+    offset : tuple[int, int]
+        Column and row of patch's first pixel in image
+    patch_values : DvDNDArray
+        Values of patch
+    domain : FloatTuple | None
+        New domain of heatmap (None to keep current domain)
+    """
+
+    offset: tuple[int, int]
+    patch_values: DvDNDArray
+    domain: FloatTuple | None = None
 
 
 class SurfaceMessage(_PlotDataMessage):
@@ -348,10 +556,75 @@ class ClientScatterParametersMessage(DvDModel):
     point_size: Float
 
 
+class ClientViewportMessage(DvDModel):
+    """Class for representing the viewport of a client's line plot
+
+    Attributes
+    ----------
+    pixel_width : int
+        Width of plot in pixels
+    x_range : FloatTuple | None
+        Visible range of x axis (None for all)
+    """
+
+    pixel_width: int
+    x_range: FloatTuple | None = None
+
+
+class ClientFrameMessage(DvDModel):
+    """
+    Class for representing a client's selection of frame of an image stack
+
+    Attributes
+    ----------
+    frame : int
+        Index of frame
+    """
+
+    frame: int
+
+
+class ClientTilesRequestMessage(DvDModel):
+    """
+    Class for representing a client request for tiles of a multi-resolution image
+
+    Attributes
+    ----------
+    level : int
+        Level of tiles
+    region : tuple[int, int, int, int] | None
+        Columns and rows (start and stop) of region in full resolution pixels
+        (None for whole image)
+    """
+
+    level: int
+    region: tuple[int, int, int, int] | None = None
+
+
+class PushAckMessage(DvDModel):
+    """
+    Class for representing an acknowledgement of a message pushed by a producer
+
+    Attributes
+    ----------
+    ack : int
+        Number of messages received in stream
+    error : str | None
+        Error if message could not be used
+    """
+
+    ack: int
+    error: str | None = None
+
+
 EndPointMessage = (
     MultiLineMessage
+    | UpdateLinesMessage
+    | ClearLinesMessage
     | ScatterMessage
     | ImageMessage
+    | ImageStackMessage
+    | ImagePatchMessage
     | SurfaceMessage
     | TableMessage
     | SelectionsMessage
@@ -359,11 +632,27 @@ EndPointMessage = (
 )
 
 
+class BatchMessage(DvDModel):
+    """
+    Class for representing a batch of end point messages for one or more plots
+
+    Attributes
+    ----------
+    messages : list[EndPointMessage]
+        Messages applied in order for each plot
+    """
+
+    messages: list[EndPointMessage]
+
+
 ClientMessage = (
     ClientStatusMessage
     | ClientSelectionMessage
     | ClientLineParametersMessage
     | ClientScatterParametersMessage
+    | ClientViewportMessage
+    | ClientTilesRequestMessage
+    | ClientFrameMessage
     | ClearSelectionsMessage
     | BatonRequestMessage
     | BatonDonateMessage
@@ -372,8 +661,17 @@ ClientMessage = (
 
 ALL_MESSAGES = (
     MultiLineMessage,
+    UpdateLinesMessage,
+    ClearLinesMessage,
     ScatterMessage,
     ImageMessage,
+    ImageStackMessage,
+    ImageFrameMessage,
+    StackFrameMessage,
+    ImageTileMessage,
+    ImagePatchMessage,
+    LineParamsMessage,
+    ScatterParamsMessage,
     SurfaceMessage,
     TableMessage,
     BatonMessage,
@@ -385,7 +683,12 @@ ALL_MESSAGES = (
     ClientSelectionMessage,
     ClientLineParametersMessage,
     ClientScatterParametersMessage,
+    ClientViewportMessage,
+    ClientTilesRequestMessage,
+    ClientFrameMessage,
     ClearPlotMessage,
+    PushAckMessage,
+    BatchMessage,
 )
 
 ALL_MODELS = (
@@ -397,6 +700,8 @@ ALL_MODELS = (
     SurfaceData,
     TableData,
     PlotConfig,
+    PyramidInfo,
+    StackInfo,
 ) + ALL_MESSAGES
 
 if __name__ == "__main__":
@@ -3,12 +3,18 @@
 
 All points are [x,y]
 All angles in radians
+
+Selections can check which points they contain and make masks of images in
+a vectorized way. Points within a tolerance of lines (and open polygons)
+are contained by those selections
 """
 
 import logging
 from math import atan2, cos, degrees, hypot, pi, radians, sin
 from uuid import uuid4
 
+import numpy as np
+from numpy.typing import ArrayLike
 from pydantic import (
     BeforeValidator,
     ConfigDict,
@@ -45,6 +51,49 @@ def _make_tuple_floats(v: tuple[Number, Number]) -> tuple[float, float]:
 
 FloatTuple = Annotated[tuple[float, float], BeforeValidator(_make_tuple_floats)]
 
+LINE_TOLERANCE = 0.5
+"""Default distance from lines within which points are contained"""
+
+
+def pixel_centres(values: ArrayLike | None, n: int) -> np.ndarray:
+    """Get coordinates of centres of n pixels from axis values
+
+    Values can be the n centres or n+1 edges of pixels. If None, the edges are
+    0 to n
+    """
+    if values is None:
+        return np.arange(n) + 0.5
+    v = np.asarray(values, dtype=np.float64).ravel()
+    if v.size == n + 1:
+        return 0.5 * (v[:-1] + v[1:])
+    if v.size != n:
+        raise ValueError(f"Axis values must have {n} or {n + 1} items: {v.size}")
+    return v
+
+
+def _near_segments(
+    x: np.ndarray, y: np.ndarray, points: list[tuple[float, float]], tolerance: float
+) -> np.ndarray:
+    """Check which points are within tolerance of line segments joining points"""
+    if len(points) == 1:
+        points = points * 2
+    t2 = tolerance * tolerance
+    near = np.zeros(np.broadcast_shapes(x.shape, y.shape), dtype=bool)
+    for (x0, y0), (x1, y1) in zip(points[:-1], points[1:]):
+        dx = x1 - x0
+        dy = y1 - y0
+        l2 = dx * dx + dy * dy
+        px = x - x0
+        py = y - y0
+        if l2 == 0:
+            near |= px * px + py * py <= t2
+            continue
+        t = np.clip((px * dx + py * dy) / l2, 0, 1)
+        ex = px - t * dx
+        ey = py - t * dy
+        near |= ex * ex + ey * ey <= t2
+    return near
+
 
 class SelectionBase(DvDModel, validate_assignment=True):
     """Base class for representing any selection"""
@@ -60,6 +109,72 @@ class SelectionBase(DvDModel, validate_assignment=True):
     fixed: bool = True
     start: FloatTuple
 
+    def contains(
+        self, points: ArrayLike, tolerance: float = LINE_TOLERANCE
+    ) -> np.ndarray:
+        """Check which points are in selection
+
+        Parameters
+        ----------
+        points : ArrayLike
+            array of [x, y] points with shape (..., 2)
+        tolerance : float
+            distance from lines within which points are contained
+
+        Returns
+        -------
+        boolean array with shape (...)
+        """
+        p = np.asarray(points, dtype=np.float64)
+        if p.ndim == 0 or p.shape[-1] != 2:
+            raise ValueError(f"Points must have shape (..., 2): {p.shape}")
+        x = p[..., 0]
+        return np.broadcast_to(self._contains(x, p[..., 1], tolerance), x.shape)
+
+    def mask(
+        self,
+        shape: tuple[int, ...],
+        x_values: ArrayLike | None = None,
+        y_values: ArrayLike | None = None,
+    ) -> np.ndarray:
+        """Make mask of image pixels whose centres are in selection
+
+        Parameters
+        ----------
+        shape : tuple[int, ...]
+            shape of image (rows and columns)
+        x_values : ArrayLike | None
+            centres or edges of columns (if None, edges are 0 to number of columns)
+        y_values : ArrayLike | None
+            centres or edges of rows (if None, edges are 0 to number of rows)
+
+        Returns
+        -------
+        boolean array of rows and columns
+        """
+        rows, cols = shape[:2]
+        x = pixel_centres(x_values, cols)
+        y = pixel_centres(y_values, rows)
+        steps = [np.abs(np.diff(v)).max() for v in (x, y) if v.size > 1]
+        tolerance = 0.5 * max(steps) if steps else LINE_TOLERANCE
+        m = self._contains(x[np.newaxis, :], y[:, np.newaxis], tolerance)
+        if m.shape == (rows, cols):
+            return m
+        return np.broadcast_to(m, (rows, cols)).copy()
+
+    def _contains(self, x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+        raise NotImplementedError(f"{type(self).__name__} cannot contain points")
+
+    def _local(self, x: np.ndarray, y: np.ndarray, angle: float = 0.0):
+        """Get coordinates relative to start in frame rotated by angle"""
+        dx = x - self.start[0]
+        dy = y - self.start[1]
+        if angle == 0:
+            return dx, dy
+        c = cos(angle)
+        s = sin(angle)
+        return c * dx + s * dy, c * dy - s * dx
+
 
 #    @property  # make read-only by omitting setter
 #    def id(self):
@@ -90,6 +205,12 @@ class AxialSelection(SelectionBase):
 
     end = property(_end_get, _end_set)
 
+    def _contains(self, x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+        d = self.dimension
+        c = x if d == 0 else y
+        s = self.start[d]
+        return (c >= s) & (c <= s + self.length)
+
 
 class OrientableSelection(SelectionBase):
     """Base class for representing any orientable selection"""
@@ -136,6 +257,12 @@ class LinearSelection(OrientableSelection):
         self.angle = atan2(dy, dx)
         self.length = hypot(dx, dy)
 
+    def _contains(self, x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+        sx, sy = self.start
+        ll = self.length
+        end = (sx + cos(self.angle) * ll, sy + sin(self.angle) * ll)
+        return _near_segments(x, y, [self.start, end], tolerance)
+
 
 class RectangularSelection(OrientableSelection):
     """Class for representing the selection of a rectangle"""
@@ -164,6 +291,16 @@ class RectangularSelection(OrientableSelection):
         s = sin(a)
         self.lengths = c * dx + s * dy, -s * dx + c * dy
 
+    def _contains(self, x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+        u, v = self._local(x, y, self.angle)
+        lx, ly = self.lengths
+        return (
+            (u >= min(lx, 0))
+            & (u <= max(lx, 0))
+            & (v >= min(ly, 0))
+            & (v <= max(ly, 0))
+        )
+
 
 class PolygonalSelection(SelectionBase):
     """Class for representing the selection of a polygon"""
@@ -176,6 +313,7 @@ class PolygonalSelection(SelectionBase):
     def check_start_and_points(cls, values: Any) -> Any:
         if not isinstance(values, dict):
             return values
+        values = dict(values)  # input is shared with other members of unions
 
         # Note start is ignored and duplicated from first point
         start = values.get("start", None)
@@ -201,6 +339,18 @@ class PolygonalSelection(SelectionBase):
             logging.warning("Overwriting start with first point")
         return self
 
+    def _contains(self, x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+        points = self.points
+        if not self.closed or len(points) < 3:
+            return _near_segments(x, y, points, tolerance)
+        inside = np.zeros(np.broadcast_shapes(x.shape, y.shape), dtype=bool)
+        for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]):
+            if y0 == y1:
+                continue
+            crosses = (y0 > y) != (y1 > y)
+            inside ^= crosses & (x < x0 + (y - y0) * ((x1 - x0) / (y1 - y0)))
+        return inside
+
 
 class EllipticalSelection(OrientableSelection):
     """Class for representing the selection of an ellipse"""
@@ -210,12 +360,26 @@ class EllipticalSelection(OrientableSelection):
     def __init__(self, degrees=None, **data):  # for pyright
         super().__init__(degrees=degrees, **data)
 
+    def _contains(self, x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+        u, v = self._local(x, y, self.angle)
+        a, b = self.semi_axes
+        if a == 0 or b == 0:
+            return np.zeros(np.broadcast_shapes(u.shape, v.shape), dtype=bool)
+        u = u / a
+        v = v / b
+        return u * u + v * v <= 1
+
 
 class CircularSelection(SelectionBase):
     """Class for representing the selection of a circle"""
 
     radius: Float
 
+    def _contains(self, x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+        u, v = self._local(x, y)
+        r = self.radius
+        return u * u + v * v <= r * r
+
 
 class CircularSectorialSelection(SelectionBase):
     """Class for representing the selection of a circular sector"""
@@ -240,6 +404,17 @@ class CircularSectorialSelection(SelectionBase):
         """Set angles in degrees"""
         self.angles = (radians(degrees[0]), radians(degrees[1]))
 
+    def _contains(self, x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+        u, v = self._local(x, y)
+        r2 = u * u + v * v
+        r0, r1 = self.radii
+        inside = (r2 >= r0 * r0) & (r2 <= r1 * r1)
+        a0, a1 = self.angles
+        span = a1 - a0
+        if span >= 2 * pi:
+            return inside
+        return inside & (np.mod(np.arctan2(v, u) - a0, 2 * pi) <= span)
+
 
 AnySelection = (
     AxialSelection
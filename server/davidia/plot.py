@@ -1,15 +1,28 @@
 from __future__ import annotations
 
+import atexit
 import logging
+import threading
 import warnings
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
 from time import time_ns
+from collections.abc import Callable
 from typing import Any
 
+import httpx
 import numpy as np
 from numpy.typing import ArrayLike
 import requests
+from requests.adapters import HTTPAdapter
+from websockets.exceptions import ConnectionClosed
+from websockets.sync.client import ClientConnection, connect
 
 from davidia.models.messages import (
+    BatchMessage,
+    ClearLinesMessage,
     ClearSelectionsMessage,
     ColourMap,
     GlyphType,
@@ -25,8 +38,12 @@ from davidia.models.messages import (
     MultiLineMessage,
     ScatterMessage,
     ImageMessage,
+    ImagePatchMessage,
+    ImageStackMessage,
     SurfaceMessage,
     TableMessage,
+    PushAckMessage,
+    UpdateLinesMessage,
 )
 
 from davidia.models.parameters import PlotConfig, TableDisplayParams, TableDisplayType
@@ -40,21 +57,196 @@ from davidia.models.selections import (
     PolygonalSelection,
     RectangularSelection,
 )
-from davidia.server.fastapi_utils import j_dumps, j_loads, ws_pack
+from davidia.server.fastapi_utils import j_dumps, j_loads, ws_pack, ws_unpack
+from davidia.server.derivations import Derivation, DerivationType
+from davidia.server.reductions import Reduction
+from davidia.server.roi import RoiStats
+from davidia.server.shared import discard_blocks, npy_file, pack_shared
 
 OptionalArrayLike = ArrayLike | None
 OptionalLists = OptionalArrayLike | list[OptionalArrayLike] | None
 
 Selections = AnySelection | list[AnySelection]
 
+DEFAULT_POOL_SIZE = 10
+"""Default maximum number of kept-alive connections to a plot server"""
+
+DEFAULT_TIMEOUT = (3.05, 30.0)
+"""Default timeouts in seconds to connect to and read from a plot server"""
+
+EXIT_FLUSH_TIMEOUT = 10.0
+"""Maximum time in seconds to wait at exit for data queued in background"""
+
+_SESSIONS: dict[tuple[str, int], requests.Session] = dict()
+
+
+def _get_session(host: str, port: int, pool_size: int) -> requests.Session:
+    """Get HTTP session shared by all connections to plot server
+
+    The session keeps connections alive so they are reused across requests;
+    its pool size is set by the first connection to the server
+    """
+    key = (host, port)
+    session = _SESSIONS.get(key)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount(f"http://{host}:{port}/", adapter)
+        _SESSIONS[key] = session
+    return session
+
+
+RegionCallback = Callable[[list[AnySelection]], None]
+
+
+class RegionSubscription:
+    """A subscription to regions of selection on a plot
+
+    The plot server sends all regions when subscribed and whenever they
+    change. These are received in a background thread which calls the
+    callback (if any) with the list of regions. Use close (or a with block)
+    to end the subscription.
+
+    Parameters
+    ----------
+    url : str
+        URL of plot server's region end point
+    callback : RegionCallback | None
+        function called with regions whenever they change
+    """
+
+    def __init__(self, url: str, callback: RegionCallback | None = None):
+        self.callback = callback
+        self.regions: list[AnySelection] | None = None
+        self._changed = threading.Condition()
+        self._closed = False
+        self._websocket = connect(url)
+        self._thread = threading.Thread(
+            target=self._receive, name="region subscription", daemon=True
+        )
+        self._thread.start()
+
+    def _receive(self):
+        try:
+            while True:
+                msg = SelectionsMessage.model_validate(
+                    ws_unpack(self._websocket.recv())
+                )
+                regions = msg.set_selections
+                with self._changed:
+                    self.regions = regions
+                    self._changed.notify_all()
+                if self.callback is not None:
+                    try:
+                        self.callback(regions)
+                    except Exception:
+                        logging.exception("Region callback failed")
+        except ConnectionClosed:
+            logging.debug("Region subscription closed")
+        finally:
+            with self._changed:
+                self._closed = True
+                self._changed.notify_all()
+
+    def wait(
+        self,
+        predicate: Callable[[list[AnySelection]], bool] = bool,
+        timeout: float | None = None,
+    ) -> list[AnySelection] | None:
+        """Wait for regions that satisfy predicate
+
+        Parameters
+        ----------
+        predicate : Callable[[list[AnySelection]], bool]
+            check of regions (by default, that there are any)
+        timeout : float | None
+            maximum time in seconds to wait (None to wait until satisfied)
+
+        Returns
+        -------
+        regions or None if timed out or subscription closed
+        """
+
+        def _done() -> bool:
+            regions = self.regions
+            return self._closed or (regions is not None and predicate(regions))
+
+        with self._changed:
+            self._changed.wait_for(_done, timeout)
+            regions = self.regions
+            if regions is not None and predicate(regions):
+                return regions
+            return None
+
+    def close(self):
+        """End subscription"""
+        self._websocket.close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 
 class PlotConnection:
-    def __init__(self, plot_id, host="localhost", port=8000, use_msgpack=True):
+    """A connection to a plot on a plot server
+
+    Parameters
+    ----------
+    plot_id : str
+        ID of plot
+    host : str
+        name or IP of plot server
+    port : int
+        port number of plot server
+    use_msgpack : bool
+        pack messages with MessagePack instead of JSON
+    stream : bool
+        push data over a websocket instead of a request per message
+    ack : bool
+        wait for server to acknowledge each message pushed over websocket
+    pool_size : int
+        maximum number of kept-alive connections in HTTP session shared by all
+        connections to plot server
+    timeout : float | tuple[float, float]
+        timeout in seconds (or connect and read timeouts) for requests
+    background : bool
+        queue data for a background thread to post so calls do not wait for
+        server (takes precedence over stream); use flush() to wait for data
+        to be sent
+    shared_memory : bool
+        put large arrays in shared memory blocks (and send views of .npy files
+        from npy_file as references) for plot server on same host that allows
+        them (not used in batches or background mode)
+    """
+
+    def __init__(
+        self,
+        plot_id,
+        host="localhost",
+        port=8000,
+        use_msgpack=True,
+        stream=False,
+        ack=True,
+        pool_size=DEFAULT_POOL_SIZE,
+        timeout: float | tuple[float, float] = DEFAULT_TIMEOUT,
+        background=False,
+        shared_memory=False,
+    ):
         self.plot_id = plot_id
         self.host = host
         self.port = port
         self.url_prefix = f"http://{host}:{port}/"
         self.use_msgpack = use_msgpack
+        self.stream = stream
+        self.ack = ack
+        self.background = background
+        self.shared_memory = shared_memory
+        self.timeout = timeout
+        self._session = _get_session(host, port, pool_size)
+        self._websocket: ClientConnection | None = None
 
     def _prepare_request(self, data):
         if data is None:
@@ -67,16 +259,104 @@ class PlotConnection:
         data = j_dumps(data)
         return data, None
 
+    def _connect(self) -> ClientConnection:
+        if self._websocket is None:
+            url = f"ws://{self.host}:{self.port}/push/{self.plot_id}"
+            if self.ack:
+                url += "?ack=true"
+            self._websocket = connect(url)
+        return self._websocket
+
+    def _push(self, data) -> PushAckMessage | None:
+        """Push data over websocket
+
+        Returns acknowledgement if waiting for it
+        """
+        start = time_ns()
+        packed = ws_pack(data) if self.use_msgpack else j_dumps(data).decode()
+        try:
+            ack = self._send(packed)
+        except ConnectionClosed:  # reconnect once as server may have restarted
+            self._websocket = None
+            ack = self._send(packed)
+        if ack is not None and ack.error:
+            logging.warning("plot_server.push failed: %s", ack.error)
+        elapsed = (time_ns() - start) // 1000000
+        logging.info("plot_server.push %dms", elapsed)
+        return ack
+
+    def _send(self, packed: bytes | str) -> PushAckMessage | None:
+        websocket = self._connect()
+        websocket.send(packed)
+        if not self.ack:
+            return None
+        reply = websocket.recv()
+        return PushAckMessage.model_validate(
+            ws_unpack(reply) if isinstance(reply, bytes) else j_loads(reply)
+        )
+
+    def close(self):
+        """Close websocket used to push data"""
+        if self._websocket is not None:
+            self._websocket.close()
+            self._websocket = None
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait for data queued in background to be sent
+
+        Parameters
+        ----------
+        timeout : float | None
+            maximum time in seconds to wait (None to wait until sent)
+
+        Returns
+        -------
+        True if all queued data was sent
+        """
+        return _SENDER is None or _SENDER.flush(timeout)
+
+    def batch(self):
+        """Context manager that collects data pushed in its block and sends
+        it in one request (see module-level batch)"""
+        return batch()
+
     def _post(
         self,
         data,
         endpoint="push_data",
     ):
-        url = self.url_prefix + endpoint
+        if endpoint == "push_data":
+            messages = _BATCH.get()
+            if messages is not None:
+                messages.append((self, data))
+                return None
+            if self.background:
+                _get_sender().put(self, data)
+                return None
+            if self.shared_memory:
+                return self._post_shared(data)
+            if self.stream:
+                return self._push(data)
         logging.debug("posting PM: %s", data)
+        return self._post_packed(*self._prepare_request(data), endpoint=endpoint)
+
+    def _post_shared(self, data):
+        packed, blocks = pack_shared(data)
+        try:
+            resp = self._post_packed(
+                packed, {"Content-Type": "application/x-msgpack"}, "push_shared"
+            )
+        except Exception:
+            discard_blocks(blocks, unlink=True)
+            raise
+        # plot server owns blocks now unless it rejected them
+        discard_blocks(blocks, unlink=resp.status_code != 200)
+        return resp
+
+    def _post_packed(self, data, headers, endpoint="push_data"):
+        url = self.url_prefix + endpoint
         start = time_ns()
-        data, headers = self._prepare_request(data)
-        resp = requests.post(url, data=data, headers=headers)
+        resp = self._session.post(url, data=data, headers=headers, timeout=self.timeout)
         elapsed = (time_ns() - start) // 1000000
         logging.info("plot_server.post %d, %dms", resp.status_code, elapsed)
         return resp
@@ -85,7 +365,7 @@ class PlotConnection:
         url = self.url_prefix + endpoint
         start = time_ns()
         data, headers = self._prepare_request(data)
-        resp = requests.put(url, data=data, headers=headers)
+        resp = self._session.put(url, data=data, headers=headers, timeout=self.timeout)
         elapsed = (time_ns() - start) // 1000000
         logging.info("plot_server.put %d, %dms", resp.status_code, elapsed)
         return resp
@@ -93,7 +373,7 @@ class PlotConnection:
     def _get(self, endpoint):
         url = self.url_prefix + endpoint
         start = time_ns()
-        resp = requests.get(url)
+        resp = self._session.get(url, timeout=self.timeout)
         elapsed = (time_ns() - start) // 1000000
         logging.info("plot_server.get %d, %dms", resp.status_code, elapsed)
         return resp
@@ -256,6 +536,62 @@ class PlotConnection:
             )
         )
 
+    def update_line(
+        self,
+        key: str,
+        x: OptionalArrayLike,
+        y: OptionalArrayLike = None,
+        append: bool = False,
+        **attribs,
+    ):
+        """Replace or append to line with given key in multiline plot
+
+        The line is added if the plot does not have a line with the key
+
+        Parameters
+        ----------
+        key: key of line
+        x: x (or y if y not given) array
+        y: y array (if x given)
+        append: append points to line
+        attribs: dict of line parameters
+
+        Returns
+        -------
+        response: Response
+            Response from push_data POST request
+        """
+        if y is None:
+            x, y = None, x
+        if y is None:
+            return
+
+        ld = LineData(
+            key=key,
+            line_params=LineParams(**attribs),
+            x=None if x is None else np.asanyarray(x),
+            y=np.asanyarray(y),
+        )
+        return self._post(
+            UpdateLinesMessage(plot_id=self.plot_id, append=append, update_lines=[ld])
+        )
+
+    def remove_lines(self, keys: str | list[str]):
+        """Remove lines with given keys from multiline plot
+
+        Parameters
+        ----------
+        keys: key or list of keys of lines
+
+        Returns
+        -------
+        response: Response
+            Response from push_data POST request
+        """
+        if isinstance(keys, str):
+            keys = [keys]
+        return self._post(ClearLinesMessage(plot_id=self.plot_id, line_keys=keys))
+
     def scatter(
         self,
         x: ArrayLike,
@@ -327,6 +663,111 @@ class PlotConnection:
             ImageMessage(plot_id=self.plot_id, plot_config=plot_config, im_data=im)
         )
 
+    def image_stack(
+        self,
+        values: ArrayLike,
+        x: OptionalArrayLike = None,
+        y: OptionalArrayLike = None,
+        plot_config: dict[str, Any] | None = None,
+        frame: int = 0,
+        **attribs,
+    ):
+        """Plot stack of images that are shown one frame at a time
+
+        Parameters
+        ----------
+        values: array whose first dimension is frames (use npy_file for
+            stacks in files that the plot server can read)
+        x: x array
+        y: y array
+        plot_config: plot config
+        frame: index of frame to show
+        Returns
+        -------
+        response: Response
+            Response from push_data POST request
+        """
+        values = np.asanyarray(values)
+        if values.ndim == 3:
+            if "domain" not in attribs:
+                attribs["domain"] = values.min(), values.max()
+            st = HeatmapData(values=values, **attribs)
+        elif values.ndim == 4 and values.shape[3] == 3:
+            st = ImageData(values=values, **attribs)
+        else:
+            raise ValueError("Data cannot be interpreted as stack of images")
+        plot_config = PlotConnection._populate_plot_config(plot_config, x, y)
+
+        return self._post(
+            ImageStackMessage(
+                plot_id=self.plot_id,
+                plot_config=plot_config,
+                stack_data=st,
+                frame=frame,
+            )
+        )
+
+    def select_frame(self, frame: int) -> requests.Response:
+        """Sends request to show frame of image stack
+
+        Returns
+        -------
+        response: Response
+            Response from select_frame PUT request
+        """
+        return self._put(None, f"select_frame/{self.plot_id}?frame={frame}")
+
+    def reduce_stack(
+        self, reduction: Reduction | str, target_id: str
+    ) -> requests.Response:
+        """Sends request to reduce image stack over its frames on plot server
+
+        Parameters
+        ----------
+        reduction: sum, mean, max or min of frames
+        target_id: ID of plot to show reduced image
+
+        Returns
+        -------
+        response: Response
+            Response from reduce_stack PUT request
+        """
+        reduction = Reduction(reduction)
+        return self._put(
+            None,
+            f"reduce_stack/{self.plot_id}?reduction={reduction.value}&target={target_id}",
+        )
+
+    def patch_image(
+        self,
+        values: ArrayLike,
+        x0: int = 0,
+        y0: int = 0,
+        domain: tuple[float, float] | None = None,
+    ):
+        """Write values into part of image
+
+        Parameters
+        ----------
+        values: array
+        x0: column of first pixel of values in image
+        y0: row of first pixel of values in image
+        domain: new domain of heatmap (None to keep current domain)
+
+        Returns
+        -------
+        response: Response
+            Response from push_data POST request
+        """
+        return self._post(
+            ImagePatchMessage(
+                plot_id=self.plot_id,
+                offset=(x0, y0),
+                patch_values=np.asanyarray(values),
+                domain=domain,
+            )
+        )
+
     def surface(
         self,
         values: OptionalLists,
@@ -448,15 +889,454 @@ class PlotConnection:
             raise ValueError("Should not be reached")
         return self._post(sm)
 
+    def subscribe_regions(
+        self, callback: RegionCallback | None = None
+    ) -> RegionSubscription:
+        """Subscribe to regions of selection so changes are pushed by plot server
+
+        Parameters
+        ----------
+        callback : RegionCallback | None
+            function called in a background thread with all regions when
+            subscribed and whenever they change
+
+        Returns
+        -------
+        subscription whose wait method can be used to wait for regions
+        """
+        url = f"ws://{self.host}:{self.port}/regions/{self.plot_id}"
+        return RegionSubscription(url, callback)
+
+    def roi_stats(self, selection_id: str | None = None) -> list[RoiStats]:
+        """Get statistics of heatmap or scatter data in regions of selection
+
+        Parameters
+        ----------
+        selection_id : str | None
+            ID of region (if None, all regions)
+
+        Returns
+        -------
+        statistics (count, sum, mean, min, max and centroid) for each region
+        """
+        return self._as_roi_stats(self._get(self._roi_stats_endpoint(selection_id)))
+
+    def _roi_stats_endpoint(self, selection_id: str | None) -> str:
+        endpoint = f"get_roi_stats/{self.plot_id}"
+        if selection_id is not None:
+            endpoint += f"?selection_id={selection_id}"
+        return endpoint
+
+    @staticmethod
+    def _as_roi_stats(resp) -> list[RoiStats]:
+        resp.raise_for_status()
+        return [RoiStats.model_validate(s) for s in j_loads(resp.content)]
+
+    def derive(
+        self,
+        target_id: str,
+        derivation_type: DerivationType | str,
+        selection_id: str | None = None,
+    ) -> str:
+        """Show line derived from region of selection in another plot
+
+        The plot server derives the line again whenever the region or the
+        plot's data changes
+
+        Parameters
+        ----------
+        target_id : str
+            ID of plot to show line
+        derivation_type : DerivationType | str
+            column_profile or row_profile (means of columns or rows of heatmap
+            in region) or sum (of data in region for each frame of image stack
+            or each new data)
+        selection_id : str | None
+            ID of region (if None, the last region)
+
+        Returns
+        -------
+        ID of derivation (also used as key of line)
+        """
+        return self._as_derivation_id(
+            self._post(
+                self._derivation(target_id, derivation_type, selection_id),
+                "add_derivation",
+            )
+        )
+
+    def _derivation(
+        self,
+        target_id: str,
+        derivation_type: DerivationType | str,
+        selection_id: str | None,
+    ) -> Derivation:
+        return Derivation(
+            plot_id=self.plot_id,
+            target_id=target_id,
+            derivation_type=DerivationType(derivation_type),
+            selection_id=selection_id,
+        )
+
+    @staticmethod
+    def _as_derivation_id(resp) -> str:
+        resp.raise_for_status()
+        return j_loads(resp.content)
+
+    def remove_derivation(self, derivation_id: str):
+        """Remove derivation and its line
+
+        Parameters
+        ----------
+        derivation_id : str
+            ID of derivation
+
+        Returns
+        -------
+        response: Response
+            Response from remove_derivation PUT request
+        """
+        return self._put(None, f"remove_derivation/{derivation_id}")
+
+
+@dataclass
+class _QueuedPush:
+    """Data queued for background sender
+
+    Replacement and control messages are packed when queued; consecutive
+    appended lines are kept (as copies) so they are concatenated when sent
+    """
+
+    connection: PlotConnection
+    replace: bool = False
+    packed: tuple[Any, dict[str, str] | None] | None = None
+    appends: list[MultiLineMessage] = field(default_factory=list)
+
+    def can_append(self, msg: MultiLineMessage) -> bool:
+        if not self.appends:
+            return False
+        lines = self.appends[0].ml_data
+        return len(lines) == len(msg.ml_data) and all(
+            a.default_indices == b.default_indices for a, b in zip(lines, msg.ml_data)
+        )
+
+    def message(self) -> tuple[Any, dict[str, str] | None]:
+        """Get packed message"""
+        if self.packed is not None:
+            return self.packed
+        first = self.appends[0]
+        lines = []
+        for i, ld in enumerate(first.ml_data):
+            chunks = [a.ml_data[i] for a in self.appends]
+            update: dict[str, Any] = {"y": np.concatenate([c.y for c in chunks])}
+            if not ld.default_indices:
+                update["x"] = np.concatenate([c.x for c in chunks])
+            lines.append(ld.model_copy(update=update))
+        msg = first.model_copy(
+            update={"ml_data": lines, "plot_config": self.appends[-1].plot_config}
+        )
+        return self.connection._prepare_request(msg)
+
+
+def _copy_lines(msg: MultiLineMessage) -> MultiLineMessage:
+    return msg.model_copy(
+        update={
+            "ml_data": [
+                ld.model_copy(
+                    update={
+                        "x": None if ld.x is None else np.array(ld.x),
+                        "y": np.array(ld.y),
+                    }
+                )
+                for ld in msg.ml_data
+            ]
+        }
+    )
+
+
+class _BackgroundSender:
+    """Thread that posts data queued by connections in background mode
+
+    Data is posted in order for each plot and plots take turns. A queued
+    full-replacement message supersedes earlier queued data for its plot and
+    consecutive appends to a plot are concatenated
+    """
+
+    def __init__(self):
+        self._pending: dict[str, deque[_QueuedPush]] = {}
+        self._condition = threading.Condition()
+        self._sending = 0
+        self._thread: threading.Thread | None = None
+        self.failures = 0
+
+    def put(self, pc: PlotConnection, msg):
+        """Queue message from connection"""
+        append = isinstance(msg, MultiLineMessage) and msg.append
+        if append:
+            msg = _copy_lines(msg)
+            item = _QueuedPush(pc, appends=[msg])
+        else:
+            replace = not isinstance(
+                msg,
+                (
+                    SelectionsMessage,
+                    ClearSelectionsMessage,
+                    UpdateLinesMessage,
+                    ClearLinesMessage,
+                    ImagePatchMessage,
+                ),
+            )
+            item = _QueuedPush(pc, replace, pc._prepare_request(msg))
+
+        with self._condition:
+            queue = self._pending.setdefault(pc.plot_id, deque())
+            if item.replace:
+                kept = [i for i in queue if i.packed is not None and not i.replace]
+                queue.clear()
+                queue.extend(kept)
+            elif append and queue and queue[-1].connection is pc:
+                last = queue[-1]
+                if last.can_append(msg):
+                    last.appends.append(msg)
+                    return
+            queue.append(item)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._send, name="davidia sender", daemon=True
+                )
+                self._thread.start()
+            self._condition.notify_all()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """Wait until all queued data is sent
+
+        Returns False if timed out
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and self._sending == 0, timeout
+            )
+
+    def _send(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+                plot_id = next(iter(self._pending))
+                queue = self._pending.pop(plot_id)
+                item = queue.popleft()
+                if queue:  # take turns with other plots
+                    self._pending[plot_id] = queue
+                self._sending += 1
+            try:
+                resp = item.connection._post_packed(*item.message())
+                if resp.status_code != 200:
+                    self.failures += 1
+                    logging.warning(
+                        "Background push to %s failed: %s", plot_id, resp.text
+                    )
+            except Exception:
+                self.failures += 1
+                logging.warning("Background push to %s failed", plot_id, exc_info=True)
+            finally:
+                with self._condition:
+                    self._sending -= 1
+                    self._condition.notify_all()
+
+
+_SENDER: _BackgroundSender | None = None
+_SENDER_LOCK = threading.Lock()
+
+
+def _get_sender() -> _BackgroundSender:
+    global _SENDER
+    with _SENDER_LOCK:
+        if _SENDER is None:
+            _SENDER = _BackgroundSender()
+        return _SENDER
+
+
+def flush(timeout: float | None = None) -> bool:
+    """Wait for data queued by connections in background mode to be sent
+
+    Parameters
+    ----------
+    timeout : float | None
+        maximum time in seconds to wait (None to wait until sent)
+
+    Returns
+    -------
+    True if all queued data was sent
+    """
+    return _SENDER is None or _SENDER.flush(timeout)
+
+
+class AsyncPlotConnection(PlotConnection):
+    """An asyncio connection to a plot on a plot server
+
+    Its methods are coroutines that mirror those of PlotConnection, e.g.
+
+    >>> async with AsyncPlotConnection("plot_0") as pc:
+    ...     await pc.line(None, y)
+
+    Requests are sent with a pooled httpx.AsyncClient so many pushes can be in
+    flight at once; use connection() to get connections to other plots that
+    share the client.
+
+    Parameters
+    ----------
+    plot_id : str
+        ID of plot
+    host : str
+        name or IP of plot server
+    port : int
+        port number of plot server
+    use_msgpack : bool
+        pack messages with MessagePack instead of JSON
+    pool_size : int
+        maximum number of connections in client's pool
+    timeout : float | tuple[float, float]
+        timeout in seconds (or connect and read timeouts) for requests
+    client : httpx.AsyncClient | None
+        client to share (if None, a client is created and closed by aclose)
+    """
+
+    def __init__(
+        self,
+        plot_id,
+        host="localhost",
+        port=8000,
+        use_msgpack=True,
+        pool_size=DEFAULT_POOL_SIZE,
+        timeout: float | tuple[float, float] = DEFAULT_TIMEOUT,
+        client: httpx.AsyncClient | None = None,
+    ):
+        super().__init__(
+            plot_id, host, port, use_msgpack, pool_size=pool_size, timeout=timeout
+        )
+        self._own_client = client is None
+        if client is None:
+            if isinstance(timeout, tuple):
+                connect_timeout, read_timeout = timeout
+            else:
+                connect_timeout = read_timeout = timeout
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=pool_size, max_keepalive_connections=pool_size
+                ),
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            )
+        self._client = client
+
+    def connection(self, plot_id: str) -> AsyncPlotConnection:
+        """Get connection to another plot on same server that shares client"""
+        return AsyncPlotConnection(
+            plot_id,
+            self.host,
+            self.port,
+            self.use_msgpack,
+            timeout=self.timeout,
+            client=self._client,
+        )
+
+    async def aclose(self):
+        """Close client if it is not shared"""
+        if self._own_client:
+            await self._client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def _post(  # pyright: ignore[reportIncompatibleMethodOverride]
+        self,
+        data,
+        endpoint="push_data",
+    ) -> httpx.Response:
+        url = self.url_prefix + endpoint
+        start = time_ns()
+        data, headers = self._prepare_request(data)
+        resp = await self._client.post(url, content=data, headers=headers)
+        elapsed = (time_ns() - start) // 1000000
+        logging.info("plot_server.post %d, %dms", resp.status_code, elapsed)
+        return resp
+
+    async def _put(  # pyright: ignore[reportIncompatibleMethodOverride]
+        self, data, endpoint
+    ) -> httpx.Response:
+        url = self.url_prefix + endpoint
+        start = time_ns()
+        data, headers = self._prepare_request(data)
+        resp = await self._client.put(url, content=data, headers=headers)
+        elapsed = (time_ns() - start) // 1000000
+        logging.info("plot_server.put %d, %dms", resp.status_code, elapsed)
+        return resp
+
+    async def _get(  # pyright: ignore[reportIncompatibleMethodOverride]
+        self, endpoint
+    ) -> httpx.Response:
+        url = self.url_prefix + endpoint
+        start = time_ns()
+        resp = await self._client.get(url)
+        elapsed = (time_ns() - start) // 1000000
+        logging.info("plot_server.get %d, %dms", resp.status_code, elapsed)
+        return resp
+
+    async def get_plots_ids(  # pyright: ignore[reportIncompatibleMethodOverride]
+        self,
+    ) -> list[str]:
+        ids = j_loads((await self._get("get_plot_ids")).content)
+        if isinstance(ids, list):
+            return ids
+        logging.warning("Fetched values not a list (%s): %s", type(ids), ids)
+        return []
+
+    async def region(  # pyright: ignore[reportIncompatibleMethodOverride]
+        self,
+        selections: Selections | None,
+        update: bool = False,
+        delete: bool | str | list[str] = False,
+    ):
+        """Get, set or delete regions of selection (see PlotConnection.region)"""
+        if selections is None and delete is False:
+            return j_loads((await self._get(f"get_regions/{self.plot_id}")).content)
+        return await super().region(selections, update, delete)
+
+    async def roi_stats(  # pyright: ignore[reportIncompatibleMethodOverride]
+        self, selection_id: str | None = None
+    ) -> list[RoiStats]:
+        """Get statistics of data in regions (see PlotConnection.roi_stats)"""
+        resp = await self._get(self._roi_stats_endpoint(selection_id))
+        return self._as_roi_stats(resp)
+
+    async def derive(  # pyright: ignore[reportIncompatibleMethodOverride]
+        self,
+        target_id: str,
+        derivation_type: DerivationType | str,
+        selection_id: str | None = None,
+    ) -> str:
+        """Show line derived from region in another plot (see PlotConnection.derive)"""
+        resp = await self._post(
+            self._derivation(target_id, derivation_type, selection_id),
+            "add_derivation",
+        )
+        return self._as_derivation_id(resp)
+
 
 _ALL_PLOTS: dict[str, PlotConnection] = dict()
+_PLOT_IDS: dict[tuple[str, int], list[str]] = dict()
+_BATCH: ContextVar[list[tuple[PlotConnection, Any]] | None] = ContextVar(
+    "batch", default=None
+)
 _DEF_PLOT_ID = None
 
 _DEF_PS_HOST = "localhost"
 _DEF_PS_PORT = 8000
+_DEF_PS_STREAM = False
 
 
-def set_default_plot_server(host: str, port: int):
+def set_default_plot_server(host: str, port: int, stream: bool = False):
     """Set default host and port for plot server
 
     Parameters
@@ -465,10 +1345,13 @@ def set_default_plot_server(host: str, port: int):
         host as IP address or name
     port : int
         port number
+    stream : bool
+        push data over websockets
     """
-    global _DEF_PS_HOST, _DEF_PS_PORT
+    global _DEF_PS_HOST, _DEF_PS_PORT, _DEF_PS_STREAM
     _DEF_PS_HOST = host
     _DEF_PS_PORT = port
+    _DEF_PS_STREAM = stream
 
 
 def get_plot_connection(plot_id="", host=None, port=None):
@@ -489,6 +1372,8 @@ def get_plot_connection(plot_id="", host=None, port=None):
     Side effects
     ------------
     Populates a global dict/cache that maps plot ID to connection
+    Populates a global dict/cache of plot IDs on server (refreshed when given
+    plot ID is not in it)
     Sets default plot ID from given plot ID or first ID on server
     """
     if plot_id and plot_id in _ALL_PLOTS:
@@ -498,8 +1383,10 @@ def get_plot_connection(plot_id="", host=None, port=None):
         host = _DEF_PS_HOST
     if port is None:
         port = _DEF_PS_PORT
-    pc = PlotConnection(plot_id, host, port)
-    ids = pc.get_plots_ids()
+    pc = PlotConnection(plot_id, host, port, stream=_DEF_PS_STREAM)
+    ids = _PLOT_IDS.get((host, port), [])
+    if len(ids) == 0 or (plot_id and plot_id not in ids):
+        ids = _PLOT_IDS[(host, port)] = pc.get_plots_ids()
     if len(ids) == 0:
         raise ValueError("Plot connection has no plots")
     if plot_id and plot_id not in ids:
@@ -513,14 +1400,69 @@ def get_plot_connection(plot_id="", host=None, port=None):
                 " with new connection",
                 plot_id,
             )
+            _ALL_PLOTS[plot_id].close()
         _DEF_PLOT_ID = plot_id
     else:
         _DEF_PLOT_ID = ids[0]
-        pc = PlotConnection(_DEF_PLOT_ID, host, port)
+        pc = PlotConnection(_DEF_PLOT_ID, host, port, stream=_DEF_PS_STREAM)
     _ALL_PLOTS[_DEF_PLOT_ID] = pc
     return pc
 
 
+def close_plot_connections():
+    """Close all cached plot connections and their HTTP sessions
+
+    This is called at exit (after waiting for data queued in background to be
+    sent) so websockets used to push data are closed cleanly
+    """
+    if not flush(EXIT_FLUSH_TIMEOUT):
+        logging.warning("Not all data queued in background was sent")
+    for pc in _ALL_PLOTS.values():
+        pc.close()
+    _ALL_PLOTS.clear()
+    _PLOT_IDS.clear()
+    for s in _SESSIONS.values():
+        s.close()
+    _SESSIONS.clear()
+
+
+atexit.register(close_plot_connections)
+
+
+@contextmanager
+def batch():
+    """Context manager that collects data pushed to plots in its block and
+    sends it in one request per plot server when the block exits
+
+    Nothing is sent if the block raises an exception. Nested blocks are part
+    of the outermost block.
+
+    Examples
+    --------
+    >>> with batch():
+    ...     line(None, y, plot_id="plot_0")
+    ...     image(values, plot_id="plot_1")
+    """
+    if _BATCH.get() is not None:
+        yield
+        return
+
+    messages: list[tuple[PlotConnection, Any]] = []
+    token = _BATCH.set(messages)
+    try:
+        yield
+    finally:
+        _BATCH.reset(token)
+
+    servers: dict[tuple[str, int], tuple[PlotConnection, list]] = {}
+    for pc, msg in messages:
+        servers.setdefault((pc.host, pc.port), (pc, []))[1].append(msg)
+    for pc, msgs in servers.values():
+        resp = pc._post(BatchMessage(messages=msgs), endpoint="push_batch")
+        if resp.status_code != 200:
+            logging.warning("Batch push to %s failed: %s", pc.url_prefix, resp.text)
+
+
 def set_default_plot_id(plot_id: str | None):
     if not plot_id:
         raise ValueError("Plot ID must not be None or empty")
@@ -574,6 +1516,55 @@ def line(
     return pc.line(x, y, plot_config, append, **attribs)
 
 
+def update_line(
+    key: str,
+    x: OptionalArrayLike,
+    y: OptionalArrayLike = None,
+    plot_id: str | None = None,
+    append: bool = False,
+    **attribs,
+):
+    """Replace or append to line with given key
+
+    The line is added if the plot does not have a line with the key
+
+    Parameters
+    ----------
+    key: key of line
+    x: x (or y if y not given) array
+    y: y array (if x given)
+    plot_id: ID of plot where line is updated
+    append: append points to line
+    **attribs: keywords specific to line (as for line)
+
+    Returns
+    -------
+    response: Response
+        Response from push_data POST request
+    """
+    plot_id = _get_default_plot_id(plot_id)
+    pc = get_plot_connection(plot_id)
+    return pc.update_line(key, x, y, append, **attribs)
+
+
+def remove_lines(keys: str | list[str], plot_id: str | None = None):
+    """Remove lines with given keys
+
+    Parameters
+    ----------
+    keys: key or list of keys of lines
+    plot_id: ID of plot where lines are removed
+
+    Returns
+    -------
+    response: Response
+        Response from push_data POST request
+    """
+    plot_id = _get_default_plot_id(plot_id)
+    pc = get_plot_connection(plot_id)
+    return pc.remove_lines(keys)
+
+
 def image(
     values: OptionalLists,
     x: OptionalArrayLike = None,
@@ -610,6 +1601,108 @@ def image(
     return pc.image(values, x, y, plot_config, **attribs)
 
 
+def image_stack(
+    values: ArrayLike,
+    x: OptionalArrayLike = None,
+    y: OptionalArrayLike = None,
+    plot_config: dict | None = None,
+    plot_id: str | None = None,
+    frame: int = 0,
+    **attribs,
+):
+    """Plot stack of images that are shown one frame at a time
+
+    Parameters
+    ----------
+    values: array whose first dimension is frames
+    x: x array
+    y: y array
+    plot_config: plot config
+    plot_id: ID of plot where stack is added
+    frame: index of frame to show
+    **attribs: keywords specific to image (as for image)
+
+    Returns
+    -------
+    response: Response
+        Response from push_data POST request
+    """
+    plot_id = _get_default_plot_id(plot_id)
+    pc = get_plot_connection(plot_id)
+    return pc.image_stack(values, x, y, plot_config, frame, **attribs)
+
+
+def select_frame(frame: int, plot_id: str | None = None):
+    """Sends request to show frame of image stack
+
+    Parameters
+    ----------
+    frame : int
+        index of frame
+    plot_id : str
+        the plot of image stack
+
+    Returns
+    -------
+    response: Response
+        Response from select_frame PUT request
+    """
+    plot_id = _get_default_plot_id(plot_id)
+    pc = get_plot_connection(plot_id)
+    return pc.select_frame(frame)
+
+
+def reduce_stack(
+    reduction: Reduction | str, target_id: str, plot_id: str | None = None
+):
+    """Sends request to reduce image stack over its frames and show result
+
+    Parameters
+    ----------
+    reduction : Reduction | str
+        sum, mean, max or min of frames
+    target_id : str
+        the plot to show reduced image
+    plot_id : str
+        the plot of image stack
+
+    Returns
+    -------
+    response: Response
+        Response from reduce_stack PUT request
+    """
+    plot_id = _get_default_plot_id(plot_id)
+    pc = get_plot_connection(plot_id)
+    return pc.reduce_stack(reduction, target_id)
+
+
+def patch_image(
+    values: ArrayLike,
+    x0: int = 0,
+    y0: int = 0,
+    domain: tuple[float, float] | None = None,
+    plot_id: str | None = None,
+):
+    """Write values into part of image
+
+    Parameters
+    ----------
+    values: array
+    x0: column of first pixel of values in image
+    y0: row of first pixel of values in image
+    domain: new domain of heatmap (None to keep current domain)
+    plot_id: ID of plot where image is patched
+
+    Returns
+    -------
+    response: Response
+        Response from push_data POST request
+    """
+    plot_id = _get_default_plot_id(plot_id)
+    pc = get_plot_connection(plot_id)
+    return pc.patch_image(values, x0, y0, domain)
+
+
 def scatter(
     x: ArrayLike,
     y: ArrayLike,
@@ -758,10 +1851,103 @@ def region(
     return pc.region(selections, update, delete)
 
 
+def subscribe_regions(
+    callback: RegionCallback | None = None, plot_id: str | None = None
+) -> RegionSubscription:
+    """Subscribe to regions of selection on plot so changes are pushed by plot server
+
+    Parameters
+    ----------
+    callback : RegionCallback | None
+        function called in a background thread with all regions when subscribed
+        and whenever they change
+    plot_id : str
+        the plot of regions
+
+    Returns
+    -------
+    subscription whose wait method can be used to wait for regions
+    """
+    plot_id = _get_default_plot_id(plot_id)
+    pc = get_plot_connection(plot_id)
+    return pc.subscribe_regions(callback)
+
+
+def roi_stats(selection_id: str | None = None, plot_id: str | None = None):
+    """Get statistics of heatmap or scatter data in regions of selection on plot
+
+    Parameters
+    ----------
+    selection_id : str | None
+        ID of region (if None, all regions)
+    plot_id : str
+        the plot of regions
+
+    Returns
+    -------
+    statistics (count, sum, mean, min, max and centroid) for each region
+    """
+    plot_id = _get_default_plot_id(plot_id)
+    pc = get_plot_connection(plot_id)
+    return pc.roi_stats(selection_id)
+
+
+def derive(
+    target_id: str,
+    derivation_type: DerivationType | str,
+    selection_id: str | None = None,
+    plot_id: str | None = None,
+):
+    """Show line derived from region of selection on plot in another plot
+
+    Parameters
+    ----------
+    target_id : str
+        the plot to show line
+    derivation_type : DerivationType | str
+        column_profile, row_profile or sum of data in region
+    selection_id : str | None
+        ID of region (if None, the last region)
+    plot_id : str
+        the plot of regions
+
+    Returns
+    -------
+    ID of derivation
+    """
+    plot_id = _get_default_plot_id(plot_id)
+    pc = get_plot_connection(plot_id)
+    return pc.derive(target_id, derivation_type, selection_id)
+
+
+def remove_derivation(derivation_id: str, plot_id: str | None = None):
+    """Remove derivation and its line
+
+    Parameters
+    ----------
+    derivation_id : str
+        ID of derivation
+    plot_id : str
+        the plot of regions
+
+    Returns
+    -------
+    response: Response
+        Response from remove_derivation PUT request
+    """
+    plot_id = _get_default_plot_id(plot_id)
+    pc = get_plot_connection(plot_id)
+    return pc.remove_derivation(derivation_id)
+
+
 __all__ = [  # pyright: ignore[reportUnsupportedDunderAll]
     PlotConnection,
+    AsyncPlotConnection,
     get_plot_connection,
     set_default_plot_id,
+    batch,
+    flush,
+    npy_file,
     AxialSelection,
     LinearSelection,
     RectangularSelection,
@@ -770,14 +1956,26 @@ __all__ = [  # pyright: ignore[reportUnsupportedDunderAll]
     EllipticalSelection,
     CircularSectorialSelection,
     ColourMap,
+    DerivationType,
     GlyphType,
+    Reduction,
     ScaleType,
     TableDisplayType,
     line,
+    update_line,
+    remove_lines,
     image,
+    image_stack,
+    select_frame,
+    reduce_stack,
+    patch_image,
     scatter,
     surface,
     table,
     region,
+    subscribe_regions,
+    roi_stats,
+    derive,
+    remove_derivation,
     clear,
 ]
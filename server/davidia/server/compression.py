@@ -0,0 +1,90 @@
+import logging
+from enum import auto
+
+from ..models.parameters import AutoNameEnum
+
+try:
+    import lz4.frame as _lz4
+except ImportError:
+    _lz4 = None
+
+try:
+    import zstandard as _zstd
+except ImportError:
+    _zstd = None
+
+logger = logging.getLogger("main")
+
+COMPRESSION_THRESHOLD = 4096
+"""Size in bytes below which messages are sent uncompressed"""
+
+_LZ4_MAGIC = b"\x04\x22\x4d\x18"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class Compression(AutoNameEnum):
+    """Class for compression of messages sent to clients
+
+    Compressed messages are frames that start with the magic number of their
+    compression format so clients can tell them from uncompressed messages.
+    Only Python (and other non-browser) clients can request compression as
+    the web client has no decompressor
+    """
+
+    none = auto()
+    lz4 = auto()
+    zstd = auto()
+
+
+def is_available(compression: Compression) -> bool:
+    """Check if compression's module is available"""
+    match compression:
+        case Compression.lz4:
+            return _lz4 is not None
+        case Compression.zstd:
+            return _zstd is not None
+    return True
+
+
+def compress(
+    data: bytes,
+    compression: Compression,
+    threshold: int = COMPRESSION_THRESHOLD,
+) -> bytes:
+    """Compress packed message
+
+    Parameters
+    ----------
+    data : bytes
+        packed message
+    compression : Compression
+        compression to use
+    threshold : int
+        size below which message is not compressed
+
+    Returns
+    -------
+    compressed frame (or data if too small or compression is not available)
+    """
+    if len(data) < threshold:
+        return data
+    match compression:
+        case Compression.lz4 if _lz4 is not None:
+            return _lz4.compress(data)
+        case Compression.zstd if _zstd is not None:
+            return _zstd.ZstdCompressor().compress(data)
+    return data
+
+
+def decompress(data: bytes) -> bytes:
+    """Decompress message if it is a compressed frame"""
+    magic = data[:4]
+    if magic == _LZ4_MAGIC:
+        if _lz4 is None:
+            raise ValueError("lz4 module is needed to decompress message")
+        return _lz4.decompress(data)
+    if magic == _ZSTD_MAGIC:
+        if _zstd is None:
+            raise ValueError("zstandard module is needed to decompress message")
+        return _zstd.ZstdDecompressor().decompress(data)
+    return data
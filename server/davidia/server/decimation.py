@@ -0,0 +1,147 @@
+import numpy as np
+
+from ..models.messages import ClientViewportMessage, LineData, MultiLineMessage
+from ..models.parameters import DvDNDArray
+
+POINTS_PER_PIXEL = 4
+"""Number of points kept in each bucket: first, minimum, maximum and last"""
+
+
+def _is_increasing(x: DvDNDArray) -> bool:
+    return x.size < 2 or bool(np.all(x[1:] >= x[:-1]))
+
+
+def _bucket_starts(
+    x: DvDNDArray | None, size: int, width: int, x_range: tuple[float, float] | None
+) -> tuple[DvDNDArray, int, int]:
+    """Find start indices of buckets
+
+    Buckets are pixel columns of x range if x is increasing otherwise they
+    are equal numbers of points
+
+    Returns start indices, and start and stop of points within x range
+    """
+    begin, end = 0, size
+    if x is not None and _is_increasing(x):
+        lo, hi = (x[0], x[-1]) if x_range is None else x_range
+        if x_range is not None:  # keep a point either side for continuity
+            begin = max(int(np.searchsorted(x, lo, side="left")) - 1, 0)
+            end = min(int(np.searchsorted(x, hi, side="right")) + 1, size)
+        if hi > lo:
+            edges = np.linspace(lo, hi, width + 1)[1:-1]
+            starts = np.searchsorted(x[begin:end], edges, side="left")
+            starts = np.unique(np.concatenate(([0], starts)))
+            return starts[starts < end - begin], begin, end
+
+    n = end - begin
+    starts = np.unique(np.linspace(0, n, min(width, n), endpoint=False).astype(np.intp))
+    return starts, begin, end
+
+
+def decimate_indices(
+    x: DvDNDArray | None,
+    y: DvDNDArray,
+    width: int,
+    x_range: tuple[float, float] | None = None,
+) -> DvDNDArray | None:
+    """Find indices of points that preserve extremes of line drawn in given width
+
+    Each bucket keeps its first, minimum, maximum and last points in order
+
+    Parameters
+    ----------
+    x : DvDNDArray | None
+        x coordinates (None for default indices)
+    y : DvDNDArray
+        y coordinates
+    width : int
+        number of pixels
+    x_range : tuple[float, float] | None
+        visible range of x (only used if x is increasing)
+
+    Returns
+    -------
+    indices of points or None if line does not need decimating
+    """
+    size = y.size
+    if size == 0 or (x is not None and x.size != size):
+        return None
+    starts, begin, end = _bucket_starts(x, size, width, x_range)
+    if end - begin <= POINTS_PER_PIXEL * starts.size:
+        return None if begin == 0 and end == size else np.arange(begin, end)
+
+    values = y[begin:end]
+    stops = np.append(starts[1:], end - begin)
+    counts = stops - starts
+    bucket_min = np.fmin.reduceat(values, starts)
+    bucket_max = np.fmax.reduceat(values, starts)
+
+    def _first_equal(bucket_values: DvDNDArray) -> DvDNDArray:
+        matched = np.flatnonzero(values == np.repeat(bucket_values, counts))
+        i = np.searchsorted(matched, starts)
+        found = matched[np.minimum(i, matched.size - 1)] if matched.size else starts
+        return np.where((i < matched.size) & (found < stops), found, starts)
+
+    indices = np.stack(
+        (starts, _first_equal(bucket_min), _first_equal(bucket_max), stops - 1)
+    )
+    indices.sort(axis=0)
+    indices = indices.T.ravel()
+    keep = np.ones(indices.size, dtype=bool)
+    keep[1:] = indices[1:] != indices[:-1]
+    return indices[keep] + begin
+
+
+def decimate_line(
+    line: LineData, width: int, x_range: tuple[float, float] | None = None
+) -> LineData:
+    """Decimate line to given width
+
+    Parameters
+    ----------
+    line : LineData
+        line to decimate
+    width : int
+        number of pixels
+    x_range : tuple[float, float] | None
+        visible range of x
+
+    Returns
+    -------
+    decimated line (or line if it does not need decimating)
+    """
+    indices = decimate_indices(line.x, line.y, width, x_range)
+    if indices is None:
+        return line
+    x = line.x
+    return line.model_copy(
+        update={"x": None if x is None else x[indices], "y": line.y[indices]}
+    )
+
+
+def decimate_lines(
+    msg: MultiLineMessage, viewport: ClientViewportMessage
+) -> MultiLineMessage:
+    """Decimate lines in message to fit client's viewport
+
+    Parameters
+    ----------
+    msg : MultiLineMessage
+        message with lines
+    viewport : ClientViewportMessage
+        viewport of client
+
+    Returns
+    -------
+    message with decimated lines (or message if no lines need decimating)
+    """
+    width = max(viewport.pixel_width, 1)
+    lines = [decimate_line(ld, width, viewport.x_range) for ld in msg.ml_data]
+    if all(d is ld for d, ld in zip(lines, msg.ml_data)):
+        return msg
+    return msg.model_copy(update={"ml_data": lines})
+
+
+def max_points(msg: MultiLineMessage) -> int:
+    """Get largest number of points in lines"""
+    return max((ld.y.size for ld in msg.ml_data), default=0)
@@ -0,0 +1,177 @@
+from enum import auto
+from uuid import uuid4
+
+import numpy as np
+from pydantic import Field
+
+from ..models.messages import (
+    ImageStackMessage,
+    LineData,
+    LineParams,
+    UpdateLinesMessage,
+    _PlotDataMessage,
+)
+from ..models.parameters import AutoNameEnum, DvDModel
+from ..models.selections import SelectionBase
+from .roi import SelectionMask, selection_key
+
+DEBOUNCE_INTERVAL = 0.05
+"""Time in seconds over which changes to a plot are gathered before derived
+data is computed again"""
+
+
+class DerivationType(AutoNameEnum):
+    """Class for types of data derived from a region of a plot
+
+    column_profile is the mean of each column in a region of a heatmap,
+    row_profile is the mean of each row and sum is the sum in a region for
+    each frame of an image stack (or for each new data of other plots)
+    """
+
+    column_profile = auto()
+    row_profile = auto()
+    sum = auto()
+
+
+class Derivation(DvDModel):
+    """
+    Class for representing data derived from a region of a plot that is shown
+    as a line in another plot
+
+    Attributes
+    ----------
+    plot_id : str
+        ID of plot with region
+    target_id : str
+        ID of plot to show line
+    derivation_type : DerivationType
+        Type of derived data
+    selection_id : str | None
+        ID of region (if None, the last region of plot)
+    id : str
+        ID of derivation (also used as key of line)
+    """
+
+    plot_id: str
+    target_id: str
+    derivation_type: DerivationType
+    selection_id: str | None = None
+    id: str = Field(default_factory=lambda: uuid4().hex[-8:])
+
+
+class DerivedLine:
+    """A line derived from a region of a plot
+
+    The key of the data and region that the line was last derived from is kept
+    so the line is only derived again when either changes. Sums over data
+    that are not image stacks are appended to the line while the region is
+    unchanged
+    """
+
+    def __init__(self, derivation: Derivation):
+        self.derivation = derivation
+        self.last_key: tuple | None = None
+        self.points = 0
+
+    def find_selection(self, selections: list[SelectionBase]) -> SelectionBase | None:
+        selection_id = self.derivation.selection_id
+        if selection_id is None:
+            return selections[-1] if selections else None
+        for s in selections:
+            if s.id == selection_id:
+                return s
+        return None
+
+    def derive(
+        self,
+        data: _PlotDataMessage,
+        values: np.ndarray,
+        selection: SelectionBase,
+        mask: SelectionMask,
+        version: int,
+        frame: int,
+    ) -> UpdateLinesMessage | None:
+        """Derive line from values in mask of selection
+
+        Parameters
+        ----------
+        data : _PlotDataMessage
+            current data of plot
+        values : np.ndarray
+            values of current data (or frame of image stack)
+        selection : SelectionBase
+            region
+        mask : SelectionMask
+            mask of region in values
+        version : int
+            version of current data
+        frame : int
+            frame of image stack
+
+        Returns
+        -------
+        update of line (or None if data and region are unchanged)
+        """
+        derivation = self.derivation
+        d_type = DerivationType(derivation.derivation_type)
+        s_key = selection_key(selection)
+        is_stack = isinstance(data, ImageStackMessage)
+        if d_type == DerivationType.sum and is_stack:
+            key = (version, s_key)
+        elif is_stack:
+            key = (version, frame, s_key)
+        else:
+            key = (version, s_key)
+        if key == self.last_key:
+            return None
+
+        append = False
+        match d_type:
+            case DerivationType.sum if is_stack:
+                stack = data.stack_data.values
+                y = stack[(slice(None), *mask.index)]
+                y = np.where(np.isfinite(y), y, 0).sum(axis=1, dtype=np.float64)
+                x = None
+            case DerivationType.sum:
+                append = self.last_key is not None and self.last_key[1] == s_key
+                v = values[mask.index]
+                total = v[np.isfinite(v)].sum(dtype=np.float64)
+                self.points = self.points + 1 if append else 0
+                x = np.array([self.points], dtype=np.int64)
+                y = np.array([total])
+            case _:
+                if len(mask.index) != 2:
+                    raise ValueError("Profiles need heatmap data")
+                axis = 1 if d_type == DerivationType.column_profile else 0
+                x, y = _profile(values, mask, axis)
+
+        self.last_key = key
+        name = f"{d_type.value} of {selection.name or selection.id}"
+        line = LineData(key=derivation.id, x=x, y=y, line_params=LineParams(name=name))
+        return UpdateLinesMessage(
+            plot_id=derivation.target_id, update_lines=[line], append=append
+        )
+
+
+def _profile(
+    values: np.ndarray, mask: SelectionMask, axis: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Get coordinates and means of finite values in mask along axis of image"""
+    index = mask.index[axis]
+    v = values[mask.index].astype(np.float64, copy=False)
+    coords = mask.x if axis == 1 else mask.y
+    finite = np.isfinite(v)
+    if not finite.all():
+        index = index[finite]
+        v = v[finite]
+        coords = coords[finite]
+    if index.size == 0:
+        return np.empty(0), np.empty(0)
+    offset = index.min()
+    index = index - offset
+    counts = np.bincount(index)
+    present = counts > 0
+    counts = counts[present]
+    sums = np.bincount(index, weights=v)[present]
+    x = np.bincount(index, weights=coords)[present] / counts
+    return x, sums / counts
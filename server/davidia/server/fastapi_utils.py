@@ -1,24 +1,78 @@
 import inspect
 import logging
+import struct
+from enum import auto
+from collections.abc import Callable, Iterable
+from functools import lru_cache
 from types import UnionType
-from typing import Any, get_args
+from typing import Any, TypeVar, get_args
 
 import numpy as np
 import orjson
 from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from msgpack import ExtType
 from msgpack import packb as _mp_packb  # max_buffer_size=100MB
 from msgpack import unpackb as _mp_unpackb
 from pydantic import BaseModel, ValidationError
 from pydantic.alias_generators import to_camel
 
 from ..models.messages import ALL_MODELS, DvDNDArray
+from ..models.parameters import AutoNameEnum
+from .compression import Compression, compress
 from ..models.selections import AnySelection, as_selection
 
 logger = logging.getLogger("main")
 
+T = TypeVar("T")
+
+
+def _model_signature(
+    model: type[BaseModel],
+) -> tuple[list[frozenset[str]], frozenset[str] | None]:
+    """Get keys of model's fields
+
+    Returns list of alternative keys for each required field and all keys
+    (or None if model allows extra keys)
+    """
+    by_name = model.model_config.get("populate_by_name", False)
+    required = []
+    allowed = set()
+    for name, field in model.model_fields.items():
+        keys = {name} if field.alias is None else {field.alias}
+        if by_name:
+            keys.add(name)
+        allowed.update(keys)
+        if field.is_required():
+            required.append(frozenset(keys))
+    forbid = model.model_config.get("extra") == "forbid"
+    return required, frozenset(allowed) if forbid else None
+
+
+_MODEL_SIGNATURES = [(m, *_model_signature(m)) for m in ALL_MODELS]
+
+
+@lru_cache(maxsize=256)
+def _candidate_models(keys: frozenset[str]) -> tuple[type[BaseModel], ...]:
+    """Get models whose required and allowed fields match given keys"""
+    return tuple(
+        m
+        for m, required, allowed in _MODEL_SIGNATURES
+        if all(not r.isdisjoint(keys) for r in required)
+        and (allowed is None or keys <= allowed)
+    )
+
 
 def as_model(raw: dict) -> BaseModel | None:
-    for m in ALL_MODELS:
+    """Validate dict as first matching model in ALL_MODELS
+
+    Only models whose fields match the keys of the dict are tried
+    """
+    if isinstance(raw, dict):
+        models = _candidate_models(frozenset(raw))
+    else:
+        models = ALL_MODELS
+    for m in models:
         try:
             return m.model_validate(raw)
         except Exception:
@@ -113,23 +167,204 @@ def encode_ndarray(obj) -> dict[str, Any]:
     return obj
 
 
-def ws_pack(obj) -> bytes | None:
+NDARRAY_EXT_TYPE = 1
+"""MessagePack extension type code for NumPy ndarrays"""
+
+_EXT32_HEADER = struct.Struct(">BIb")
+_ALIGNMENT = 8
+
+
+class ArrayFormat(AutoNameEnum):
+    """Class for format of ndarrays in packed messages
+
+    dict format packs arrays as maps with their data copied into bytes.
+    ext format packs arrays as extension types whose data is aligned to
+    8-byte boundaries in the message so it can be viewed without copying
+    """
+
+    dict = auto()
+    ext = auto()
+
+
+def _pack_header(n: int, fix: int, short: int, long: int) -> bytes:
+    if n < 16:
+        return bytes((fix | n,))
+    if n < 0x10000:
+        return struct.pack(">BH", short, n)
+    return struct.pack(">BI", long, n)
+
+
+def _pack_ext_ndarray(obj: np.ndarray, chunks: list, offset: int) -> int:
+    """Add chunks for ndarray as extension type
+
+    The payload is the length of its header, the header (dtype string and
+    shape), padding and then the array data aligned in the message
+    """
+    obj = np.ascontiguousarray(obj)
+    header = _mp_packb((obj.dtype.str, obj.shape))
+    start = offset + _EXT32_HEADER.size + 1 + len(header)
+    padding = -start % _ALIGNMENT
+    length = 1 + len(header) + padding + obj.nbytes
+    chunks.append(_EXT32_HEADER.pack(0xC9, length, NDARRAY_EXT_TYPE))
+    chunks.append(bytes((len(header),)) + header + bytes(padding))
+    chunks.append(obj.reshape(-1).view(np.uint8))
+    return offset + _EXT32_HEADER.size + length
+
+
+def _pack_ext(obj, chunks: list, offset: int) -> int:
+    """Add chunks for object and return offset after them"""
+    if isinstance(obj, dict):
+        chunk = _pack_header(len(obj), 0x80, 0xDE, 0xDF)
+        chunks.append(chunk)
+        offset += len(chunk)
+        for k, v in obj.items():
+            offset = _pack_ext(k, chunks, offset)
+            offset = _pack_ext(v, chunks, offset)
+        return offset
+    if isinstance(obj, (list, tuple)):
+        chunk = _pack_header(len(obj), 0x90, 0xDC, 0xDD)
+        chunks.append(chunk)
+        offset += len(chunk)
+        for i in obj:
+            offset = _pack_ext(i, chunks, offset)
+        return offset
+    if isinstance(obj, np.ndarray) and obj.dtype.kind in "biufc":
+        return _pack_ext_ndarray(obj, chunks, offset)
+    chunk = _mp_packb(obj, use_bin_type=True, default=encode_ndarray)
+    chunks.append(chunk)
+    return offset + len(chunk)
+
+
+def ws_pack(obj, array_format: ArrayFormat = ArrayFormat.dict) -> bytes | None:
     """Pack object for a websocket message
 
     Packs object by converting Pydantic models and ndarrays to dicts before
-    using MessagePack
+    using MessagePack. For ext format, ndarrays are packed as extension types
+    and their data is copied once into the message
     """
     if isinstance(obj, BaseModel):
         obj = obj.model_dump(by_alias=True)
+    if array_format == ArrayFormat.ext:
+        chunks = []
+        _pack_ext(obj, chunks, 0)
+        return b"".join(chunks)
     return _mp_packb(obj, use_bin_type=True, default=encode_ndarray)
 
 
+def _decode_ext(code: int, data: bytes):
+    if code != NDARRAY_EXT_TYPE:
+        return ExtType(code, data)
+    n = data[0]
+    dtype, shape = _mp_unpackb(data[1 : n + 1])
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    offset = len(data) - count * dtype.itemsize
+    return np.frombuffer(data, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+
 def ws_unpack(obj: bytes) -> dict[str, Any]:
     """Unpack a websocket message as a dict
 
-    Unpacks MessagePack object to dict (deserializes NumPy ndarrays)
+    Unpacks MessagePack object to dict (deserializes NumPy ndarrays in either
+    array format)
     """
-    return _mp_unpackb(obj, raw=False, object_hook=decode_ndarray)
+    return _mp_unpackb(obj, raw=False, object_hook=decode_ndarray, ext_hook=_decode_ext)
+
+
+OFFLOAD_THRESHOLD = 1 << 20
+"""Size in bytes of array data or message above which work is done in a
+worker thread instead of the event loop"""
+
+
+def array_nbytes(obj) -> int:
+    """Get total number of bytes in ndarrays of object"""
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, BaseModel):
+        return sum(array_nbytes(getattr(obj, f)) for f in type(obj).model_fields)
+    if isinstance(obj, dict):
+        return sum(array_nbytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(array_nbytes(i) for i in obj)
+    return 0
+
+
+async def offload(nbytes: int, func: Callable[..., T], *args) -> T:
+    """Call function in worker thread if number of bytes is at least the
+    offload threshold so event loop is not blocked
+
+    Parameters
+    ----------
+    nbytes : int
+        size of data processed by function
+    func : Callable
+        function to call
+    args
+        arguments of function
+
+    Returns
+    -------
+    result of function
+    """
+    if nbytes >= OFFLOAD_THRESHOLD:
+        return await run_in_threadpool(func, *args)
+    return func(*args)
+
+
+class PackedMessage:
+    """A message that is packed (and compressed) when first needed in each
+    array format and compression"""
+
+    def __init__(self, msg: BaseModel | None = None, packed: bytes | None = None):
+        self.msg = msg
+        self._packed: dict[tuple[ArrayFormat, Compression], bytes | None] = {}
+        if packed is not None:
+            self._packed[ArrayFormat.dict, Compression.none] = packed
+        self._nbytes: int | None = None
+
+    @property
+    def nbytes(self) -> int:
+        """Number of bytes in ndarrays of message"""
+        if self._nbytes is None:
+            self._nbytes = array_nbytes(self.msg)
+        return self._nbytes
+
+    async def prepare(self, formats: Iterable[tuple[ArrayFormat, Compression]]):
+        """Pack message in given array formats and compressions
+
+        This is done in a worker thread if message is large
+        """
+        if self.msg is None:
+            return
+        missing = [f for f in set(formats) if f not in self._packed]
+        if missing:
+
+            def _pack():
+                for f in missing:
+                    self.get(*f)
+
+            await offload(self.nbytes, _pack)
+
+    def get(
+        self,
+        array_format: ArrayFormat = ArrayFormat.dict,
+        compression: Compression = Compression.none,
+    ) -> bytes | None:
+        """Get message packed in given array format and compressed"""
+        if self.msg is None:  # only have message packed with dict format
+            array_format = ArrayFormat.dict
+        key = (array_format, compression)
+        if key not in self._packed:
+            if compression != Compression.none:
+                packed = self.get(array_format)
+                if packed is not None:
+                    packed = compress(packed, compression)
+            elif self.msg is not None:
+                packed = ws_pack(self.msg, array_format)
+            else:
+                return None
+            self._packed[key] = packed
+        return self._packed[key]
 
 
 _MESSAGE_PACK = "application/x-msgpack"
@@ -172,15 +407,12 @@ def message_unpack(func):
 
         return model_class(**obj)
 
-    async def wrapper(request: Request) -> Response:
-        ct = request.headers.get("Content-Type")
-        unpacker = ws_unpack if ct == _MESSAGE_PACK else j_loads
-        body = await request.body()
+    def _decode(unpacker, body: bytes) -> dict[str, Any]:
         unpacked = unpacker(body)
         if len(f_params) == 1:
-            kwargs = {k: _instantiate_obj(v, unpacked) for k, v in f_params.items()}
+            return {k: _instantiate_obj(v, unpacked) for k, v in f_params.items()}
         else:
-            kwargs = {
+            return {
                 # TODO something about missing parameters or extra items in unpacked
                 k: _instantiate_obj(
                     v,
@@ -190,6 +422,12 @@ def message_unpack(func):
                 if k in unpacked  # pyright: ignore[reportGeneralTypeIssues]
             }
 
+    async def wrapper(request: Request) -> Response:
+        ct = request.headers.get("Content-Type")
+        unpacker = ws_unpack if ct == _MESSAGE_PACK else j_loads
+        body = await request.body()
+        kwargs = await offload(len(body), _decode, unpacker, body)
+
         response = await func(**kwargs)
         if not isinstance(response, f_class):
             raise ValueError(
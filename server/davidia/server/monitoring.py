@@ -0,0 +1,81 @@
+from asyncio import CancelledError, Task, create_task, get_running_loop, sleep
+
+from pydantic import BaseModel
+
+
+class LoopLagStats(BaseModel):
+    """Statistics of event loop lag (in seconds)
+
+    Lag is how late a periodic task wakes up so it is the time for which
+    other work blocked the event loop
+    """
+
+    samples: int
+    last: float
+    mean: float
+    max: float
+
+
+class LoopLagMonitor:
+    """A class to measure how much the event loop is blocked
+
+    Parameters
+    ----------
+    interval : float
+        period in seconds between wake-ups
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self._task: Task | None = None
+        self.reset()
+
+    def reset(self):
+        """Reset statistics"""
+        self._samples = 0
+        self._total = 0.0
+        self._last = 0.0
+        self._max = 0.0
+
+    def record(self, lag: float):
+        """Record lag of a wake-up"""
+        self._samples += 1
+        self._total += lag
+        self._last = lag
+        if lag > self._max:
+            self._max = lag
+
+    @property
+    def stats(self) -> LoopLagStats:
+        n = self._samples
+        return LoopLagStats(
+            samples=n,
+            last=self._last,
+            mean=self._total / n if n > 0 else 0.0,
+            max=self._max,
+        )
+
+    def start(self):
+        """Start measuring lag of running event loop"""
+        if self._task is None:
+            self._task = create_task(self._measure(), name="loop lag monitor")
+
+    async def stop(self):
+        """Stop measuring lag"""
+        task = self._task
+        if task is None:
+            return
+        self._task = None
+        task.cancel()
+        try:
+            await task
+        except CancelledError:
+            pass
+
+    async def _measure(self):
+        loop = get_running_loop()
+        interval = self.interval
+        while True:
+            start = loop.time()
+            await sleep(interval)
+            self.record(max(loop.time() - start - interval, 0.0))
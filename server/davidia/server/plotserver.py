@@ -1,8 +1,20 @@
 from __future__ import annotations
 
 import logging
-from asyncio import Lock, Queue, QueueEmpty, sleep
-from collections import defaultdict
+from asyncio import (
+    AbstractEventLoop,
+    CancelledError,
+    Lock,
+    Queue,
+    Task,
+    create_task,
+    gather,
+    get_running_loop,
+    sleep,
+)
+from collections import OrderedDict, defaultdict
+from functools import partial
+from pathlib import Path
 from time import time_ns
 
 import numpy as np
@@ -17,28 +29,58 @@ from ..models.messages import (
     BatonMessage,
     _BasePlotMessage,
     _PlotDataMessage,
+    ClearLinesMessage,
     ClearPlotMessage,
     ClearSelectionsMessage,
+    ClientFrameMessage,
     ClientSelectionMessage,
     ClientStatusMessage,
     ClientLineParametersMessage,
     ClientScatterParametersMessage,
+    ClientTilesRequestMessage,
+    ClientViewportMessage,
     ColourMap,
     HeatmapData,
     ImageMessage,
+    ImagePatchMessage,
+    ImageStackMessage,
     LineData,
+    LineParamsMessage,
     MultiLineMessage,
     _BaseSelectionsMessage,
     SelectionsMessage,
     ScatterData,
     ScatterMessage,
+    ScatterParamsMessage,
+    StackFrameMessage,
     StatusType,
     SurfaceData,
     SurfaceMessage,
+    UpdateLinesMessage,
     ClientMessage,
+    EndPointMessage,
+    PushAckMessage,
 )
 from ..models.selections import SelectionBase
-from .fastapi_utils import ws_pack, ws_unpack, as_model
+from .compression import Compression, compress, is_available
+from .decimation import POINTS_PER_PIXEL, decimate_lines, max_points
+from .fastapi_utils import (
+    ArrayFormat,
+    PackedMessage,
+    as_model,
+    j_loads,
+    offload,
+    ws_pack,
+    ws_unpack,
+)
+from .pyramid import ImagePyramid
+from . import derivations as _derivations
+from .derivations import Derivation, DerivedLine
+from .reductions import Reducer, Reduction, reduced_image
+from .roi import MaskCache, RoiStats, roi_stats, roi_values, selection_key
+from .stack import MAX_PACKED_FRAMES, ImageStack
+from .shared import SharedBlocks, unpack_shared
+from .queues import ClientQueue, MessageKind, QueuePolicy, QueueStats, Snapshot
 
 logger = logging.getLogger("main")
 
@@ -62,21 +104,74 @@ def add_colour_to_lines(line_data: list[LineData]):
 class PlotClient:
     """A class to represent a Web UI client that plots
 
-    This manages a queue of messages to send to the client
+    This manages a queue of messages to send to the client. Once started, a
+    writer task sends queued messages so that a slow client does not delay
+    any other client
     """
 
-    def __init__(self, websocket: WebSocket, uuid: str):
+    def __init__(
+        self,
+        websocket: WebSocket,
+        uuid: str,
+        policy: QueuePolicy | None = None,
+        snapshot: Snapshot | None = None,
+        array_format: ArrayFormat = ArrayFormat.dict,
+        compression: Compression = Compression.none,
+        tiles: bool = False,
+    ):
         self.websocket = websocket
         self.uuid = uuid
-        self.queue = Queue()
+        self.array_format = array_format
+        self.tiles = tiles  # client requests tiles of image pyramids
+        if not is_available(compression):
+            logger.warning("Compression %s is not available", compression)
+            compression = Compression.none
+        self.compression = compression
+        self.queue = ClientQueue(policy, snapshot)
         self.name = ""
+        self.viewport: ClientViewportMessage | None = None
+        self.appended_points = 0
+        self.stack_id: str | None = None
+        # recently sent frames of stack and count of queue's discarded messages
+        self.stack_frames: OrderedDict[int, None] = OrderedDict()
+        self.stack_discarded = 0
+        self._loop: AbstractEventLoop | None = None
+        self._writer: Task | None = None
+
+    async def add_message(
+        self, message: bytes | PackedMessage, kind=MessageKind.control
+    ):
+        """Add message for client
 
-    async def add_message(self, message: bytes):
-        """Add message for client"""
+        Parameters
+        ----------
+        message : bytes | PackedMessage
+            packed message (or message to pack in client's array format)
+        kind : MessageKind
+            kind of message that determines whether it can be coalesced or dropped
+        """
+        packed = self.pack(message)
+        if packed is None:
+            return
+        message = packed
         logger.debug(
             "New message being added to client %s with name %s", self.uuid, self.name
         )
-        await self.queue.put(message)
+        loop = self._loop
+        if loop is not None and loop is not get_running_loop():
+            # writer waits in another event loop so wake it safely
+            item = await self.queue.prepare((message, kind))
+            loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        else:
+            await self.queue.put((message, kind))
+
+    def pack(self, message: bytes | PackedMessage | None) -> bytes | None:
+        """Get message packed in client's array format and compressed"""
+        if isinstance(message, PackedMessage):
+            return message.get(self.array_format, self.compression)
+        if message is None or self.compression == Compression.none:
+            return message
+        return compress(message, self.compression)
 
     def clear_queue(self):
         """Clear messages in client queue"""
@@ -85,18 +180,149 @@ class PlotClient:
             q.get_nowait()
             q.task_done()
 
-    async def send_next_message(self):
-        """Send next message in queue to client"""
+    def queue_stats(self) -> QueueStats:
+        """Get statistics of client's queue"""
+        q = self.queue
+        return QueueStats(
+            name=self.name,
+            uuid=self.uuid,
+            size=q.qsize(),
+            coalesced=q.coalesced,
+            dropped=q.dropped,
+        )
+
+    @property
+    def is_writing(self) -> bool:
+        """True if writer task is sending messages"""
+        return self._writer is not None and not self._writer.done()
+
+    def start(self):
+        """Start writer task that sends queued messages to client"""
+        if self._writer is None:
+            self._loop = get_running_loop()
+            self._writer = create_task(
+                self._send_messages(), name=f"writer for {self.name}"
+            )
+
+    async def stop(self):
+        """Stop writer task"""
+        writer = self._writer
+        if writer is None:
+            return
+        self._writer = None
+        self._loop = None
+        writer.cancel()
         try:
-            msg = self.queue.get_nowait()
-            self.queue.task_done()
-            await self.websocket.send_bytes(msg)
-        except QueueEmpty:
-            logger.debug("Queue for client %s is empty", self.uuid)
+            await writer
+        except CancelledError:
+            pass
+
+    async def _send_messages(self):
+        while True:
+            msg = await self.queue.get()
+            try:
+                await self.websocket.send_bytes(msg)
+            except Exception:
+                logger.warning(
+                    "Could not send message to client %s:%s",
+                    self.name,
+                    self.uuid,
+                    exc_info=True,
+                )
+                return
+            finally:
+                self.queue.task_done()
+
+
+class GrowableArray:
+    """A 1D array that can be extended in amortized constant time per item
+
+    Its capacity is doubled when full so appending a batch of n items only
+    copies existing items O(1) times on average. The view attribute is the
+    valid part of the buffer and is replaced on every extension; earlier views
+    remain valid as prefixes as the buffer is only ever written beyond them.
+    """
+
+    MIN_CAPACITY = 1024
+
+    def __init__(self, initial: DvDNDArray):
+        initial = np.ravel(initial)
+        self._size = initial.size
+        self._buffer = np.empty(
+            max(2 * self._size, GrowableArray.MIN_CAPACITY), dtype=initial.dtype
+        )
+        self._buffer[: self._size] = initial
+        self.view: DvDNDArray = self._buffer[: self._size]
+
+    @property
+    def capacity(self) -> int:
+        return self._buffer.size
+
+    def extend(self, data: DvDNDArray) -> DvDNDArray:
+        """Append data and return view of all items"""
+        data = np.ravel(data)
+        size = self._size
+        new_size = size + data.size
+        dtype = np.result_type(self._buffer, data)
+        if new_size > self._buffer.size or dtype != self._buffer.dtype:
+            buffer = np.empty(max(new_size, 2 * self._buffer.size), dtype=dtype)
+            buffer[:size] = self._buffer[:size]
+            self._buffer = buffer
+        self._buffer[size:new_size] = data
+        self._size = new_size
+        self.view = self._buffer[:new_size]
+        return self.view
+
+
+class LineBuffers:
+    """Growable buffers that back the coordinates of lines in a plot state
+
+    Buffers are matched to lines by key and only reused if the line still
+    holds the buffer's view, otherwise a new buffer is seeded from the line
+    """
+
+    def __init__(self):
+        self._arrays: dict[tuple[str, str], GrowableArray] = {}
+
+    def clear(self):
+        self._arrays.clear()
+
+    def discard(self, key: str):
+        """Remove buffers of line with given key"""
+        for axis in ("x", "y"):
+            self._arrays.pop((key, axis), None)
+
+    def extend(
+        self, key: str, axis: str, current: DvDNDArray | None, new: DvDNDArray | None
+    ) -> DvDNDArray | None:
+        """Append new to current coordinates of line with given key
+
+        Parameters
+        ----------
+        key : str
+            key of line
+        axis : str
+            name of coordinate
+        current : DvDNDArray | None
+            current coordinates of line
+        new : DvDNDArray | None
+            coordinates to append
+        """
+        if current is None:
+            return new
+        if new is None:
+            return current
+        buffer_key = (key, axis)
+        buffer = self._arrays.get(buffer_key)
+        if buffer is None or buffer.view is not current:
+            buffer = self._arrays[buffer_key] = GrowableArray(current)
+        return buffer.extend(new)
 
 
 def combine_line_messages(
-    ml_data_msg: MultiLineMessage, new_points_msg: MultiLineMessage
+    ml_data_msg: MultiLineMessage,
+    new_points_msg: MultiLineMessage,
+    buffers: LineBuffers | None = None,
 ) -> tuple[MultiLineMessage, MultiLineMessage]:
     """
     Adds indices to data message and appends points to current multi-line
@@ -108,10 +334,14 @@ def combine_line_messages(
         current data lines
     new_points_msg : MultiLineMessage
         new points to append to current data lines.
+    buffers : LineBuffers | None
+        buffers that back current data lines (if None, new ones are used)
     """
     if not new_points_msg.append:
         raise ValueError(f"New data is not marked as append: {new_points_msg}")
 
+    if buffers is None:
+        buffers = LineBuffers()
     current_lines = ml_data_msg.ml_data
     add_colour_to_lines(new_points_msg.ml_data)
     new_points = new_points_msg.ml_data
@@ -119,20 +349,14 @@ def combine_line_messages(
     current_lines_len = len(current_lines)
     new_points_len = len(new_points)
 
-    def _append(a: DvDNDArray | None, b: DvDNDArray | None):
-        if a is None:
-            return b
-        if b is None:
-            return a
-        return np.append(a, b)
-
     if not default_indices:
         combined_lines = [
-            LineData(
-                line_params=c.line_params,
-                x=_append(c.x, p.x),
-                y=np.append(c.y, p.y),
-                default_indices=False,
+            c.model_copy(
+                update={
+                    "x": buffers.extend(c.key, "x", c.x, p.x),
+                    "y": buffers.extend(c.key, "y", c.y, p.y),
+                    "default_indices": False,
+                }
             )
             for c, p in zip(current_lines, new_points)
         ]
@@ -149,31 +373,26 @@ def combine_line_messages(
         for c, p in zip(current_lines, new_points):
             c_y_size = c.y.size
             total_y_size = c_y_size + p.y.size
+            new_x = np.arange(
+                c_y_size,
+                total_y_size,
+                dtype=np.min_scalar_type(total_y_size),
+            )
             indexed_lines.append(
                 LineData(
                     line_params=p.line_params,
-                    x=np.arange(
-                        c_y_size,
-                        total_y_size,
-                        dtype=np.min_scalar_type(total_y_size),
-                    ),
+                    x=new_x,
                     y=p.y,
                     default_indices=True,
                 )
             )
             combined_lines.append(
-                LineData(
-                    line_params=c.line_params,
-                    x=_append(
-                        c.x,
-                        np.arange(
-                            c_y_size,
-                            total_y_size,
-                            dtype=np.min_scalar_type(total_y_size),
-                        ),
-                    ),
-                    y=np.append(c.y, p.y),
-                    default_indices=True,
+                c.model_copy(
+                    update={
+                        "x": buffers.extend(c.key, "x", c.x, new_x),
+                        "y": buffers.extend(c.key, "y", c.y, p.y),
+                        "default_indices": True,
+                    }
                 )
             )
         if current_lines_len > new_points_len:
@@ -200,8 +419,77 @@ def combine_line_messages(
     )
 
 
+def update_keyed_lines(
+    ml_data_msg: MultiLineMessage,
+    update_msg: UpdateLinesMessage,
+    line_index: dict[str, int],
+    buffers: LineBuffers | None = None,
+) -> list[LineData]:
+    """
+    Replaces or appends to lines of current multi-line data by key
+
+    Lines with new keys are added. Lines of the update message that use default
+    indices are given indices that follow on from the points of current lines
+
+    Parameters
+    ----------
+    ml_data_msg : MultiLineMessage
+        current data lines
+    update_msg : UpdateLinesMessage
+        lines to replace or append to current data lines.
+    line_index : dict[str, int]
+        position of each current line by key (updated for added lines)
+    buffers : LineBuffers | None
+        buffers that back current data lines (if None, new ones are used)
+
+    Returns updated lines
+    """
+    if buffers is None:
+        buffers = LineBuffers()
+    lines = list(ml_data_msg.ml_data)
+    for p in update_msg.update_lines:
+        i = line_index.get(p.key)
+        c = None if i is None else lines[i]
+        if p.x is None or p.default_indices:
+            start = c.y.size if update_msg.append and c is not None else 0
+            end = start + p.y.size
+            p.x = np.arange(start, end, dtype=np.min_scalar_type(end))
+            p.default_indices = True
+        if c is None:
+            if not p.line_params.colour:
+                p.line_params.colour = COLOURLIST[len(lines) % len(COLOURLIST)]
+            line_index[p.key] = len(lines)
+            lines.append(p)
+        elif update_msg.append:
+            lines[i] = c.model_copy(
+                update={
+                    "x": buffers.extend(c.key, "x", c.x, p.x),
+                    "y": buffers.extend(c.key, "y", c.y, p.y),
+                }
+            )
+        else:
+            if not p.line_params.colour:
+                p.line_params.colour = c.line_params.colour
+            if not p.line_params.name:
+                p.line_params.name = c.line_params.name
+            buffers.discard(c.key)
+            lines[i] = p
+    return check_line_names(lines)
+
+
 class PlotState:
-    """Class for representing the state of a plot"""
+    """Class for representing the state of a plot
+
+    The packed data message for new clients is a snapshot of the current data
+    that is built on demand and kept until the data changes. For an image with
+    a pyramid, it is the overview of the image (for clients that request tiles)
+    and for an image stack, it is the frame at the cursor
+
+    For multi-line data, an index of the position of each line by key is kept
+
+    The data version is increased whenever the current data changes so results
+    derived from data can be kept until then
+    """
 
     def __init__(
         self,
@@ -212,13 +500,114 @@ class PlotState:
         new_baton_message=None,
         current_baton=None,
     ):
-        self.new_data_message: bytes | None = new_data_message
+        self._data_message: PackedMessage | None = None
+        self._full_message: PackedMessage | None = None
+        self._line_index: dict[str, int] | None = None
+        self.data_version = 0
+        self.new_data_message = new_data_message
         self.new_selections_message: bytes | None = new_selections_message
         self.new_baton_message: bytes | None = new_baton_message
         self.current_data: _PlotDataMessage | None = current_data
         self.current_selections: list[SelectionBase] | None = current_selections
         self.current_baton: str | None = current_baton
+        self.line_buffers = LineBuffers()
+        self.pyramid: ImagePyramid | None = None
+        self.stack: ImageStack | None = None
+        self.frame = 0  # cursor of image stack
+        self.shared_blocks: SharedBlocks | None = None
         self.lock = Lock()
+        self.update_lock = Lock()  # keeps updates in order while packing
+
+    @property
+    def current_data(self) -> _PlotDataMessage | None:
+        """Current data of plot"""
+        return self._current_data
+
+    @current_data.setter
+    def current_data(self, data: _PlotDataMessage | None):
+        self._current_data = data
+        self._line_index = None
+
+    @property
+    def line_index(self) -> dict[str, int]:
+        """Position of each line of current multi-line data by key"""
+        if self._line_index is None:
+            data = self._current_data
+            lines = data.ml_data if isinstance(data, MultiLineMessage) else []
+            self._line_index = {ld.key: i for i, ld in enumerate(lines)}
+        return self._line_index
+
+    def set_lines(self, lines: list[LineData], line_index: dict[str, int] | None):
+        """Set lines of current multi-line data and their index (or None to
+        rebuild it when needed)
+
+        The current data is copied so any earlier message of it is unchanged
+        """
+        data = self._current_data
+        assert isinstance(data, MultiLineMessage)
+        self._current_data = data.model_copy(update={"ml_data": lines})
+        self._line_index = line_index
+
+    @property
+    def data_message(self) -> PackedMessage | None:
+        """Message of current data (packed on demand in each array format)"""
+        if self._data_changed:
+            if self.pyramid is not None:
+                data = self.pyramid.overview_message()
+            elif self.stack is not None:
+                data = self.stack.frame_message(self.frame)
+            else:
+                data = self.current_data
+            self._data_message = None if data is None else PackedMessage(data)
+            self._data_changed = False
+        return self._data_message
+
+    def client_data_message(self, tiles: bool) -> PackedMessage | None:
+        """Message of current data for a client
+
+        Clients that do not request tiles get the full resolution image
+        instead of the overview of its pyramid
+
+        Parameters
+        ----------
+        tiles : bool
+            client requests tiles of image pyramids
+        """
+        if tiles or self.pyramid is None:
+            return self.data_message
+        if self._full_message is None:
+            self._full_message = PackedMessage(self.current_data)
+        return self._full_message
+
+    @property
+    def new_data_message(self) -> bytes | None:
+        """Packed message of current data (packed on demand if data has changed)"""
+        data_message = self.data_message
+        return None if data_message is None else data_message.get()
+
+    @new_data_message.setter
+    def new_data_message(self, message: bytes | None):
+        self._data_message = None if message is None else PackedMessage(packed=message)
+        self._full_message = None
+        self._data_changed = False
+
+    def mark_data_changed(self):
+        """Mark current data as changed so its packed message is stale"""
+        self.data_version += 1
+        self.mark_snapshot_changed()
+
+    def mark_snapshot_changed(self):
+        """Mark packed message of current data as stale (without changing data)"""
+        self._data_message = None
+        self._full_message = None
+        self._data_changed = True
+
+    def set_shared_blocks(self, blocks: SharedBlocks | None):
+        """Set shared memory blocks that back current data and release any
+        previous blocks"""
+        if self.shared_blocks is not None and self.shared_blocks is not blocks:
+            self.shared_blocks.release()
+        self.shared_blocks = blocks
 
     def clear(self):
         """Clear all current and new data and selections"""
@@ -226,6 +615,10 @@ class PlotState:
         self.new_selections_message = None
         self.current_data = None
         self.current_selections = None
+        self.line_buffers.clear()
+        self.pyramid = None
+        self.stack = None
+        self.set_shared_blocks(None)
 
 
 class PlotServer:
@@ -238,39 +631,78 @@ class PlotServer:
         The data processor.
     _clients : dict[str, list[PlotClient]]
         A dictionary containing all plot clients per plot ID.
-    client_status : StatusType
-        The status of the client.
     baton: str | None
         Current baton uuid
     plot_states : dict[str, PlotState] = defaultdict(PlotState)
         A dictionary containing plot states per plot_id
     client_total : int
         Number of clients added to server
+    queue_policy : QueuePolicy
+        Policy for queues of messages to clients
+    reducer : Reducer
+        Reducer of image stacks (which keeps recent results)
+    masks : MaskCache
+        Masks of selections kept for each plot and version of its data
+    _region_subscribers : dict[str, list[Queue]]
+        A dictionary containing queues of latest selections for subscribers
+        per plot ID
+    _derived_lines : dict[str, list[DerivedLine]]
+        A dictionary containing lines derived from regions per plot ID
     """
 
-    def __init__(self):
+    def __init__(self, queue_policy: QueuePolicy | None = None):
         self._clients: dict[str, list[PlotClient]] = defaultdict(list)
-        self.client_status: StatusType = StatusType.busy
         self.uuids: list[str] = []
         self.baton: str | None = None
         self.plot_states: dict[str, PlotState] = defaultdict(PlotState)
         self.client_total = 0
+        self.queue_policy = QueuePolicy() if queue_policy is None else queue_policy
         self.last_colour_maps: dict[str, ColourMap] = defaultdict(
             lambda: ColourMap.Greys
         )
+        self.reducer = Reducer()
+        self.masks = MaskCache()
+        self._region_subscribers: dict[str, list[Queue[list[SelectionBase]]]] = (
+            defaultdict(list)
+        )
+        self._derived_lines: dict[str, list[DerivedLine]] = defaultdict(list)
+        self._derive_tasks: dict[str, Task] = {}
+        self._derive_pending: set[str] = set()  # changed while deriving lines
 
     async def add_client(
-        self, plot_id: str, websocket: WebSocket, uuid: str
+        self,
+        plot_id: str,
+        websocket: WebSocket,
+        uuid: str,
+        array_format: ArrayFormat = ArrayFormat.dict,
+        compression: Compression = Compression.none,
+        tiles: bool = False,
     ) -> PlotClient:
         """Add a client given by a plot ID and websocket
         Parameters
         ----------
         plot_id : str
         websocket: WebSocket
+        uuid : str
+        array_format : ArrayFormat
+            format of ndarrays in messages sent to client
+        compression : Compression
+            compression of messages sent to client
+        tiles : bool
+            client requests tiles of image pyramids (otherwise it is sent
+            full resolution images)
 
         Returns the added client
         """
-        client = PlotClient(websocket, uuid)
+        client = PlotClient(
+            websocket,
+            uuid,
+            self.queue_policy,
+            lambda: self._packed_client_snapshot(plot_id, client),
+            array_format,
+            compression,
+            tiles,
+        )
         client.name = f"{plot_id}:{self.client_total}"
         self.client_total += 1
         self._clients[plot_id].append(client)
@@ -280,8 +712,12 @@ class PlotServer:
         if plot_id in self.plot_states:
             plot_state = self.plot_states[plot_id]
             async with plot_state.lock:
-                if plot_state.new_data_message:
-                    await client.add_message(plot_state.new_data_message)
+                data_message = plot_state.client_data_message(client.tiles)
+                if data_message is not None:
+                    await data_message.prepare(
+                        [(client.array_format, client.compression)]
+                    )
+                    await client.add_message(data_message, MessageKind.replace)
                 if plot_state.new_selections_message:
                     await client.add_message(plot_state.new_selections_message)
         if not self.baton:
@@ -320,6 +756,7 @@ class PlotServer:
         -------
         True if messages updated
         """
+        await client.stop()
         try:
             self._clients[plot_id].remove(client)
         except ValueError:
@@ -359,7 +796,6 @@ class PlotServer:
             if msg is not None:
                 for c in self.clients_with_uuid(self.baton):
                     await c.add_message(msg)
-            await self.send_next_message()
         else:
             logger.warning("Ignoring baton request by unknown %s", requester)
 
@@ -409,6 +845,7 @@ class PlotServer:
             plot_state = self.plot_states[plot_id]
             async with plot_state.lock:
                 plot_state.clear()
+                self._notify_regions(plot_id, [])
 
     async def get_regions(self, plot_id: str) -> list[SelectionBase]:
         """
@@ -425,6 +862,193 @@ class PlotServer:
             cs = plot_state.current_selections
             return [] if cs is None else list(cs)
 
+    async def subscribe_regions(self, plot_id: str) -> Queue[list[SelectionBase]]:
+        """
+        Subscribe to selections of plot
+
+        Parameters
+        ----------
+        plot_id : str
+
+        Returns queue that holds latest list of selections (which initially are
+        the current selections)
+        """
+        queue: Queue[list[SelectionBase]] = Queue(maxsize=1)
+        plot_state = self.plot_states[plot_id]
+        async with plot_state.lock:
+            queue.put_nowait(list(plot_state.current_selections or []))
+            self._region_subscribers[plot_id].append(queue)
+        return queue
+
+    def unsubscribe_regions(self, plot_id: str, queue: Queue[list[SelectionBase]]):
+        """Remove subscription to selections of plot"""
+        try:
+            self._region_subscribers[plot_id].remove(queue)
+        except ValueError:
+            logger.warning("Region subscriber of %s does not exist", plot_id)
+
+    def _notify_regions(self, plot_id: str, selections: list[SelectionBase]):
+        """Put selections in queues of subscribers (replacing any not yet sent)"""
+        for q in self._region_subscribers.get(plot_id, ()):
+            if q.full():
+                q.get_nowait()
+            q.put_nowait(list(selections))
+
+    async def add_derivation(self, derivation: Derivation) -> str:
+        """
+        Add line derived from region of plot that is shown in target plot
+
+        The line is derived again whenever the region or the plot's data
+        changes
+
+        Parameters
+        ----------
+        derivation : Derivation
+
+        Returns ID of derivation
+        """
+        if derivation.target_id == derivation.plot_id:
+            raise ValueError("Target plot must differ from plot with region")
+        self._derived_lines[derivation.plot_id].append(DerivedLine(derivation))
+        self._schedule_derivations(derivation.plot_id)
+        return derivation.id
+
+    async def remove_derivation(self, derivation_id: str) -> bool:
+        """
+        Remove derivation and its line from target plot
+
+        Parameters
+        ----------
+        derivation_id : str
+
+        Returns True if derivation was removed
+        """
+        for lines in self._derived_lines.values():
+            for dl in lines:
+                derivation = dl.derivation
+                if derivation.id == derivation_id:
+                    lines.remove(dl)
+                    await self.update(
+                        ClearLinesMessage(
+                            plot_id=derivation.target_id, line_keys=[derivation_id]
+                        )
+                    )
+                    return True
+        return False
+
+    def _schedule_derivations(self, plot_id: str):
+        """Derive lines from regions of plot once changes have been gathered
+
+        Only one task derives lines of a plot. Changes made while it derives
+        lines are gathered and derived again by the same task
+        """
+        if not self._derived_lines.get(plot_id):
+            return
+        if plot_id in self._derive_tasks:
+            self._derive_pending.add(plot_id)
+            return
+        task = create_task(
+            self._run_derivations(plot_id), name=f"derivations of {plot_id}"
+        )
+        task.add_done_callback(partial(self._derivations_done, plot_id))
+        self._derive_tasks[plot_id] = task
+
+    def _derivations_done(self, plot_id: str, task: Task):
+        if self._derive_tasks.get(plot_id) is task:
+            del self._derive_tasks[plot_id]
+        if not task.cancelled() and (e := task.exception()) is not None:
+            logger.error("Could not derive lines of %s", plot_id, exc_info=e)
+        if plot_id in self._derive_pending:  # changed after task finished
+            self._derive_pending.discard(plot_id)
+            self._schedule_derivations(plot_id)
+
+    async def _run_derivations(self, plot_id: str):
+        while True:
+            await sleep(_derivations.DEBOUNCE_INTERVAL)
+            self._derive_pending.discard(plot_id)
+            await self._derive_lines(plot_id)
+            if plot_id not in self._derive_pending:
+                return
+
+    async def _derive_lines(self, plot_id: str):
+        plot_state = self.plot_states[plot_id]
+        async with plot_state.lock:
+            data = plot_state.current_data
+            version = plot_state.data_version
+            frame = plot_state.frame
+            selections = list(plot_state.current_selections or [])
+        try:
+            values, make_mask = roi_values(data, frame)
+        except ValueError:
+            logger.debug("Cannot derive lines from data of %s", plot_id)
+            return
+        assert data is not None
+        derived = [
+            (dl, s)
+            for dl in self._derived_lines[plot_id]
+            if (s := dl.find_selection(selections)) is not None
+        ]
+
+        def _derive() -> list[UpdateLinesMessage]:
+            messages = []
+            for dl, s in derived:
+                key = (plot_id, version, selection_key(s))
+                try:
+                    mask = self.masks.get(key, lambda: make_mask(s))
+                    msg = dl.derive(data, values, s, mask, version, frame)
+                except (NotImplementedError, ValueError):
+                    logger.warning(
+                        "Could not derive line %s", dl.derivation.id, exc_info=True
+                    )
+                    continue
+                if msg is not None:
+                    messages.append(msg)
+            return messages
+
+        for msg in await offload(values.nbytes, _derive):
+            await self.update(msg)
+
+    async def get_roi_stats(
+        self, plot_id: str, selection_id: str | None = None
+    ) -> list[RoiStats]:
+        """
+        Get statistics of plot's heatmap or scatter data in its selections
+
+        Masks of selections are kept until the data changes so repeated
+        requests only gather the values in each selection
+
+        Parameters
+        ----------
+        plot_id : str
+        selection_id : str | None
+            ID of selection (if None, all selections)
+
+        Returns list of statistics for each selection
+        """
+        plot_state = self.plot_states[plot_id]
+        async with plot_state.lock:
+            data = plot_state.current_data
+            version = plot_state.data_version
+            frame = plot_state.frame
+            selections = list(plot_state.current_selections or [])
+        if selection_id is not None:
+            selections = [s for s in selections if s.id == selection_id]
+        values, make_mask = roi_values(data, frame)
+
+        def _stats() -> list[RoiStats]:
+            stats = []
+            for s in selections:
+                key = (plot_id, version, selection_key(s))
+                try:
+                    mask = self.masks.get(key, lambda: make_mask(s))
+                except NotImplementedError:
+                    logger.warning("Ignoring selection %s of %s", s.id, plot_id)
+                    continue
+                stats.append(roi_stats(s.id, values, mask))
+            return stats
+
+        return await offload(values.nbytes, _stats)
+
     async def clear_queues(self, plot_id: str):
         """
         Clears current data, selections and queues for a given plot ID
@@ -451,7 +1075,6 @@ class PlotServer:
         if msg is not None:
             for c in self._clients[plot_id]:
                 await c.add_message(msg)
-        await self.send_next_message()
 
     async def clear_plots_and_queues(self, plot_id: str):
         """
@@ -475,12 +1098,9 @@ class PlotServer:
         pause = params.pause
         for _ in range(params.iterations):
             for msg in b(params.params):
-                msg = ws_pack(msg)
-                if msg is None:
-                    continue
+                msg = PackedMessage(msg)
                 for c in self._clients[plot_id]:
                     await c.add_message(msg)
-                await self.send_next_message()
                 if start == -1:
                     await sleep(1)  # allow more time to setup plot
                     start = time_ns()
@@ -489,96 +1109,126 @@ class PlotServer:
 
         return f"Finished in {int((time_ns() - start) / 1000000)}ms"
 
-    async def send_next_message(self):
-        """Sends the next response on the response list and updates the client status"""
-        if self.clients_available():
-            self.client_status = StatusType.busy
-            for cl in self._clients.values():
-                for c in cl:
-                    await c.send_next_message()
-
-    def convert_line_params_to_data_message(
+    def update_line_params(
         self, plot_id: str, line_params: ClientLineParametersMessage
-    ) -> MultiLineMessage:
+    ) -> LineParamsMessage:
         """
-        Creates new MultiLineMessage from existing line data and new parameters
+        Updates parameters of line in current multi-line data
+
+        The current data is copied so any earlier message of it is unchanged
 
         Parameters
         ----------
         plot_id: str
             id of plot for which to update data
-        line_param_msg : ClientLineParametersMessage
-            line with updates parameters.
+        line_params : ClientLineParametersMessage
+            line with updated parameters.
+
+        Returns message of line's new parameters for clients
         """
 
-        ml_data_msg = self.plot_states[plot_id].current_data
+        plot_state = self.plot_states[plot_id]
+        ml_data_msg = plot_state.current_data
         if not isinstance(ml_data_msg, MultiLineMessage):
             raise ValueError(
                 f"Wrong type of message given: MultiLineMessage expected: {type(ml_data_msg)}"
             )
 
-        current_lines = ml_data_msg.ml_data
-        modified_line_params = line_params.line_params
-        updated_lines = []
-        key_found = False
-
-        for line in current_lines:
-            if not key_found and line.key == line_params.key:
-                updated_line = LineData(
-                    key=line.key,
-                    line_params=modified_line_params,
-                    x=line.x,
-                    y=line.y,
-                    default_indices=line.default_indices,
-                )
-                updated_lines.append(updated_line)
-                key_found = True
-            else:
-                updated_lines.append(line)
-
-        if not key_found:
+        i = plot_state.line_index.get(line_params.key)
+        if i is None:
             raise ValueError(
-                f"No line with key {line_params.key} found in current line data {current_lines}"
+                f"No line with key {line_params.key} found in current line data"
             )
 
-        add_colour_to_lines(updated_lines)
+        line = ml_data_msg.ml_data[i]
+        params = line_params.line_params.model_copy()
+        if not params.colour:
+            params.colour = COLOURLIST[i % len(COLOURLIST)]
+        lines = list(ml_data_msg.ml_data)
+        lines[i] = line.model_copy(update={"line_params": params})
+        plot_state.set_lines(lines, plot_state.line_index)
+        return LineParamsMessage(plot_id=plot_id, key=line.key, line_params=params)
 
-        return MultiLineMessage(
-            ml_data=updated_lines, plot_config=ml_data_msg.plot_config
-        )
-
-    def convert_scatter_params_to_data_message(
+    def update_scatter_params(
         self, plot_id: str, scatter_params: ClientScatterParametersMessage
-    ) -> ScatterMessage:
+    ) -> ScatterParamsMessage:
         """
-        Creates new ScatterMessage from existing scatter data and new parameters
+        Updates parameters of current scatter data
+
+        The current data is copied so any earlier message of it is unchanged
 
         Parameters
         ----------
         plot_id: str
             id of plot for which to update data
-        scatter_param_msg : ClientScatterParametersMessage
+        scatter_params : ClientScatterParametersMessage
             scatter data parameters.
+
+        Returns message of new parameters for clients
         """
 
-        sc_data_msg = self.plot_states[plot_id].current_data
+        plot_state = self.plot_states[plot_id]
+        sc_data_msg = plot_state.current_data
         if not isinstance(sc_data_msg, ScatterMessage):
             raise ValueError(
                 f"Wrong type of message given: ScatterMessage expected: {type(sc_data_msg)}"
             )
 
-        sc_data = sc_data_msg.sc_data
-
-        updated_data = ScatterData(
-            x=sc_data.x,
-            y=sc_data.y,
-            point_values=sc_data.point_values,
-            domain=sc_data.domain,
-            colour_map=sc_data.colour_map,
-            point_size=scatter_params.point_size,
+        sc_data = sc_data_msg.sc_data.model_copy(
+            update={"point_size": scatter_params.point_size}
+        )
+        plot_state.current_data = sc_data_msg.model_copy(update={"sc_data": sc_data})
+        return ScatterParamsMessage(
+            plot_id=plot_id, point_size=scatter_params.point_size
         )
 
-        return ScatterMessage(sc_data=updated_data, plot_config=sc_data_msg.plot_config)
+    def patch_image(self, plot_id: str, patch: ImagePatchMessage):
+        """
+        Writes patch into values of current image data
+
+        The values are copied first if they are read-only
+
+        Parameters
+        ----------
+        plot_id: str
+            id of plot for which to update data
+        patch : ImagePatchMessage
+            patch of values and its offset
+        """
+        plot_state = self.plot_states[plot_id]
+        im_msg = plot_state.current_data
+        if not isinstance(im_msg, ImageMessage):
+            raise ValueError(
+                f"Wrong type of message given: ImageMessage expected: {type(im_msg)}"
+            )
+
+        im_data = im_msg.im_data
+        values = im_data.values
+        patch_values = patch.patch_values
+        x0, y0 = patch.offset
+        rows, cols = patch_values.shape[:2]
+        if (
+            x0 < 0
+            or y0 < 0
+            or y0 + rows > values.shape[0]
+            or x0 + cols > values.shape[1]
+            or patch_values.shape[2:] != values.shape[2:]
+        ):
+            raise ValueError(
+                f"Patch of shape {patch_values.shape} at {patch.offset} does not fit in image of shape {values.shape}"
+            )
+
+        pyramid = plot_state.pyramid
+        if not values.flags.writeable:
+            values = im_data.values = np.array(values)
+            if pyramid is not None:
+                pyramid.levels[0] = values
+        if patch.domain is not None and isinstance(im_data, HeatmapData):
+            im_data.domain = patch.domain
+        if pyramid is None:
+            values[y0 : y0 + rows, x0 : x0 + cols] = patch_values
+        else:
+            pyramid.update(x0, y0, patch_values)
 
     def combine_line_messages(
         self, plot_id: str, new_points_msg: MultiLineMessage
@@ -594,12 +1244,15 @@ class PlotServer:
         new_points_msg : MultiLineMessage
             new points to append to current data lines.
         """
-        ml_data_msg = self.plot_states[plot_id].current_data
+        plot_state = self.plot_states[plot_id]
+        ml_data_msg = plot_state.current_data
         if not isinstance(ml_data_msg, MultiLineMessage):
             raise ValueError(
                 f"Wrong type of message given: MultiLineMessage expected: {type(ml_data_msg)}"
             )
-        return combine_line_messages(ml_data_msg, new_points_msg)
+        return combine_line_messages(
+            ml_data_msg, new_points_msg, plot_state.line_buffers
+        )
 
     async def update_plot_states_with_message(
         self,
@@ -610,7 +1263,8 @@ class PlotServer:
         | ClientSelectionMessage
         | ClientLineParametersMessage
         | ClientScatterParametersMessage,
-    ) -> bytes | None:
+        shared: SharedBlocks | None = None,
+    ) -> bytes | PackedMessage | None:
         """Indexes and combines line messages if needed and updates plot states
 
         Parameters
@@ -620,10 +1274,19 @@ class PlotServer:
         msg : _BasePlotMessage | _BaseSelectionsMessage | BatonMessage | ClientSelectionMessage |
          ClientLineParametersMessage | ClientScatterParametersMessage
             A message for plot states.
+        shared : SharedBlocks | None
+            shared memory blocks that back arrays of message
+
+        Returns packed message for clients (data messages are packed on demand
+        in the array format of each client)
         """
         plot_state = self.plot_states[plot_id]
         new_msg = None
         logger.debug("Updating plot state with %s", type(msg))
+        pyramid = None
+        if isinstance(msg, ImageMessage) and msg.im_data.tile_size:
+            # clients get overview and request tiles when zoomed in
+            pyramid = await offload(msg.im_data.values.nbytes, ImagePyramid, msg)
         async with plot_state.lock:
             match msg:
                 case BatonMessage():
@@ -654,18 +1317,16 @@ class PlotServer:
                     else:
                         plot_state.current_selections = msg.set_selections
                         new_msg = plot_state.new_selections_message = ws_pack(msg)
+                    self._notify_regions(plot_id, plot_state.current_selections)
 
                 case ClientLineParametersMessage():
-                    msg = plot_state.current_data = (
-                        self.convert_line_params_to_data_message(plot_id, msg)
-                    )
-                    new_msg = plot_state.new_data_message = ws_pack(msg)
+                    # clients patch their lines so only parameters are sent
+                    new_msg = ws_pack(self.update_line_params(plot_id, msg))
+                    plot_state.mark_data_changed()
 
                 case ClientScatterParametersMessage():
-                    msg = plot_state.current_data = (
-                        self.convert_scatter_params_to_data_message(plot_id, msg)
-                    )
-                    new_msg = plot_state.new_data_message = ws_pack(msg)
+                    new_msg = ws_pack(self.update_scatter_params(plot_id, msg))
+                    plot_state.mark_data_changed()
 
                 case ClearSelectionsMessage():
                     ids = msg.selection_ids
@@ -681,6 +1342,7 @@ class PlotServer:
                     plot_state.new_selections_message = ws_pack(
                         SelectionsMessage(set_selections=current)
                     )
+                    self._notify_regions(plot_id, current)
                     new_msg = ws_pack(msg)
 
                 case MultiLineMessage():
@@ -693,26 +1355,102 @@ class PlotServer:
                     ]
                     msg.ml_data = check_line_names(data)
 
-                    if msg.append:
-                        if isinstance(plot_state.current_data, MultiLineMessage):
-                            combined_msgs, indexed_append_msgs = (
-                                self.combine_line_messages(plot_id, msg)
-                            )
-                            plot_state.current_data = combined_msgs
-                            plot_state.new_data_message = ws_pack(
-                                plot_state.current_data
-                            )
-                            msg = indexed_append_msgs
-                        else:
-                            add_default_indices(msg)
-                            add_colour_to_lines(msg.ml_data)
-
+                    if msg.append and isinstance(
+                        plot_state.current_data, MultiLineMessage
+                    ):
+                        combined_msgs, indexed_append_msgs = self.combine_line_messages(
+                            plot_id, msg
+                        )
+                        plot_state.current_data = combined_msgs
+                        plot_state.set_shared_blocks(None)  # lines were copied
+                        plot_state.mark_data_changed()
+                        new_msg = PackedMessage(indexed_append_msgs)
                     else:
-                        add_indices(msg)
+                        if msg.append:
+                            add_default_indices(msg)
+                        else:
+                            add_indices(msg)
                         add_colour_to_lines(msg.ml_data)
 
+                        plot_state.current_data = msg
+                        plot_state.line_buffers.clear()
+                        plot_state.set_shared_blocks(shared)
+                        plot_state.pyramid = None
+                        plot_state.stack = None
+                        plot_state.mark_data_changed()
+                        new_msg = plot_state.data_message
+
+                case UpdateLinesMessage():
+                    current_data = plot_state.current_data
+                    if isinstance(current_data, MultiLineMessage):
+                        line_index = plot_state.line_index
+                        lines = update_keyed_lines(
+                            current_data, msg, line_index, plot_state.line_buffers
+                        )
+                        plot_state.set_lines(lines, line_index)
+                        new_msg = PackedMessage(msg)
+                    else:
+                        ml_msg = MultiLineMessage(
+                            plot_id=plot_id, ml_data=msg.update_lines
+                        )
+                        add_indices(ml_msg)
+                        check_line_names(ml_msg.ml_data)
+                        add_colour_to_lines(ml_msg.ml_data)
+                        plot_state.current_data = ml_msg
+                        plot_state.line_buffers.clear()
+                        plot_state.set_shared_blocks(shared)
+                        plot_state.pyramid = None
+                        plot_state.stack = None
+                        new_msg = None  # sent as whole data below
+                    plot_state.mark_data_changed()
+                    if new_msg is None:
+                        new_msg = plot_state.data_message
+
+                case ImageStackMessage():
+                    stack_data = msg.stack_data
+                    if isinstance(stack_data, HeatmapData):
+                        cm_id = "HM:" + plot_id
+                        if stack_data.colour_map:
+                            self.last_colour_maps[cm_id] = stack_data.colour_map
+                        else:
+                            stack_data.colour_map = self.last_colour_maps[cm_id]
+                    stack = ImageStack(msg)
                     plot_state.current_data = msg
-                    new_msg = plot_state.new_data_message = ws_pack(msg)
+                    plot_state.line_buffers.clear()
+                    plot_state.set_shared_blocks(shared)
+                    plot_state.pyramid = None
+                    plot_state.stack = stack
+                    plot_state.frame = stack.clamp(msg.frame)
+                    plot_state.mark_data_changed()
+                    new_msg = plot_state.data_message
+
+                case ImagePatchMessage():
+                    await offload(
+                        msg.patch_values.nbytes, self.patch_image, plot_id, msg
+                    )
+                    plot_state.mark_data_changed()
+                    if plot_state.pyramid is None:
+                        new_msg = PackedMessage(msg)
+                    else:  # clients of tiled images get new overview
+                        new_msg = plot_state.data_message
+
+                case ClearLinesMessage():
+                    current_data = plot_state.current_data
+                    line_index = plot_state.line_index
+                    keys = [k for k in msg.line_keys if k in line_index]
+                    if not keys or not isinstance(current_data, MultiLineMessage):
+                        return None
+                    removed = set(keys)
+                    for k in keys:
+                        plot_state.line_buffers.discard(k)
+                    lines = [ld for ld in current_data.ml_data if ld.key not in removed]
+                    if lines:
+                        plot_state.set_lines(lines, None)
+                    else:
+                        plot_state.current_data = None
+                        plot_state.set_shared_blocks(None)
+                    plot_state.mark_data_changed()
+                    new_msg = ws_pack(msg.model_copy(update={"line_keys": keys}))
 
                 case _PlotDataMessage():
 
@@ -734,30 +1472,325 @@ class PlotServer:
                         check_cm("SU:" + plot_id, msg.su_data)
 
                     plot_state.current_data = msg
-                    new_msg = plot_state.new_data_message = ws_pack(msg)
+                    plot_state.line_buffers.clear()
+                    plot_state.set_shared_blocks(shared)
+                    plot_state.pyramid = pyramid
+                    plot_state.stack = None
+                    plot_state.mark_data_changed()
+                    new_msg = plot_state.data_message
 
                 case _:
                     logger.warning("Did not handle update of %s", msg)
                     new_msg = None
 
+        if new_msg is not None and not isinstance(msg, BatonMessage):
+            self._schedule_derivations(plot_id)
         return new_msg
 
-    async def update(self, msg: _BasePlotMessage):
+    async def update(self, msg: _BasePlotMessage, shared: SharedBlocks | None = None):
         """Processes any plot message into a client message and adds that to any client
 
         Parameters
         ----------
         msg : _BasePlotMessage
             A client message for processing.
+        shared : SharedBlocks | None
+            shared memory blocks that back arrays of message (these are kept
+            while message is current data of plot or else released)
+        """
+        await self._update_and_add_message(msg.plot_id, msg, None, shared)
+
+    async def update_batch(self, messages: list[EndPointMessage]):
+        """Processes batch of plot messages and adds them to clients
+
+        Messages are applied in order for each plot and plots are updated
+        concurrently
+
+        Parameters
+        ----------
+        messages : list[EndPointMessage]
+            messages for processing
+        """
+        by_plot: dict[str, list[EndPointMessage]] = defaultdict(list)
+        for m in messages:
+            by_plot[m.plot_id].append(m)
+
+        async def _update_plot(plot_id: str, plot_messages: list[EndPointMessage]):
+            for m in plot_messages:
+                await self._update_and_add_message(plot_id, m, None)
+
+        await gather(*(_update_plot(p, ms) for p, ms in by_plot.items()))
+
+    async def _update_and_add_message(
+        self, plot_id, processed_msg, omit_client, shared: SharedBlocks | None = None
+    ):
+        plot_state = self.plot_states[plot_id]
+        try:
+            async with plot_state.update_lock:
+                new_msg = await self.update_plot_states_with_message(
+                    plot_id, processed_msg, shared
+                )
+                if new_msg is None:
+                    return
+                if isinstance(new_msg, bytes):  # compress once for all clients
+                    new_msg = PackedMessage(packed=new_msg)
+                clients = [c for c in self._clients[plot_id] if c is not omit_client]
+                full_msg = None
+                if plot_state.pyramid is not None and isinstance(
+                    processed_msg, (ImageMessage, ImagePatchMessage)
+                ):  # clients that do not request tiles get full resolution
+                    full_msg = (
+                        PackedMessage(processed_msg)
+                        if isinstance(processed_msg, ImagePatchMessage)
+                        else plot_state.client_data_message(False)
+                    )
+                messages = [
+                    new_msg if full_msg is None or c.tiles else full_msg
+                    for c in clients
+                ]
+                for m in {id(m): m for m in messages}.values():
+                    await m.prepare(
+                        (c.array_format, c.compression)
+                        for c, cm in zip(clients, messages)
+                        if cm is m
+                    )
+                kind = message_kind(processed_msg)
+                current_data = plot_state.current_data
+                frames: dict[tuple, PackedMessage | None] = {}
+                for c, m in zip(clients, messages):
+                    await c.add_message(
+                        *self._client_frame(
+                            c, current_data, processed_msg, m, kind, frames
+                        )
+                    )
+                stack = plot_state.stack
+                if isinstance(processed_msg, ImageStackMessage) and stack is not None:
+                    for c in clients:
+                        await self._send_frames(
+                            plot_id, c, stack, stack.neighbours(plot_state.frame)
+                        )
+        finally:
+            if shared is not None and plot_state.shared_blocks is not shared:
+                shared.release()  # message data was not kept
+
+    @staticmethod
+    def _client_frame(
+        client: PlotClient,
+        current_data: _PlotDataMessage | None,
+        processed_msg,
+        message: bytes | PackedMessage,
+        kind: MessageKind,
+        frames: dict[tuple, PackedMessage | None],
+    ) -> tuple[bytes | PackedMessage, MessageKind]:
+        """Get message for client whose viewport may need decimated lines
+
+        Append messages are passed on until the number of appended points
+        exceeds the client's budget then lines are decimated again
+
+        Parameters
+        ----------
+        client : PlotClient
+        current_data : _PlotDataMessage | None
+            current data of plot
+        processed_msg
+            message used to update plot state
+        message : bytes | PackedMessage
+            message for all clients
+        kind : MessageKind
+            kind of message
+        frames : dict[tuple, PackedMessage | None]
+            cache of decimated messages for each viewport
         """
-        await self._update_and_add_message(msg.plot_id, msg, None)
+        viewport = client.viewport
+        if (
+            viewport is None
+            or kind == MessageKind.control
+            or not isinstance(current_data, MultiLineMessage)
+        ):
+            return message, kind
+
+        if kind == MessageKind.append and isinstance(processed_msg, MultiLineMessage):
+            client.appended_points += max_points(processed_msg)
+            if client.appended_points <= POINTS_PER_PIXEL * viewport.pixel_width:
+                return message, kind
+
+        key = (viewport.pixel_width, viewport.x_range)
+        if key not in frames:
+            decimated = decimate_lines(current_data, viewport)
+            frames[key] = (
+                None
+                if decimated is current_data and kind == MessageKind.replace
+                else PackedMessage(decimated)
+            )
+        client.appended_points = 0
+        frame = frames[key]
+        return (message if frame is None else frame), MessageKind.replace
+
+    def _client_snapshot(
+        self, plot_id: str, client: PlotClient
+    ) -> PackedMessage | None:
+        """Get message of plot's current data for client"""
+        plot_state = self.plot_states[plot_id]
+        current_data = plot_state.current_data
+        viewport = client.viewport
+        if viewport is not None and isinstance(current_data, MultiLineMessage):
+            client.appended_points = 0
+            return PackedMessage(decimate_lines(current_data, viewport))
+        return plot_state.client_data_message(client.tiles)
+
+    async def _packed_client_snapshot(
+        self, plot_id: str, client: PlotClient
+    ) -> bytes | None:
+        """Pack message of plot's current data for client (in worker thread if large)"""
+        msg = self._client_snapshot(plot_id, client)
+        if msg is None:
+            return None
+        await msg.prepare([(client.array_format, client.compression)])
+        return client.pack(msg)
+
+    async def set_viewport(
+        self, plot_id: str, client: PlotClient, viewport: ClientViewportMessage
+    ):
+        """Set client's viewport and send it current line data to fit viewport
 
-    async def _update_and_add_message(self, plot_id, processed_msg, omit_client):
-        new_msg = await self.update_plot_states_with_message(plot_id, processed_msg)
-        if new_msg is not None:
+        Parameters
+        ----------
+        plot_id : str
+            ID of plot
+        client : PlotClient
+            client whose viewport has changed
+        viewport : ClientViewportMessage
+            viewport (decimation is disabled if its pixel width is not positive)
+        """
+        client.viewport = viewport if viewport.pixel_width > 0 else None
+        plot_state = self.plot_states[plot_id]
+        async with plot_state.lock:
+            if not isinstance(plot_state.current_data, MultiLineMessage):
+                return
+            msg = self._client_snapshot(plot_id, client)
+        if msg is not None:
+            await client.add_message(msg, MessageKind.replace)
+
+    async def select_frame(self, plot_id: str, frame: int):
+        """Move cursor of plot's image stack to frame and send it to clients
+
+        Clients are sent values of frames that they do not have, which include
+        the frames next to the cursor so they can be shown without delay
+
+        Parameters
+        ----------
+        plot_id : str
+            ID of plot
+        frame : int
+            index of frame
+        """
+        plot_state = self.plot_states[plot_id]
+        async with plot_state.update_lock:
+            async with plot_state.lock:
+                stack = plot_state.stack
+                if stack is None:
+                    logger.warning("No image stack for frame selected in %s", plot_id)
+                    return
+                frame = stack.clamp(frame)
+                plot_state.frame = frame
+                plot_state.mark_snapshot_changed()
+                self._schedule_derivations(plot_id)
+            cursor = ws_pack(
+                StackFrameMessage(plot_id=plot_id, stack_id=stack.stack_id, frame=frame)
+            )
+            assert cursor is not None
             for c in self._clients[plot_id]:
-                if c is not omit_client:
-                    await c.add_message(new_msg)
+                await self._send_frames(plot_id, c, stack, [frame])
+                await c.add_message(cursor, MessageKind.append)
+                await self._send_frames(plot_id, c, stack, stack.neighbours(frame))
+
+    async def reduce_stack(self, plot_id: str, reduction: Reduction, target_id: str):
+        """Reduce plot's image stack over its frames and plot result as image
+
+        Results are kept for each version of the stack's data so repeated
+        requests do not reduce the stack again
+
+        Parameters
+        ----------
+        plot_id : str
+            ID of plot with image stack
+        reduction : Reduction
+            reduction of frames
+        target_id : str
+            ID of plot to show reduced image
+        """
+        plot_state = self.plot_states[plot_id]
+        async with plot_state.lock:
+            stack_msg = plot_state.current_data
+            version = plot_state.data_version
+        if not isinstance(stack_msg, ImageStackMessage):
+            raise ValueError(f"Plot {plot_id} does not have an image stack")
+        values = await self.reducer.reduce(
+            (plot_id, version), stack_msg.stack_data.values, reduction
+        )
+        await self.update(reduced_image(stack_msg, values, target_id))
+
+    @staticmethod
+    async def _send_frames(
+        plot_id: str, client: PlotClient, stack: ImageStack, frames: list[int]
+    ):
+        """Send client values of frames of stack that it does not have
+
+        These are append messages so they are bounded by the client's queue. The
+        most recently sent frames are tracked (as the client keeps at least as
+        many) and tracking restarts when the queue discards any data messages
+        """
+        if client.stack_id != stack.stack_id:
+            client.stack_id = stack.stack_id
+            client.stack_frames.clear()
+        q = client.queue
+        for f in frames:
+            discarded = q.dropped + q.coalesced
+            if client.stack_discarded != discarded:  # sent frames may be lost
+                client.stack_discarded = discarded
+                client.stack_frames.clear()
+            if f in client.stack_frames:
+                continue
+            packed = stack.packed_frame(plot_id, f)
+            await packed.prepare([(client.array_format, client.compression)])
+            await client.add_message(packed, MessageKind.append)
+            if q.dropped + q.coalesced == discarded:
+                client.stack_frames[f] = None
+                if len(client.stack_frames) > MAX_PACKED_FRAMES:
+                    client.stack_frames.popitem(last=False)
+
+    async def send_tiles(
+        self, plot_id: str, client: PlotClient, request: ClientTilesRequestMessage
+    ):
+        """Send client tiles of plot's image pyramid
+
+        Parameters
+        ----------
+        plot_id : str
+            ID of plot
+        client : PlotClient
+            client requesting tiles
+        request : ClientTilesRequestMessage
+            level and region of tiles
+        """
+        plot_state = self.plot_states[plot_id]
+        async with plot_state.lock:
+            pyramid = plot_state.pyramid
+            if pyramid is None:
+                logger.warning(
+                    "No image pyramid for tiles requested by %s", client.name
+                )
+                return
+            try:
+                indices = pyramid.tile_indices(request.level, request.region)
+            except ValueError:
+                logger.warning("Invalid tiles requested: %s", request, exc_info=True)
+                return
+            tiles = [
+                pyramid.packed_tile(plot_id, request.level, r, c) for r, c in indices
+            ]
+        for t in tiles:
+            await client.add_message(t, MessageKind.append)
 
     async def prepare_client(
         self, plot_id: str, msg: ClientMessage, omit_client: PlotClient | None = None
@@ -791,17 +1824,150 @@ class PlotServer:
     def clients_with_uuid(self, uuid: str):
         return (c for cl in self._clients.values() for c in cl if c.uuid == uuid)
 
+    def get_queue_stats(self) -> list[QueueStats]:
+        """Get statistics of queues of all clients"""
+        return [c.queue_stats() for cl in self._clients.values() for c in cl]
+
+
+def message_kind(msg) -> MessageKind:
+    """Get kind of message sent to clients after updating plot state with message"""
+    match msg:
+        case (
+            MultiLineMessage(append=True)
+            | UpdateLinesMessage()
+            | ClearLinesMessage()
+            | ImagePatchMessage()
+        ):
+            return MessageKind.append
+        case _PlotDataMessage():
+            return MessageKind.replace
+    return MessageKind.control
+
+
+def decode_end_point_message(
+    data: bytes | str,
+    shared: SharedBlocks | None = None,
+    npy_root: Path | None = None,
+) -> EndPointMessage:
+    """Decode packed (or JSON) end point message
+
+    If shared memory blocks are given, arrays may reference blocks, which are
+    attached to them, or .npy files in given root directory
+
+    Raises ValueError if data is not an end point message
+    """
+    if shared is not None and isinstance(data, bytes):
+        raw = unpack_shared(data, shared, npy_root)
+    else:
+        raw = ws_unpack(data) if isinstance(data, bytes) else j_loads(data)
+    msg = as_model(raw) if isinstance(raw, dict) else raw
+    if not isinstance(msg, EndPointMessage):
+        raise ValueError(f"Not an end point message: {type(msg)}")
+    return msg
+
+
+async def handle_producer(
+    server: PlotServer, plot_id: str, socket: WebSocket, ack: bool = False
+):
+    """Update plot with stream of end point messages from a producer
 
-async def handle_client(server: PlotServer, plot_id: str, socket: WebSocket, uuid: str):
-    client = await server.add_client(plot_id, socket, uuid)
-    initialize = True
+    Parameters
+    ----------
+    server : PlotServer
+    plot_id : str
+        ID of plot to update (overrides plot ID of messages)
+    socket : WebSocket
+    ack : bool
+        if True, reply to each message with a PushAckMessage
+    """
+    received = 0
+    try:
+        while True:
+            raw_message = await socket.receive()
+            if raw_message["type"] == "websocket.disconnect":
+                logger.debug("Producer for %s disconnected", plot_id)
+                break
+
+            received += 1
+            data = raw_message.get("bytes")
+            if data is None:
+                data = raw_message.get("text", "")
+            error = None
+            try:
+                msg = await offload(len(data), decode_end_point_message, data)
+                msg.plot_id = plot_id
+                await server.update(msg)
+            except (ValueError, ValidationError) as e:
+                logger.warning("Ignoring message %d pushed to %s", received, plot_id)
+                error = str(e)
+            if ack:
+                await socket.send_bytes(
+                    ws_pack(PushAckMessage(ack=received, error=error))  # pyright: ignore
+                )
+    except WebSocketDisconnect:
+        logger.debug("Producer for %s disconnected", plot_id)
+
+
+async def handle_region_subscriber(server: PlotServer, plot_id: str, socket: WebSocket):
+    """Send selections of plot to a subscriber whenever they change
+
+    A SelectionsMessage of all current selections is sent when subscribed and
+    after every change. A subscriber that is slow only gets the latest selections
+
+    Parameters
+    ----------
+    server : PlotServer
+    plot_id : str
+        ID of plot
+    socket : WebSocket
+    """
+    queue = await server.subscribe_regions(plot_id)
+
+    async def _send_regions():
+        while True:
+            selections = await queue.get()
+            msg = ws_pack(SelectionsMessage(plot_id=plot_id, set_selections=selections))
+            assert msg is not None
+            await socket.send_bytes(msg)
+
+    sender = create_task(_send_regions(), name=f"region sender for {plot_id}")
+    try:
+        while True:
+            raw_message = await socket.receive()
+            if raw_message["type"] == "websocket.disconnect":
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        logger.debug("Region subscriber for %s disconnected", plot_id)
+        server.unsubscribe_regions(plot_id, queue)
+        sender.cancel()
+        try:
+            await sender
+        except CancelledError:
+            pass
+        except Exception:
+            logger.debug("Could not send regions of %s", plot_id, exc_info=True)
+
+
+async def handle_client(
+    server: PlotServer,
+    plot_id: str,
+    socket: WebSocket,
+    uuid: str,
+    array_format: ArrayFormat = ArrayFormat.dict,
+    compression: Compression = Compression.none,
+    tiles: bool = False,
+):
+    client = await server.add_client(
+        plot_id, socket, uuid, array_format, compression, tiles
+    )
     try:
         while True:
-            update_all = False
             raw_message = await socket.receive()
             if raw_message["type"] == "websocket.disconnect":
                 logger.debug("Websocket disconnected: %s:%s", client.name, client.uuid)
-                update_all = await server.remove_client(plot_id, client)
+                await server.remove_client(plot_id, client)
                 break
 
             message = ws_unpack(raw_message["bytes"])
@@ -819,27 +1985,27 @@ async def handle_client(server: PlotServer, plot_id: str, socket: WebSocket, uui
                 case ClientStatusMessage():
                     status = received_message.status
                     if status == StatusType.ready:
-                        if initialize:
-                            await client.send_next_message()
-                            await (
-                                client.send_next_message()
-                            )  # in case there are selections
-
-                            initialize = False
-                        else:
-                            server.client_status = StatusType.ready
-                        update_all = True
+                        client.start()  # send queued data and selections
                     elif status == StatusType.closing:
                         logger.info(
                             "Websocket closing for %s:%s", client.name, client.uuid
                         )
-                        update_all = await server.remove_client(plot_id, client)
+                        await server.remove_client(plot_id, client)
                         break
                 case BatonRequestMessage():
                     await server.send_baton_approval_request(received_message)
+                case ClientViewportMessage():
+                    await server.set_viewport(plot_id, client, received_message)
+                case ClientTilesRequestMessage():
+                    await server.send_tiles(plot_id, client, received_message)
+                case ClientFrameMessage():
+                    if uuid == server.baton:
+                        await server.select_frame(plot_id, received_message.frame)
+                    else:
+                        logger.warning("Frame selected by non-baton holder")
                 case BatonDonateMessage():
                     if uuid == server.baton:
-                        update_all = await server.take_baton(received_message)
+                        await server.take_baton(received_message)
                     else:
                         logger.warning("Baton approval received from non-baton holder")
                 case None:
@@ -850,7 +2016,6 @@ async def handle_client(server: PlotServer, plot_id: str, socket: WebSocket, uui
                         message,
                         raw_message,
                     )
-                    update_all = False
                 case _:
                     omit = None
 
@@ -882,19 +2047,11 @@ async def handle_client(server: PlotServer, plot_id: str, socket: WebSocket, uui
                                 exc_info=True,
                             )
 
-                        update_all = True
-
-            if update_all:
-                await server.send_next_message()
-
     except WebSocketDisconnect:
         logger.error(
             "Websocket disconnected: %s:%s", client.name, client.uuid, exc_info=True
         )
-        update_all = await server.remove_client(plot_id, client)
-
-    if update_all:
-        await server.send_next_message()
+        await server.remove_client(plot_id, client)
 
 
 def check_line_names(lines: list[LineData]) -> list[LineData]:
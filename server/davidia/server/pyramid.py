@@ -0,0 +1,190 @@
+from math import ceil
+
+import numpy as np
+
+from ..models.messages import ImageMessage, ImageTileMessage, PyramidInfo
+from ..models.parameters import DvDNDArray
+from .fastapi_utils import PackedMessage
+
+
+def downsample(values: DvDNDArray) -> DvDNDArray:
+    """Halve number of rows and columns of image by averaging 2x2 blocks
+
+    Odd numbers of rows or columns are padded by repeating the last one
+
+    Parameters
+    ----------
+    values : DvDNDArray
+        image values (rows and columns are first two dimensions)
+
+    Returns
+    -------
+    downsampled values with same dtype
+    """
+    rows, cols = values.shape[:2]
+    pad = [(0, rows % 2), (0, cols % 2)] + [(0, 0)] * (values.ndim - 2)
+    if rows % 2 or cols % 2:
+        values = np.pad(values, pad, mode="edge")
+    blocks = values.reshape(
+        (values.shape[0] // 2, 2, values.shape[1] // 2, 2) + values.shape[2:]
+    )
+    dtype = values.dtype
+    if dtype.kind == "f":
+        return blocks.mean(axis=(1, 3), dtype=dtype)
+    return np.rint(blocks.mean(axis=(1, 3))).astype(dtype)
+
+
+def _downsample_axis(axis: DvDNDArray | None, size: int, factor: int):
+    """Pick values of axis for downsampled image that has given size"""
+    if axis is None or factor == 1:
+        return axis
+    coarse = ceil(size / factor)
+    if axis.size == size + 1:  # pixel edges
+        return np.append(axis[:size:factor][:coarse], axis[-1])
+    if axis.size == size:
+        return axis[::factor][:coarse]
+    return axis
+
+
+class ImagePyramid:
+    """A class to represent an image as tiles at multiple resolutions
+
+    Level 0 is the full resolution image and each subsequent level halves its
+    number of rows and columns until the last level fits in a single tile.
+    Tiles are packed when first requested and kept for later requests
+    """
+
+    def __init__(self, msg: ImageMessage):
+        im_data = msg.im_data
+        tile_size = im_data.tile_size
+        if tile_size is None:
+            raise ValueError("Image data must have a tile size")
+        values = im_data.values
+        if values.ndim not in (2, 3):
+            raise ValueError("Image values must be 2D or 3D", values.shape)
+        self.msg = msg
+        self.tile_size = tile_size
+        self.levels: list[DvDNDArray] = [values]
+        while max(values.shape[:2]) > tile_size:
+            values = downsample(values)
+            self.levels.append(values)
+        self._packed_tiles: dict[tuple[int, int, int], PackedMessage] = {}
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        rows, cols = self.levels[0].shape[:2]
+        return rows, cols
+
+    def overview_message(self) -> ImageMessage:
+        """Create image message with last level of pyramid"""
+        msg = self.msg
+        level = len(self.levels) - 1
+        factor = 2**level
+        rows, cols = self.shape
+        pc = msg.plot_config
+        plot_config = pc.model_copy(
+            update={
+                "x_values": _downsample_axis(pc.x_values, cols, factor),
+                "y_values": _downsample_axis(pc.y_values, rows, factor),
+            }
+        )
+        im_data = msg.im_data.model_copy(update={"values": self.levels[level]})
+        return msg.model_copy(
+            update={
+                "plot_config": plot_config,
+                "im_data": im_data,
+                "pyramid": PyramidInfo(
+                    shape=self.shape, levels=len(self.levels), level=level
+                ),
+            }
+        )
+
+    def update(self, x0: int, y0: int, values: DvDNDArray):
+        """Write values into full resolution image and update the parts of
+        lower levels (and their tiles) that they cover
+
+        Parameters
+        ----------
+        x0 : int
+            column of first pixel
+        y0 : int
+            row of first pixel
+        values : DvDNDArray
+            values to write
+        """
+        c0, r0 = x0, y0
+        c1, r1 = x0 + values.shape[1], y0 + values.shape[0]
+        self.levels[0][r0:r1, c0:c1] = values
+        self._discard_tiles(0, c0, r0, c1, r1)
+        for level in range(1, len(self.levels)):
+            previous = self.levels[level - 1]
+            rows, cols = previous.shape[:2]
+            # align region to 2x2 blocks of previous level
+            c0, r0 = c0 - c0 % 2, r0 - r0 % 2
+            c1, r1 = min(c1 + c1 % 2, cols), min(r1 + r1 % 2, rows)
+            block = downsample(previous[r0:r1, c0:c1])
+            c0, r0 = c0 // 2, r0 // 2
+            c1, r1 = c0 + block.shape[1], r0 + block.shape[0]
+            self.levels[level][r0:r1, c0:c1] = block
+            self._discard_tiles(level, c0, r0, c1, r1)
+
+    def _discard_tiles(self, level: int, c0: int, r0: int, c1: int, r1: int):
+        """Discard packed tiles of level that overlap region"""
+        ts = self.tile_size
+        for r in range(r0 // ts, ceil(r1 / ts)):
+            for c in range(c0 // ts, ceil(c1 / ts)):
+                self._packed_tiles.pop((level, r, c), None)
+
+    def tile_indices(
+        self, level: int, region: tuple[int, int, int, int] | None = None
+    ) -> list[tuple[int, int]]:
+        """Get indices of tiles in level that overlap region
+
+        Parameters
+        ----------
+        level : int
+            level of pyramid
+        region : tuple[int, int, int, int] | None
+            columns and rows (start and stop) of region in full resolution pixels
+
+        Returns
+        -------
+        list of row and column indices
+        """
+        if level < 0 or level >= len(self.levels):
+            raise ValueError(f"Level {level} is not in pyramid", len(self.levels))
+        rows, cols = self.levels[level].shape[:2]
+        ts = self.tile_size
+        n_rows = ceil(rows / ts)
+        n_cols = ceil(cols / ts)
+        if region is None:
+            r_range = range(n_rows)
+            c_range = range(n_cols)
+        else:
+            x0, y0, x1, y1 = region
+            size = ts * 2**level  # in full resolution pixels
+            c_range = range(max(x0 // size, 0), min(ceil(x1 / size), n_cols))
+            r_range = range(max(y0 // size, 0), min(ceil(y1 / size), n_rows))
+        return [(r, c) for r in r_range for c in c_range]
+
+    def tile(self, level: int, row: int, col: int) -> DvDNDArray:
+        """Get tile of level at given row and column indices"""
+        ts = self.tile_size
+        return self.levels[level][row * ts : (row + 1) * ts, col * ts : (col + 1) * ts]
+
+    def packed_tile(
+        self, plot_id: str, level: int, row: int, col: int
+    ) -> PackedMessage:
+        """Get tile message (packed on demand)"""
+        key = (level, row, col)
+        if key not in self._packed_tiles:
+            ts = self.tile_size
+            self._packed_tiles[key] = PackedMessage(
+                ImageTileMessage(
+                    plot_id=plot_id,
+                    level=level,
+                    offset=(col * ts, row * ts),
+                    tile_values=self.tile(level, row, col),
+                )
+            )
+        return self._packed_tiles[key]
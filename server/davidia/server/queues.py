@@ -0,0 +1,172 @@
+import logging
+from asyncio import Queue
+from collections import deque
+from collections.abc import Awaitable, Callable
+from enum import auto
+
+from pydantic import BaseModel
+
+from ..models.parameters import AutoNameEnum
+
+logger = logging.getLogger("main")
+
+
+class MessageKind(AutoNameEnum):
+    """Class for kind of message queued for a client
+
+    control messages (selections, baton, etc) are always delivered in order,
+    replace messages supersede all earlier data messages and append messages
+    add to earlier data messages
+    """
+
+    control = auto()
+    replace = auto()
+    append = auto()
+
+
+class QueuePolicy(BaseModel):
+    """Policy for queues of messages to clients
+
+    Attributes
+    ----------
+    max_size : int
+        Maximum number of messages in queue (0 for no limit)
+    coalesce : bool
+        Replace queued data messages with newer full-replacement messages
+    """
+
+    max_size: int = 256
+    coalesce: bool = True
+
+
+class QueueStats(BaseModel):
+    """Statistics for queue of messages to a client"""
+
+    name: str
+    uuid: str
+    size: int
+    coalesced: int
+    dropped: int
+
+
+Snapshot = Callable[[], Awaitable[bytes | None]]
+
+
+class ClientQueue(Queue):
+    """Queue of packed messages for a client
+
+    Items put in the queue are packed messages, which are delivered in order,
+    or pairs of packed message and MessageKind. Getting an item returns the
+    packed message.
+
+    When a data message is added to a full queue, all its data messages are
+    dropped and replaced by a snapshot of the plot's data (if available) or else
+    its oldest data message is dropped. Control messages are never dropped.
+
+    The snapshot is awaited by put (or prepare) before the item is added so it
+    can be packed without blocking the event loop; put_nowait does not take a
+    snapshot unless given one by prepare.
+    """
+
+    def __init__(
+        self, policy: QueuePolicy | None = None, snapshot: Snapshot | None = None
+    ):
+        self.policy = QueuePolicy() if policy is None else policy
+        self.snapshot = snapshot
+        self.coalesced = 0
+        self.dropped = 0
+        super().__init__()
+
+    def _init(self, maxsize):
+        self._queue: deque[tuple[bytes, MessageKind]] = deque()
+
+    def _get(self) -> bytes:
+        return self._queue.popleft()[0]
+
+    def needs_space(self, kind: MessageKind) -> bool:
+        """Check if adding a message of given kind will drop data messages"""
+        max_size = self.policy.max_size
+        if kind == MessageKind.control or max_size <= 0:
+            return False
+        q = self._queue
+        if kind == MessageKind.replace and self.policy.coalesce:
+            return sum(1 for i in q if i[1] == MessageKind.control) >= max_size
+        return len(q) >= max_size
+
+    async def prepare(
+        self, item: bytes | tuple[bytes, MessageKind]
+    ) -> tuple[bytes, MessageKind, bytes | None]:
+        """Get item with snapshot to add in place of data messages if queue is full"""
+        if isinstance(item, tuple):
+            message, kind = item
+        else:
+            message, kind = item, MessageKind.control
+        snapshot = None
+        if self.snapshot is not None and self.needs_space(kind):
+            snapshot = await self.snapshot()
+        return message, kind, snapshot
+
+    async def put(self, item: bytes | tuple[bytes, MessageKind]):
+        await super().put(await self.prepare(item))
+
+    def _put(
+        self,
+        item: bytes
+        | tuple[bytes, MessageKind]
+        | tuple[bytes, MessageKind, bytes | None],
+    ):
+        snapshot = None
+        if not isinstance(item, tuple):
+            message, kind = item, MessageKind.control
+        elif len(item) == 3:
+            message, kind, snapshot = item
+        else:
+            message, kind = item
+
+        q = self._queue
+        size = len(q)
+        if kind == MessageKind.replace and self.policy.coalesce:
+            self.coalesced += self._remove_data()
+
+        max_size = self.policy.max_size
+        if max_size > 0 and len(q) >= max_size:
+            message, kind = self._make_space(message, kind, snapshot)
+
+        if message is not None:
+            q.append((message, kind))
+
+        # put_nowait counts one unfinished task so balance for removed items
+        for _ in range(size + 1 - len(q)):
+            self.task_done()
+
+    def _remove_data(self) -> int:
+        """Remove all data messages and return number removed"""
+        q = self._queue
+        kept = [i for i in q if i[1] == MessageKind.control]
+        removed = len(q) - len(kept)
+        if removed > 0:
+            q.clear()
+            q.extend(kept)
+        return removed
+
+    def _make_space(
+        self, message: bytes, kind: MessageKind, snapshot: bytes | None
+    ) -> tuple[bytes | None, MessageKind]:
+        """Make space in full queue by dropping data messages
+
+        Returns message and kind to add to queue
+        """
+        if kind == MessageKind.control:
+            return message, kind  # always deliver
+
+        if snapshot is not None:  # snapshot includes message
+            self.dropped += self._remove_data() + 1
+            return snapshot, MessageKind.replace
+
+        self.dropped += 1
+        q = self._queue
+        for i, (_, k) in enumerate(q):
+            if k != MessageKind.control:
+                del q[i]
+                return message, kind
+        return None, kind
@@ -0,0 +1,282 @@
+import logging
+from asyncio import Future, gather, get_running_loop, shield, wrap_future
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from enum import auto
+from functools import reduce
+from multiprocessing import get_context
+
+import numpy as np
+
+from ..models.messages import HeatmapData, ImageMessage, ImageStackMessage
+from ..models.parameters import AutoNameEnum, DvDNDArray
+
+logger = logging.getLogger("main")
+
+REDUCTION_CHUNK_BYTES = 1 << 26
+"""Size in bytes of chunks of frames that are reduced by each task"""
+
+POOL_THRESHOLD = 1 << 24
+"""Size in bytes of stacks above which they are reduced in worker processes"""
+
+MAX_CACHED_REDUCTIONS = 8
+"""Maximum number of reduced images kept"""
+
+
+class Reduction(AutoNameEnum):
+    """Class for reductions of an image stack over its frames"""
+
+    sum = auto()
+    mean = auto()
+    max = auto()
+    min = auto()
+
+
+@dataclass(frozen=True)
+class FileFrames:
+    """A reference to frames of a stack that are memory-mapped from a file
+
+    Worker processes map the file themselves so frames are not copied to them
+    """
+
+    path: str
+    offset: int
+    dtype: str
+    shape: tuple[int, ...]
+    strides: tuple[int, ...]
+
+    @staticmethod
+    def of(values: np.ndarray) -> "FileFrames | None":
+        """Get reference to memory-mapped values (or None if they are not)"""
+        if not isinstance(values, np.memmap) or values.filename is None:
+            return None
+        if any(s < 0 for s in values.strides):
+            return None
+        root = values
+        while isinstance(root.base, np.ndarray):
+            root = root.base
+        if not isinstance(root, np.memmap):
+            return None
+        address = values.__array_interface__["data"][0]
+        root_address = root.__array_interface__["data"][0]
+        return FileFrames(
+            values.filename,
+            root.offset + address - root_address,
+            values.dtype.str,
+            values.shape,
+            values.strides,
+        )
+
+    def load(self, start: int, stop: int) -> np.ndarray:
+        """Get frames from start to stop"""
+        mm = np.memmap(self.path, dtype=np.uint8, mode="r")
+        frames = np.ndarray(
+            self.shape,
+            dtype=np.dtype(self.dtype),
+            buffer=mm,
+            offset=self.offset,
+            strides=self.strides,
+        )
+        return frames[start:stop]
+
+
+def _accumulator(dtype: np.dtype, reduction: Reduction) -> np.dtype | None:
+    if reduction == Reduction.mean or dtype.kind in "fc":
+        return np.dtype(np.float64) if dtype.kind != "c" else None
+    if reduction == Reduction.sum:
+        return np.dtype(np.uint64 if dtype.kind == "u" else np.int64)
+    return None
+
+
+def reduce_chunk(
+    frames: np.ndarray | FileFrames, reduction: Reduction, start: int, stop: int
+) -> np.ndarray:
+    """Reduce frames from start to stop over first dimension
+
+    A mean is returned as a sum which is divided once all chunks are combined
+    """
+    if isinstance(frames, FileFrames):
+        frames = frames.load(start, stop)
+    else:
+        frames = frames[start:stop]
+    match reduction:
+        case Reduction.max:
+            return np.max(frames, axis=0)
+        case Reduction.min:
+            return np.min(frames, axis=0)
+        case _:
+            return np.sum(frames, axis=0, dtype=_accumulator(frames.dtype, reduction))
+
+
+def _combine(
+    partials: list[np.ndarray], reduction: Reduction, frames: int
+) -> np.ndarray:
+    match reduction:
+        case Reduction.max:
+            return reduce(np.maximum, partials)
+        case Reduction.min:
+            return reduce(np.minimum, partials)
+        case Reduction.sum:
+            return reduce(np.add, partials)
+        case _:
+            return reduce(np.add, partials) / frames
+
+
+def _chunks(values: np.ndarray) -> list[tuple[int, int]]:
+    frames = values.shape[0]
+    frame_bytes = max(values[0].nbytes, 1)
+    step = max(REDUCTION_CHUNK_BYTES // frame_bytes, 1)
+    return [(s, min(s + step, frames)) for s in range(0, frames, step)]
+
+
+def reduce_frames(values: DvDNDArray, reduction: Reduction) -> np.ndarray:
+    """Reduce stack over its frames in chunks so memory-mapped stacks are read
+    in pieces
+
+    Parameters
+    ----------
+    values : DvDNDArray
+        stack whose first dimension is frames
+    reduction : Reduction
+        reduction of frames
+
+    Returns
+    -------
+    reduced image
+    """
+    if values.ndim < 2 or values.shape[0] == 0:
+        raise ValueError("Stack must have frames", values.shape)
+    partials = [reduce_chunk(values, reduction, s, e) for s, e in _chunks(values)]
+    return _combine(partials, reduction, values.shape[0])
+
+
+def reduced_image(msg: ImageStackMessage, values: np.ndarray, plot_id: str):
+    """Create image message of reduced stack
+
+    Parameters
+    ----------
+    msg : ImageStackMessage
+        message of stack
+    values : np.ndarray
+        reduced values
+    plot_id : str
+        ID of plot to show image
+
+    Returns
+    -------
+    image message whose heatmap domain covers values (RGB images are clipped to
+    range of stack's type)
+    """
+    stack_data = msg.stack_data
+    update: dict = {"values": values}
+    if isinstance(stack_data, HeatmapData):
+        update["domain"] = (float(np.nanmin(values)), float(np.nanmax(values)))
+    else:
+        dtype = stack_data.values.dtype
+        if dtype.kind in "iu":
+            info = np.iinfo(dtype)
+            values = np.clip(np.rint(values), info.min, info.max)
+        update["values"] = values.astype(dtype, copy=False)
+    return ImageMessage(
+        plot_id=plot_id,
+        plot_config=msg.plot_config,
+        im_data=stack_data.model_copy(update=update),
+    )
+
+
+class Reducer:
+    """A class to reduce image stacks over their frames
+
+    Large stacks are split into chunks of frames that are reduced in a pool of
+    worker processes. Results are kept by key (which should include the
+    version of the stack's data) and concurrent requests of the same key share
+    one computation
+    """
+
+    def __init__(self, max_workers: int | None = None):
+        self.max_workers = max_workers
+        self._executor: Executor | None = None
+        self._results: OrderedDict[tuple, Future[np.ndarray]] = OrderedDict()
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            # spawned so workers do not inherit server's threads and locks
+            self._executor = ProcessPoolExecutor(
+                self.max_workers, mp_context=get_context("spawn")
+            )
+        return self._executor
+
+    async def reduce(
+        self, key: tuple, values: DvDNDArray, reduction: Reduction
+    ) -> np.ndarray:
+        """Reduce stack (or get result kept for key)
+
+        Parameters
+        ----------
+        key : tuple
+            key of result
+        values : DvDNDArray
+            stack whose first dimension is frames
+        reduction : Reduction
+            reduction of frames
+
+        Returns
+        -------
+        reduced image
+        """
+        key = (*key, reduction)
+        result = self._results.get(key)
+        if result is None:
+            loop = get_running_loop()
+            result = self._results[key] = loop.create_task(
+                self._reduce(values, reduction)
+            )
+            if len(self._results) > MAX_CACHED_REDUCTIONS:
+                self._results.popitem(last=False)
+        else:
+            self._results.move_to_end(key)
+        try:
+            return await shield(result)
+        except Exception:
+            if self._results.get(key) is result:
+                del self._results[key]
+            raise
+
+    async def _reduce(self, values: DvDNDArray, reduction: Reduction) -> np.ndarray:
+        if values.ndim < 2 or values.shape[0] == 0:
+            raise ValueError("Stack must have frames", values.shape)
+        loop = get_running_loop()
+        if values.nbytes < POOL_THRESHOLD:
+            return await loop.run_in_executor(None, reduce_frames, values, reduction)
+
+        chunks = _chunks(values)
+        logger.debug("Reducing %s in %d chunks", values.shape, len(chunks))
+        frames = FileFrames.of(values)
+        executor = self.executor
+        if frames is None:  # chunks are copied to workers
+            tasks = [
+                executor.submit(reduce_chunk, values[s:e], reduction, 0, e - s)
+                for s, e in chunks
+            ]
+        else:
+            tasks = [
+                executor.submit(reduce_chunk, frames, reduction, s, e)
+                for s, e in chunks
+            ]
+        partials = await gather(*(wrap_future(t) for t in tasks))
+        return await loop.run_in_executor(
+            None, _combine, partials, reduction, values.shape[0]
+        )
+
+    def clear(self):
+        """Clear kept results"""
+        self._results.clear()
+
+    def shutdown(self):
+        """Shut down worker processes"""
+        self.clear()
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,205 @@
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+
+import numpy as np
+from pydantic import BaseModel
+
+from ..models.messages import (
+    HeatmapData,
+    ImageMessage,
+    ImageStackMessage,
+    ScatterMessage,
+    _PlotDataMessage,
+)
+from ..models.selections import SelectionBase, pixel_centres
+
+logger = logging.getLogger("main")
+
+MAX_CACHED_MASKS = 64
+"""Maximum number of selection masks kept"""
+
+
+class RoiStats(BaseModel):
+    """Statistics of data in a selection (or region of interest)
+
+    The centroid is weighted by data values unless they sum to zero. Data
+    points that are not finite are ignored
+    """
+
+    selection_id: str
+    count: int
+    sum: float
+    mean: float | None = None
+    min: float | None = None
+    max: float | None = None
+    centroid: tuple[float, float] | None = None
+
+
+class SelectionMask:
+    """Indices and coordinates of data points in a selection
+
+    Parameters
+    ----------
+    index : tuple[np.ndarray, ...]
+        index arrays of points in data values
+    x : np.ndarray
+        x coordinates of points
+    y : np.ndarray
+        y coordinates of points
+    """
+
+    def __init__(self, index: tuple[np.ndarray, ...], x: np.ndarray, y: np.ndarray):
+        self.index = index
+        self.x = x
+        self.y = y
+
+    @property
+    def count(self) -> int:
+        return self.x.size
+
+    @staticmethod
+    def of_image(
+        selection: SelectionBase,
+        shape: tuple[int, ...],
+        x_values: np.ndarray | None = None,
+        y_values: np.ndarray | None = None,
+    ) -> "SelectionMask":
+        """Make mask of pixels of image in selection"""
+        rows, cols = np.nonzero(selection.mask(shape, x_values, y_values))
+        x = pixel_centres(x_values, shape[1])[cols]
+        y = pixel_centres(y_values, shape[0])[rows]
+        return SelectionMask((rows, cols), x, y)
+
+    @staticmethod
+    def of_points(
+        selection: SelectionBase, x: np.ndarray, y: np.ndarray
+    ) -> "SelectionMask":
+        """Make mask of scattered points in selection"""
+        x = np.ravel(x)
+        y = np.ravel(y)
+        indices = np.flatnonzero(selection.contains(np.stack((x, y), axis=-1)))
+        return SelectionMask((indices,), x[indices], y[indices])
+
+
+def selection_key(selection: SelectionBase) -> str:
+    """Get key of selection's geometry (which ignores its ID, name and style)"""
+    return type(selection).__name__ + selection.model_dump_json(
+        exclude={"id", "name", "colour", "alpha", "fixed"}
+    )
+
+
+class MaskCache:
+    """Recently used selection masks kept by key
+
+    Keys should include the version of the data so masks are made again
+    once the data changes. The cache is used from worker threads so masks
+    are made outside its lock
+    """
+
+    def __init__(self, max_size: int = MAX_CACHED_MASKS):
+        self.max_size = max_size
+        self._masks: OrderedDict[tuple, SelectionMask] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._masks)
+
+    def get(self, key: tuple, make: Callable[[], SelectionMask]) -> SelectionMask:
+        """Get mask of key (or make it)"""
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+                return mask
+        made = make()
+        with self._lock:
+            mask = self._masks.setdefault(key, made)  # keep mask made by others
+            self._masks.move_to_end(key)
+            if len(self._masks) > self.max_size:
+                self._masks.popitem(last=False)
+        return mask
+
+    def clear(self):
+        with self._lock:
+            self._masks.clear()
+
+
+def roi_values(
+    msg: _PlotDataMessage | None, frame: int = 0
+) -> tuple[np.ndarray, Callable[[SelectionBase], SelectionMask]]:
+    """Get values of plot data and function to make masks of selections
+
+    Parameters
+    ----------
+    msg : _PlotDataMessage | None
+        heatmap, image stack (of heatmaps) or scatter data
+    frame : int
+        frame of image stack
+
+    Returns
+    -------
+    values and function to make mask of selection for values
+    """
+    config = msg.plot_config if msg is not None else None
+    x_values = config.x_values if config is not None else None
+    y_values = config.y_values if config is not None else None
+    match msg:
+        case ImageMessage(im_data=HeatmapData(values=values)):
+            pass
+        case ImageStackMessage(stack_data=HeatmapData(values=values)):
+            values = values[frame]
+        case ScatterMessage():
+            sc_data = msg.sc_data
+            return sc_data.point_values.ravel(), lambda s: SelectionMask.of_points(
+                s, sc_data.x, sc_data.y
+            )
+        case _:
+            raise ValueError("Statistics need heatmap or scatter data")
+    shape = values.shape
+    return values, lambda s: SelectionMask.of_image(s, shape, x_values, y_values)
+
+
+def roi_stats(selection_id: str, values: np.ndarray, mask: SelectionMask) -> RoiStats:
+    """Calculate statistics of values in mask
+
+    Parameters
+    ----------
+    selection_id : str
+        ID of selection
+    values : np.ndarray
+        data values
+    mask : SelectionMask
+        mask of selection in values
+
+    Returns
+    -------
+    statistics of finite values in mask
+    """
+    v = values[mask.index]
+    x = mask.x
+    y = mask.y
+    finite = np.isfinite(v)
+    if not finite.all():
+        v = v[finite]
+        x = x[finite]
+        y = y[finite]
+    if v.size == 0:
+        return RoiStats(selection_id=selection_id, count=0, sum=0.0)
+    v = v.astype(np.float64, copy=False)
+    total = float(v.sum())
+    if total != 0:
+        centroid = (float(x @ v) / total, float(y @ v) / total)
+    else:
+        centroid = (float(x.mean()), float(y.mean()))
+    return RoiStats(
+        selection_id=selection_id,
+        count=v.size,
+        sum=total,
+        mean=total / v.size,
+        min=float(v.min()),
+        max=float(v.max()),
+        centroid=centroid,
+    )
@@ -0,0 +1,267 @@
+import logging
+import os
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from msgpack import ExtType
+from msgpack import packb as _mp_packb
+from msgpack import unpackb as _mp_unpackb
+from pydantic import BaseModel
+
+from .fastapi_utils import _decode_ext, decode_ndarray, ws_pack
+
+logger = logging.getLogger("main")
+
+SHARED_ARRAY_EXT_TYPE = 2
+"""MessagePack extension type code for references to ndarrays in shared memory"""
+
+NPY_FILE_EXT_TYPE = 3
+"""MessagePack extension type code for references to ndarrays in .npy files"""
+
+SHARED_MEMORY_THRESHOLD = 1 << 16
+"""Size in bytes of arrays above which they are put in shared memory"""
+
+IndexSpec = list[int | list[int | None]] | None
+"""Packable index of an array as list of integers or (start, stop, step)
+lists for slices"""
+
+
+class NpyFileArray(np.memmap):
+    """A memory-mapped view of array in .npy file
+
+    When packed for a plot server on the same host, it is sent as a reference to
+    the file (and index) instead of its data. Arrays derived from it are not.
+    """
+
+    npy_path: str | None = None
+    npy_index: IndexSpec = None
+
+
+def _index_spec(index) -> IndexSpec:
+    if index is None:
+        return None
+    if not isinstance(index, tuple):
+        index = (index,)
+    spec = []
+    for i in index:
+        if isinstance(i, slice):
+            spec.append([i.start, i.stop, i.step])
+        elif isinstance(i, (int, np.integer)):
+            spec.append(int(i))
+        else:
+            raise ValueError(f"Index must contain only integers or slices: {index}")
+    return spec
+
+
+def _to_index(spec: IndexSpec) -> tuple:
+    if spec is None:
+        return ()
+    return tuple(slice(*i) if isinstance(i, list) else i for i in spec)
+
+
+def npy_file(path: str | os.PathLike, index=None) -> NpyFileArray:
+    """Get memory-mapped view of array in .npy file
+
+    Parameters
+    ----------
+    path : str | os.PathLike
+        path to .npy file
+    index : int | slice | tuple | None
+        basic index of array (integers and slices)
+
+    Returns
+    -------
+    view that can be used as data of a plot
+    """
+    spec = _index_spec(index)
+    mm = np.load(path, mmap_mode="r")
+    arr = mm[_to_index(spec)].view(NpyFileArray)
+    arr.npy_path = os.path.abspath(path)
+    arr.npy_index = spec
+    return arr
+
+
+def load_npy(path: str, spec: IndexSpec, root: Path | None) -> np.ndarray:
+    """Load memory-mapped view of array in .npy file within root directory
+
+    Raises ValueError if file is not allowed or cannot be loaded
+    """
+    if root is None:
+        raise ValueError("References to .npy files are not enabled")
+    p = Path(path).resolve()
+    if p.suffix != ".npy" or not p.is_relative_to(root.resolve()):
+        raise ValueError(f"{path} is not a .npy file in {root}")
+    try:
+        return np.load(p, mmap_mode="r")[_to_index(spec)]
+    except (OSError, IndexError, TypeError) as e:
+        raise ValueError(f"Could not load {path}: {e}") from e
+
+
+class SharedBlocks:
+    """Shared memory blocks that back the arrays of a message
+
+    Blocks are created by a producer on the same host and their ownership is
+    passed to the plot server, which unlinks them when released. Blocks can
+    only be attached if enabled
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._blocks: dict[str, SharedMemory] = {}
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def attach(self, name: str, dtype: str, shape: tuple[int, ...]) -> np.ndarray:
+        """Get array that views data in block of given name
+
+        Raises ValueError if blocks are not enabled, the block does not exist
+        or the dtype or shape of the array are invalid
+        """
+        if not self.enabled:
+            raise ValueError("References to shared memory blocks are not enabled")
+        try:
+            dt = np.dtype(dtype)
+            size = int(np.prod(shape)) * dt.itemsize
+        except TypeError as e:
+            raise ValueError(f"Invalid dtype or shape: {dtype}, {shape}") from e
+        if dt.hasobject or size < 0:
+            raise ValueError(f"Invalid dtype or shape: {dtype}, {shape}")
+        shm = self._blocks.get(name)
+        if shm is None:
+            try:
+                shm = SharedMemory(name)
+            except FileNotFoundError as e:
+                raise ValueError(f"Shared memory block {name} does not exist") from e
+            self._blocks[name] = shm
+        if size > shm.size:
+            raise ValueError(f"Shared memory block {name} is too small for array")
+        try:
+            return np.ndarray(shape, dtype=dt, buffer=shm.buf)
+        except TypeError as e:
+            raise ValueError(f"Invalid shape: {shape}") from e
+
+    def release(self):
+        """Unlink blocks (their memory is freed once no arrays view them)"""
+        for name, shm in self._blocks.items():
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                logger.debug("Shared memory block %s already unlinked", name)
+            _LINGERING.append(shm)
+        self._blocks.clear()
+        _close_lingering()
+
+
+_LINGERING: list[SharedMemory] = []
+
+
+def _close_lingering():
+    """Close unlinked blocks that are no longer viewed by arrays"""
+    still_viewed = []
+    for shm in _LINGERING:
+        try:
+            shm.close()
+        except BufferError:
+            still_viewed.append(shm)
+    _LINGERING[:] = still_viewed
+
+
+def unpack_shared(
+    data: bytes, blocks: SharedBlocks, npy_root: Path | None = None
+) -> dict[str, Any]:
+    """Unpack message whose arrays may reference shared memory blocks or .npy files
+
+    Parameters
+    ----------
+    data : bytes
+        packed message
+    blocks : SharedBlocks
+        blocks attached for message
+    npy_root : Path | None
+        directory of .npy files that can be referenced (None for none)
+    """
+
+    def _ext_hook(code: int, payload: bytes):
+        if code == SHARED_ARRAY_EXT_TYPE:
+            try:
+                name, dtype, shape = _mp_unpackb(payload)
+                shape = tuple(shape)
+            except TypeError as e:
+                raise ValueError("Invalid reference to shared memory block") from e
+            return blocks.attach(name, dtype, shape)
+        if code == NPY_FILE_EXT_TYPE:
+            path, spec = _mp_unpackb(payload)
+            return load_npy(path, spec, npy_root)
+        return _decode_ext(code, payload)
+
+    return _mp_unpackb(data, raw=False, object_hook=decode_ndarray, ext_hook=_ext_hook)
+
+
+def _share_arrays(obj, blocks: list[SharedMemory], threshold: int):
+    if isinstance(obj, dict):
+        return {k: _share_arrays(v, blocks, threshold) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_share_arrays(i, blocks, threshold) for i in obj]
+    if isinstance(obj, NpyFileArray) and obj.npy_path is not None:
+        return ExtType(NPY_FILE_EXT_TYPE, _mp_packb((obj.npy_path, obj.npy_index)))
+    if (
+        isinstance(obj, np.ndarray)
+        and obj.dtype.kind in "biufc"
+        and obj.nbytes >= threshold
+    ):
+        shm = SharedMemory(create=True, size=obj.nbytes)
+        # plot server owns block once it is posted
+        resource_tracker.unregister(shm._name, "shared_memory")  # pyright: ignore
+        blocks.append(shm)
+        np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf)[...] = obj
+        return ExtType(
+            SHARED_ARRAY_EXT_TYPE, _mp_packb((shm.name, obj.dtype.str, obj.shape))
+        )
+    return obj
+
+
+def pack_shared(
+    obj, threshold: int = SHARED_MEMORY_THRESHOLD
+) -> tuple[bytes, list[SharedMemory]]:
+    """Pack object with its large arrays written to shared memory blocks
+
+    Views of .npy files from npy_file are packed as references to the files
+
+    Parameters
+    ----------
+    obj : Any
+        object to pack
+    threshold : int
+        size in bytes of arrays above which they are put in shared memory
+
+    Returns
+    -------
+    packed message and created blocks (that should be closed once posted
+    or also unlinked if posting failed)
+    """
+    if isinstance(obj, BaseModel):
+        obj = obj.model_dump(by_alias=True)
+    blocks: list[SharedMemory] = []
+    try:
+        packed = ws_pack(_share_arrays(obj, blocks, threshold))
+    except Exception:
+        discard_blocks(blocks, unlink=True)
+        raise
+    assert packed is not None
+    return packed, blocks
+
+
+def discard_blocks(blocks: list[SharedMemory], unlink: bool = False):
+    """Close created blocks and optionally unlink them"""
+    for shm in blocks:
+        shm.close()
+        if unlink:
+            resource_tracker.register(shm._name, "shared_memory")  # pyright: ignore
+            try:
+                shm.unlink()
+            except FileNotFoundError:
+                pass
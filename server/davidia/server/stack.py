@@ -0,0 +1,82 @@
+from collections import OrderedDict
+from uuid import uuid4
+
+from ..models.messages import (
+    ImageFrameMessage,
+    ImageMessage,
+    ImageStackMessage,
+    StackInfo,
+)
+from ..models.parameters import DvDNDArray
+from .fastapi_utils import PackedMessage
+
+PREFETCH_FRAMES = 2
+"""Number of frames on each side of the current frame that are sent to clients
+in advance"""
+
+MAX_PACKED_FRAMES = 16
+"""Maximum number of packed frames kept for clients"""
+
+
+class ImageStack:
+    """A class to represent a stack of images that are shown one frame at a time
+
+    The first dimension of the values are the frames. Values may be memory-mapped
+    so that only frames that are sent are read. Recently packed frames are kept
+    for other clients
+    """
+
+    def __init__(self, msg: ImageStackMessage):
+        values = msg.stack_data.values
+        if values.ndim not in (3, 4) or values.shape[0] == 0:
+            raise ValueError("Stack values must be 3D or 4D with frames", values.shape)
+        self.msg = msg
+        self.stack_id = uuid4().hex
+        self._packed_frames: OrderedDict[int, PackedMessage] = OrderedDict()
+
+    @property
+    def frames(self) -> int:
+        return self.msg.stack_data.values.shape[0]
+
+    def clamp(self, frame: int) -> int:
+        """Get frame index that is within stack"""
+        return min(max(frame, 0), self.frames - 1)
+
+    def frame_values(self, frame: int) -> DvDNDArray:
+        return self.msg.stack_data.values[frame]
+
+    def neighbours(self, frame: int, count: int = PREFETCH_FRAMES) -> list[int]:
+        """Get indices of frames nearest to given frame (nearest first)"""
+        indices = []
+        for i in range(1, count + 1):
+            indices.extend(f for f in (frame + i, frame - i) if 0 <= f < self.frames)
+        return indices
+
+    def frame_message(self, frame: int) -> ImageMessage:
+        """Create image message of frame"""
+        msg = self.msg
+        im_data = msg.stack_data.model_copy(update={"values": self.frame_values(frame)})
+        return ImageMessage(
+            plot_id=msg.plot_id,
+            plot_config=msg.plot_config,
+            im_data=im_data,
+            stack=StackInfo(stack_id=self.stack_id, frames=self.frames, frame=frame),
+        )
+
+    def packed_frame(self, plot_id: str, frame: int) -> PackedMessage:
+        """Get message of frame's values (packed on demand)"""
+        packed = self._packed_frames.get(frame)
+        if packed is None:
+            packed = self._packed_frames[frame] = PackedMessage(
+                ImageFrameMessage(
+                    plot_id=plot_id,
+                    stack_id=self.stack_id,
+                    frame=frame,
+                    frame_values=self.frame_values(frame),
+                )
+            )
+            if len(self._packed_frames) > MAX_PACKED_FRAMES:
+                self._packed_frames.popitem(last=False)
+        else:
+            self._packed_frames.move_to_end(frame)
+        return packed
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import asyncio
 import datetime
 import itertools
 import time
@@ -15,9 +16,10 @@ from davidia.models.messages import (
     LineData,
     LineParams,
     MultiLineMessage,
-    StatusType,
 )
 from davidia.server.fastapi_utils import (
+    NDARRAY_EXT_TYPE,
+    ArrayFormat,
     j_dumps,
     j_loads,
     message_unpack,
@@ -108,7 +110,6 @@ async def test_status_ws():
                 client_1 = ps._clients["plot_1"]
                 plot_state_0 = ps.plot_states["plot_0"]
                 plot_state_1 = ps.plot_states["plot_1"]
-                assert ps.client_status == StatusType.busy
                 assert len(client_0) == 1
                 assert len(client_1) == 1
 
@@ -122,9 +123,7 @@ async def test_status_ws():
                 assert plot_state_1.current_selections is None
 
                 await ps.update(plot_msg_0)
-                await ps.send_next_message()
                 time.sleep(1)
-                assert ps.client_status == StatusType.busy
                 assert plot_state_0.current_data
                 assert plot_state_0.current_selections is None
                 assert plot_state_0.new_data_message
@@ -135,9 +134,7 @@ async def test_status_ws():
                 assert plot_state_1.current_selections is None
 
                 await ps.update(plot_msg_1)
-                await ps.send_next_message()
                 time.sleep(1)
-                assert ps.client_status == StatusType.busy
                 assert len(client_0) == 1
                 assert len(client_1) == 1
                 assert plot_state_0.new_data_message
@@ -152,7 +149,6 @@ async def test_status_ws():
                     )
                 )
                 time.sleep(1)
-                assert ps.client_status == StatusType.busy
 
                 received_0_0 = ws_0.receive()
                 received_0_1 = ws_0.receive()
@@ -179,7 +175,6 @@ async def test_status_ws():
                     )
                 )
                 time.sleep(1)
-                assert ps.client_status == StatusType.busy
 
                 received_1_0 = ws_1.receive()
                 rec_text_1_0 = ws_unpack(received_1_0["bytes"])
@@ -192,9 +187,7 @@ async def test_status_ws():
                 )
 
                 await ps.update(plot_msg_2)
-                await ps.send_next_message()
                 time.sleep(1)
-                assert ps.client_status == StatusType.busy
                 received_new_line = ws_0.receive()
                 rec_data = ws_unpack(received_new_line["bytes"])
                 line_msg = MultiLineMessage.model_validate(rec_data)
@@ -210,8 +203,13 @@ class Codec:
 
 js_codec = Codec("", j_dumps, j_loads)
 mp_codec = Codec("application/x-msgpack", ws_pack, ws_unpack)
+mp_ext_codec = Codec(
+    "application/x-msgpack", lambda d: ws_pack(d, ArrayFormat.ext), ws_unpack
+)
 
-CODECS_PARAMS = list(itertools.product((js_codec, mp_codec), (js_codec, mp_codec)))
+CODECS_PARAMS = list(
+    itertools.product((js_codec, mp_codec, mp_ext_codec), (js_codec, mp_codec))
+)
 
 
 @pytest.mark.asyncio  # @UndefinedVariable
@@ -306,6 +304,62 @@ async def test_push_points():
             assert ws_unpack(response._content) == "data sent"
 
 
+def test_ws_pack_ext_format():
+    data = {
+        "a": np.arange(10, dtype=np.int16).reshape(2, 5),
+        "b": [1, "x", {"c": np.linspace(0, 1, 7)[::2]}],
+        "e": np.zeros((0, 3), dtype=np.uint8),
+        "s": np.array(["ab", "c"]),
+        "m": {str(i): i for i in range(20)},
+    }
+    packed = ws_pack(data, ArrayFormat.ext)
+    assert packed is not None
+    nppd_assert_equal(ws_unpack(packed), ws_unpack(ws_pack(data)))
+
+    # array data are aligned in message
+    for a in (data["a"], data["b"][2]["c"]):
+        offset = packed.index(a.tobytes())
+        assert offset % 8 == 0
+    assert packed.count(NDARRAY_EXT_TYPE.to_bytes(1, "big")) >= 4
+
+
+def test_websocket_array_format():
+    app = _create_bare_app()
+    ps = getattr(app, "_plot_server")
+    line = LineData(
+        key="a", line_params=LineParams(), x=np.arange(7.0), y=np.arange(7.0) ** 2
+    )
+    ready = ws_pack({"status": "ready"})
+
+    with TestClient(app) as client:
+        with client.websocket_connect("/plot/0a0a0a0a/plot_0") as ws_dict:
+            with client.websocket_connect("/plot/0b0b0b0b/plot_0?arrays=ext") as ws_ext:
+                assert [c.array_format for c in ps._clients["plot_0"]] == [
+                    ArrayFormat.dict,
+                    ArrayFormat.ext,
+                ]
+                response = client.post(
+                    "/push_data",
+                    content=ws_pack(MultiLineMessage(plot_id="plot_0", ml_data=[line])),
+                    headers={"Content-Type": "application/x-msgpack"},
+                )
+                assert response.status_code == 200
+                received = {}
+                for name, ws in (("dict", ws_dict), ("ext", ws_ext)):
+                    ws.send_bytes(ready)
+                    while True:
+                        packed = ws.receive_bytes()
+                        if b"mlData" in packed:
+                            received[name] = packed
+                            break
+
+    assert received["dict"] != received["ext"]
+    y = line.y.tobytes()
+    assert received["ext"].index(y) % 8 == 0
+    for packed in received.values():
+        nppd_assert_equal(ws_unpack(packed)["mlData"][0]["x"], line.x)
+
+
 class TrialA(NumpyModel):
     integers: list[int]
     floats: list[float]
@@ -393,3 +447,342 @@ if __name__ == "__main__":
     import json
 
     print(json.dumps(TrialB.model_json_schema(), indent=2))
+
+
+def test_push_websocket():
+    app = _create_bare_app()
+    line = LineData(key="a", line_params=LineParams(), y=np.arange(10.0))
+
+    with TestClient(app) as client:
+        with client.websocket_connect("/push/plot_0?ack=true") as ws:
+            for i in range(3):
+                ws.send_bytes(ws_pack(MultiLineMessage(plot_id="", ml_data=[line])))  # pyright: ignore
+                assert ws_unpack(ws.receive_bytes()) == {"ack": i + 1, "error": None}
+
+            ws.send_bytes(ws_pack({"status": "ready"}))  # pyright: ignore
+            reply = ws_unpack(ws.receive_bytes())
+            assert reply["ack"] == 4
+            assert reply["error"] is not None
+
+        ps = getattr(app, "_plot_server")
+        current = ps.plot_states["plot_0"].current_data
+        assert isinstance(current, MultiLineMessage)
+        np.testing.assert_array_equal(current.ml_data[0].y, line.y)
+
+
+def test_plot_connection_stream():
+    from unittest import mock
+
+    from davidia.plot import PlotConnection
+
+    app = _create_bare_app()
+    urls = []
+
+    class TestClientConnection:
+        """Adapter of test client session to websockets client connection"""
+
+        def __init__(self, client: TestClient, url: str):
+            urls.append(url)
+            path = url.split("8000", 1)[1]
+            self._context = client.websocket_connect(path)
+            self._session = self._context.__enter__()
+
+        def send(self, message):
+            self._session.send_bytes(message)
+
+        def recv(self):
+            return self._session.receive_bytes()
+
+        def close(self):
+            self._context.__exit__(None, None, None)
+
+    with TestClient(app) as client:
+        with mock.patch(
+            "davidia.plot.connect", lambda url: TestClientConnection(client, url)
+        ):
+            pc = PlotConnection("plot_1", stream=True)
+            try:
+                ack = pc.line(None, [np.arange(5.0), np.arange(8.0)])
+                assert ack is not None and ack.ack == 1 and ack.error is None
+                ack = pc.line(None, np.arange(3.0), plot_config={})
+                assert ack is not None and ack.ack == 2
+            finally:
+                pc.close()
+    assert urls == ["ws://localhost:8000/push/plot_1?ack=true"]
+
+
+def test_push_batch():
+    from davidia.models.messages import BatchMessage, HeatmapData, ImageMessage
+
+    app = _create_bare_app()
+    messages = [
+        MultiLineMessage(
+            plot_id=f"plot_{i}",
+            ml_data=[LineData(key="a", line_params=LineParams(), y=np.arange(i + 3))],
+        )
+        for i in range(3)
+    ]
+    messages.append(
+        MultiLineMessage(
+            plot_id="plot_0",
+            append=True,
+            ml_data=[LineData(line_params=LineParams(), y=np.arange(3, 5))],
+        )
+    )
+    messages.append(
+        ImageMessage(
+            plot_id="plot_3",
+            im_data=HeatmapData(values=np.ones((4, 4)), domain=(0, 1)),
+        )
+    )
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/push_batch",
+            content=ws_pack(BatchMessage(messages=messages)),
+            headers={"Content-Type": "application/x-msgpack"},
+        )
+        assert response.status_code == 200
+        assert j_loads(response.content) == "5 messages sent"
+
+    ps = getattr(app, "_plot_server")
+    assert sorted(ps.plot_states) == ["plot_0", "plot_1", "plot_2", "plot_3"]
+    line_0 = ps.plot_states["plot_0"].current_data
+    nppd_assert_equal(line_0.ml_data[0].y, np.arange(5))
+    nppd_assert_equal(ps.plot_states["plot_2"].current_data.ml_data[0].y, np.arange(5))
+    assert isinstance(ps.plot_states["plot_3"].current_data, ImageMessage)
+
+
+def test_plot_batch():
+    from unittest import mock
+
+    from davidia.plot import PlotConnection, batch
+
+    app = _create_bare_app()
+    with TestClient(app) as client:
+
+        def post(url, data=None, headers=None, timeout=None):
+            return client.post(url, content=data, headers=headers)
+
+        with mock.patch("requests.Session.post", side_effect=post) as mock_post:
+            pc_0 = PlotConnection("plot_0")
+            pc_1 = PlotConnection("plot_1")
+            with pytest.raises(RuntimeError):
+                with batch():
+                    pc_0.line(None, [np.arange(5.0)])
+                    raise RuntimeError("nothing pushed")
+            assert mock_post.call_count == 0
+
+            with pc_0.batch():
+                assert pc_0.line(None, [np.arange(5.0)]) is None
+                with batch():
+                    pc_1.line(None, [np.arange(3.0)])
+                pc_0.line(None, [np.arange(5.0, 7.0)], append=True)
+                assert mock_post.call_count == 0
+            mock_post.assert_called_once()
+            assert mock_post.call_args.args[0].endswith("/push_batch")
+
+    ps = getattr(app, "_plot_server")
+    nppd_assert_equal(ps.plot_states["plot_0"].current_data.ml_data[0].y, np.arange(7))
+    nppd_assert_equal(ps.plot_states["plot_1"].current_data.ml_data[0].y, np.arange(3))
+
+
+def test_plot_keyed_lines():
+    from unittest import mock
+
+    from davidia.plot import PlotConnection
+
+    app = _create_bare_app()
+    with TestClient(app) as client:
+
+        def post(url, data=None, headers=None, timeout=None):
+            return client.post(url, content=data, headers=headers)
+
+        with mock.patch("requests.Session.post", side_effect=post):
+            pc = PlotConnection("plot_0")
+            pc.line(None, [np.arange(5.0), np.arange(3.0)])
+            lines = getattr(app, "_plot_server").plot_states["plot_0"].current_data
+            key = lines.ml_data[1].key
+            assert pc.update_line(key, np.arange(2.0), append=True).status_code == 200
+            assert pc.update_line("c", np.arange(4.0), colour="red").status_code == 200
+            assert pc.remove_lines(lines.ml_data[0].key).status_code == 200
+
+    lines = getattr(app, "_plot_server").plot_states["plot_0"].current_data.ml_data
+    assert [ld.key for ld in lines] == [key, "c"]
+    nppd_assert_equal(lines[0].y, np.array([0.0, 1, 2, 0, 1]))
+    nppd_assert_equal(lines[0].x, np.arange(5))
+    assert lines[1].line_params.colour == "red"
+
+
+def test_plot_connection_session():
+    from unittest import mock
+
+    import davidia.plot as dp
+
+    app = _create_bare_app()
+    with TestClient(app) as client:
+        with client.websocket_connect("/plot/0a0a0a0a/plot_0"):
+            with client.websocket_connect("/plot/0a0a0a0a/plot_1"):
+
+                def get(url, timeout=None):
+                    assert timeout == dp.DEFAULT_TIMEOUT
+                    return client.get(url)
+
+                with mock.patch("requests.Session.get", side_effect=get) as mock_get:
+                    try:
+                        pc_0 = dp.get_plot_connection("plot_0", "localhost", 8001)
+                        pc_1 = dp.get_plot_connection("plot_1", "localhost", 8001)
+                        assert pc_0 is not pc_1
+                        assert pc_0._session is pc_1._session  # shared pool
+                        assert mock_get.call_count == 1  # plot IDs are cached
+                        pc_2 = dp.PlotConnection("plot_0", "localhost", 8002)
+                        assert pc_2._session is not pc_0._session
+                    finally:
+                        dp.close_plot_connections()
+                    assert not dp._SESSIONS
+
+
+@pytest.mark.asyncio
+async def test_async_plot_connection():
+    from davidia.models.selections import RectangularSelection
+    from davidia.plot import AsyncPlotConnection
+
+    app = _create_bare_app()
+    client = AsyncClient(transport=ASGITransport(app=app))  # pyright: ignore
+    async with AsyncPlotConnection("plot_0", client=client) as pc:
+        others = [pc.connection(f"plot_{i}") for i in range(1, 8)]
+        responses = await asyncio.gather(
+            pc.line(None, [np.arange(4.0)]),
+            *(o.image(np.full((4, 4), i)) for i, o in enumerate(others)),
+        )
+        assert all(r.status_code == 200 for r in responses)
+
+        selection = RectangularSelection(start=(1, 2), lengths=(3, 4))
+        assert (await pc.region(selection)).status_code == 200
+        regions = await pc.region(None)
+        assert len(regions) == 1 and regions[0].id == selection.id
+        assert (await pc.clear()).status_code == 200
+    assert not client.is_closed  # shared client is not closed
+    await client.aclose()
+
+    ps = getattr(app, "_plot_server")
+    assert ps.plot_states["plot_0"].current_data is None
+    for i in range(1, 8):
+        nppd_assert_equal(
+            ps.plot_states[f"plot_{i}"].current_data.im_data.values,
+            np.full((4, 4), i - 1),
+        )
+
+
+def test_plot_connection_background():
+    import threading
+    from unittest import mock
+
+    from davidia.plot import PlotConnection
+
+    app = _create_bare_app()
+    busy = threading.Event()
+    ready = threading.Event()
+    posted = []
+
+    with TestClient(app) as client:
+
+        def post(url, data=None, headers=None, timeout=None):
+            busy.set()
+            ready.wait(5)
+            posted.append(ws_unpack(data))
+            return client.post(url, content=data, headers=headers)
+
+        with mock.patch("requests.Session.post", side_effect=post):
+            pc_0 = PlotConnection("plot_0", background=True)
+            pc_1 = PlotConnection("plot_1", background=True)
+            assert pc_0.image(np.zeros((4, 4))) is None
+            assert busy.wait(5)  # server is busy with first image
+            for i in range(1, 4):
+                pc_0.image(np.full((4, 4), i))  # only newest is kept
+
+            y = np.arange(3.0)
+            pc_1.line(None, [y], plot_config={})
+            for _ in range(3):
+                y += 3  # data is copied when queued
+                pc_1.line(None, [y], append=True)  # concatenated
+            assert not pc_0.flush(0)
+
+            ready.set()
+            assert pc_0.flush(5)
+
+    assert len(posted) == 4
+    ps = getattr(app, "_plot_server")
+    nppd_assert_equal(
+        ps.plot_states["plot_0"].current_data.im_data.values, np.full((4, 4), 3)
+    )
+    nppd_assert_equal(ps.plot_states["plot_1"].current_data.ml_data[0].y, np.arange(12))
+
+
+def test_region_subscriptions():
+    from unittest import mock
+
+    from websockets.exceptions import ConnectionClosed
+
+    from davidia.models.messages import SelectionsMessage
+    from davidia.models.selections import CircularSelection, RectangularSelection
+    from davidia.plot import PlotConnection
+
+    app = _create_bare_app()
+    rs = RectangularSelection(start=(1, 2), lengths=(3, 4))
+    cs = CircularSelection(start=(0, 0), radius=2)
+    received = []
+    with TestClient(app) as client:
+
+        def post(url, data=None, headers=None, timeout=None):
+            return client.post(url, content=data, headers=headers)
+
+        def put(url, data=None, headers=None, timeout=None):
+            return client.put(url, content=data, headers=headers)
+
+        with (
+            mock.patch("requests.Session.post", side_effect=post),
+            mock.patch("requests.Session.put", side_effect=put),
+        ):
+            pc = PlotConnection("plot_0")
+            with client.websocket_connect("/regions/plot_0") as ws:
+                received.append(ws.receive_bytes())  # current regions
+                pc.region(rs)
+                received.append(ws.receive_bytes())
+                pc.region(cs, update=True)
+                received.append(ws.receive_bytes())
+                pc.region(None, delete=rs.id)
+                received.append(ws.receive_bytes())
+                pc.clear()
+                received.append(ws.receive_bytes())
+    ps = getattr(app, "_plot_server")
+    assert ps._region_subscribers["plot_0"] == []
+
+    ids = [
+        [s.id for s in SelectionsMessage.model_validate(ws_unpack(r)).set_selections]
+        for r in received
+    ]
+    assert ids == [[], [rs.id], [rs.id, cs.id], [cs.id], []]
+
+    class ScriptedConnection:
+        def __init__(self, url):
+            self.url = url
+
+        def recv(self):
+            time.sleep(0.01)
+            if received:
+                return received.pop(0)
+            raise ConnectionClosed(None, None)
+
+        def close(self):
+            pass
+
+    calls = []
+    with mock.patch("davidia.plot.connect", ScriptedConnection):
+        with PlotConnection("plot_0").subscribe_regions(calls.append) as sub:
+            assert sub._websocket.url == "ws://localhost:8000/regions/plot_0"
+            regions = sub.wait(timeout=5)
+            assert regions is not None and isinstance(regions[0], RectangularSelection)
+            assert sub.wait(lambda r: len(r) == 2, timeout=5) is not None
+            assert sub.wait(lambda r: len(r) == 3, timeout=5) is None  # closed
+    assert [len(c) for c in calls] == [0, 1, 2, 1, 0]
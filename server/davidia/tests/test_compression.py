@@ -0,0 +1,139 @@
+from unittest import mock
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from davidia.main import _create_bare_app
+from davidia.models.messages import (
+    HeatmapData,
+    ImageMessage,
+    LineData,
+    LineParams,
+    MultiLineMessage,
+)
+from davidia.server.compression import (
+    COMPRESSION_THRESHOLD,
+    Compression,
+    compress,
+    decompress,
+    is_available,
+)
+from davidia.server.fastapi_utils import PackedMessage, ws_pack, ws_unpack
+from davidia.server.plotserver import PlotServer
+
+
+@pytest.mark.parametrize("compression", list(Compression))
+def test_compress_round_trip(compression: Compression):
+    if not is_available(compression):
+        pytest.skip(f"{compression} is not available")
+    data = ws_pack({"values": np.zeros(10_000)})
+    assert data is not None
+    compressed = compress(data, compression)
+    if compression == Compression.none:
+        assert compressed is data
+    else:
+        assert len(compressed) < len(data) // 10
+    assert decompress(compressed) == data
+
+    small = ws_pack({"status": "ready"})
+    assert small is not None and len(small) < COMPRESSION_THRESHOLD
+    assert compress(small, compression) is small
+    assert decompress(small) is small
+
+
+def test_packed_message_compressed_once():
+    msg = PackedMessage(
+        ImageMessage(im_data=HeatmapData(values=np.zeros((64, 64)), domain=(0, 1)))
+    )
+    with mock.patch(
+        "davidia.server.fastapi_utils.compress", wraps=compress
+    ) as mock_compress:
+        compressed = msg.get(compression=Compression.lz4)
+        assert msg.get(compression=Compression.lz4) is compressed
+        assert mock_compress.call_count == 1
+    assert compressed is not None
+    assert decompress(compressed) == msg.get()
+
+
+@pytest.mark.asyncio
+async def test_clients_with_compression():
+    ps = PlotServer()
+    plain = await ps.add_client("plot_0", None, "0a0a0a0a")  # pyright: ignore
+    lz4_0 = await ps.add_client(
+        "plot_0",
+        None,  # pyright: ignore
+        "0b0b0b0b",
+        compression=Compression.lz4,
+    )
+    lz4_1 = await ps.add_client(
+        "plot_0",
+        None,  # pyright: ignore
+        "0c0c0c0c",
+        compression=Compression.lz4,
+    )
+    for c in (plain, lz4_0, lz4_1):
+        c.clear_queue()
+
+    line = LineData(key="a", line_params=LineParams(), y=np.zeros(10_000))
+    await ps.update(MultiLineMessage(plot_id="plot_0", ml_data=[line]))
+    uncompressed = plain.queue.get_nowait()
+    compressed = lz4_0.queue.get_nowait()
+    assert lz4_1.queue.get_nowait() is compressed  # compressed once
+    assert len(compressed) < len(uncompressed)
+    assert decompress(compressed) == uncompressed
+
+    # new clients get compressed snapshot
+    lz4_2 = await ps.add_client(
+        "plot_0",
+        None,  # pyright: ignore
+        "0d0d0d0d",
+        compression=Compression.lz4,
+    )
+    assert lz4_2.queue.get_nowait() is compressed
+
+
+def test_websocket_compression():
+    app = _create_bare_app()
+    line = LineData(key="a", line_params=LineParams(), y=np.zeros(10_000))
+
+    with TestClient(app) as client:
+        with client.websocket_connect("/plot/0a0a0a0a/plot_0?compression=lz4") as ws:
+            response = client.post(
+                "/push_data",
+                content=ws_pack(MultiLineMessage(plot_id="plot_0", ml_data=[line])),
+                headers={"Content-Type": "application/x-msgpack"},
+            )
+            assert response.status_code == 200
+            ws.send_bytes(ws_pack({"status": "ready"}))  # pyright: ignore
+            while True:
+                packed = ws.receive_bytes()
+                received = ws_unpack(decompress(packed))
+                if "mlData" in received:
+                    break
+
+    assert packed != decompress(packed)
+    np.testing.assert_array_equal(received["mlData"][0]["y"], line.y)
+
+
+def test_websocket_compression_ignored_for_browsers():
+    app = _create_bare_app()
+    line = LineData(key="a", line_params=LineParams(), y=np.zeros(10_000))
+
+    with TestClient(app) as client:
+        with client.websocket_connect(
+            "/plot/0a0a0a0a/plot_0?compression=lz4",
+            headers={"Origin": "http://localhost"},
+        ) as ws:
+            response = client.post(
+                "/push_data",
+                content=ws_pack(MultiLineMessage(plot_id="plot_0", ml_data=[line])),
+                headers={"Content-Type": "application/x-msgpack"},
+            )
+            assert response.status_code == 200
+            ws.send_bytes(ws_pack({"status": "ready"}))  # pyright: ignore
+            while True:
+                packed = ws.receive_bytes()
+                assert decompress(packed) is packed
+                if "mlData" in ws_unpack(packed):
+                    break
@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+
+from davidia.models.messages import (
+    ClientViewportMessage,
+    LineData,
+    LineParams,
+    MultiLineMessage,
+)
+from davidia.server.decimation import (
+    POINTS_PER_PIXEL,
+    decimate_indices,
+    decimate_line,
+    decimate_lines,
+)
+from davidia.server.fastapi_utils import as_model, ws_unpack
+from davidia.server.plotserver import PlotServer
+
+
+def _noisy_line(n: int):
+    rng = np.random.default_rng(123)
+    x = np.arange(n, dtype=np.float64)
+    y = np.sin(x / 500) + rng.random(n)
+    return x, y
+
+
+@pytest.mark.parametrize("increasing", [True, False])
+def test_decimate_indices_preserves_extremes(increasing: bool):
+    x, y = _noisy_line(100_000)
+    if not increasing:
+        x = x[::-1].copy()
+    width = 200
+    indices = decimate_indices(x, y, width)
+    assert indices is not None
+    assert indices.size <= POINTS_PER_PIXEL * width
+    assert np.all(np.diff(indices) > 0)
+    assert indices[0] == 0 and indices[-1] == y.size - 1
+    assert y[indices].max() == y.max()
+    assert y[indices].min() == y.min()
+
+    # each pixel column keeps its own extremes
+    if increasing:
+        edges = np.linspace(x[0], x[-1], width + 1)
+        column = np.clip(np.searchsorted(edges, x, side="right") - 1, 0, width - 1)
+        kept = np.zeros(y.size, dtype=bool)
+        kept[indices] = True
+        for c in (0, width // 2, width - 1):
+            in_column = column == c
+            assert y[in_column & kept].max() == y[in_column].max()
+            assert y[in_column & kept].min() == y[in_column].min()
+
+
+def test_decimate_indices_x_range():
+    x, y = _noisy_line(100_000)
+    indices = decimate_indices(x, y, 100, (20_000, 20_200))
+    assert indices is not None
+    np.testing.assert_array_equal(indices, np.arange(19_999, 20_202))
+
+    indices = decimate_indices(x, y, 100, (20_000, 60_000))
+    assert indices is not None
+    assert indices.size <= POINTS_PER_PIXEL * 100 + 2
+    assert x[indices[0]] < 20_000 and x[indices[1]] >= 20_000
+    assert x[indices[-1]] > 60_000 and x[indices[-2]] <= 60_000
+
+
+def test_decimate_small_lines_unchanged():
+    line = LineData(line_params=LineParams(), x=np.arange(10), y=np.arange(10))
+    assert decimate_line(line, 100) is line
+    msg = MultiLineMessage(ml_data=[line])
+    assert decimate_lines(msg, ClientViewportMessage(pixel_width=100)) is msg
+
+    edges = LineData(line_params=LineParams(), x=np.arange(1001), y=np.arange(1000))
+    assert decimate_line(edges, 10) is edges
+
+
+def test_decimate_line_with_nans():
+    x, y = _noisy_line(10_000)
+    y[:500] = np.nan
+    indices = decimate_indices(x, y, 50)
+    assert indices is not None
+    assert np.nanmax(y[indices]) == np.nanmax(y)
+    assert np.nanmin(y[indices]) == np.nanmin(y)
+
+
+def test_viewport_message_decoded():
+    msg = as_model({"pixelWidth": 640, "xRange": [1, 2]})
+    assert isinstance(msg, ClientViewportMessage)
+    assert msg.x_range == (1.0, 2.0)
+
+
+@pytest.mark.asyncio
+async def test_clients_with_viewport_receive_decimated_lines():
+    ps = PlotServer()
+    full = await ps.add_client("plot_0", None, "0a0a0a0a")  # pyright: ignore
+    small = await ps.add_client("plot_0", None, "0b0b0b0b")  # pyright: ignore
+    await ps.set_viewport("plot_0", small, ClientViewportMessage(pixel_width=100))
+    full.clear_queue()
+    small.clear_queue()
+
+    x, y = _noisy_line(10_000)
+    await ps.update(
+        MultiLineMessage(
+            ml_data=[LineData(key="a", line_params=LineParams(), x=x, y=y)]
+        )
+    )
+    received = ws_unpack(full.queue.get_nowait())
+    assert received["mlData"][0]["y"].size == y.size
+    received = ws_unpack(small.queue.get_nowait())
+    small_y = received["mlData"][0]["y"]
+    assert small_y.size <= POINTS_PER_PIXEL * 100
+    assert small_y.max() == y.max()
+
+    # appends are passed on until too many points have been appended
+    for i in range(4):
+        xa = np.arange(100) + x.size + 100 * i
+        await ps.update(
+            MultiLineMessage(
+                append=True,
+                ml_data=[LineData(line_params=LineParams(), x=xa, y=np.sin(xa))],
+            )
+        )
+    appended = [ws_unpack(small.queue.get_nowait()) for _ in range(4)]
+    assert [a["append"] for a in appended] == [True, True, True, True]
+    await ps.update(
+        MultiLineMessage(
+            append=True,
+            ml_data=[
+                LineData(line_params=LineParams(), x=xa + 100, y=np.sin(xa + 100))
+            ],
+        )
+    )
+    resent = ws_unpack(small.queue.get_nowait())
+    assert not resent["append"]
+    assert resent["mlData"][0]["x"][-1] == x.size + 499
+    assert resent["mlData"][0]["y"].size <= POINTS_PER_PIXEL * 100
+
+    # zooming in resends full resolution data in range
+    await ps.set_viewport(
+        "plot_0", small, ClientViewportMessage(pixel_width=100, x_range=(100, 200))
+    )
+    zoomed = ws_unpack(small.queue.get_nowait())
+    np.testing.assert_array_equal(zoomed["mlData"][0]["y"], y[99:202])
@@ -0,0 +1,215 @@
+import asyncio
+import time
+from unittest import mock
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from davidia.main import _create_bare_app
+from davidia.models.messages import (
+    HeatmapData,
+    ImageMessage,
+    ImageStackMessage,
+    MultiLineMessage,
+    SelectionsMessage,
+)
+from davidia.models.selections import RectangularSelection
+from davidia.plot import PlotConnection
+from davidia.server import derivations
+from davidia.server.derivations import Derivation, DerivationType, DerivedLine
+from davidia.server.plotserver import PlotServer
+from davidia.server.roi import SelectionMask, roi_values
+
+
+def test_derived_line():
+    values = np.arange(20.0).reshape(4, 5)
+    msg = ImageMessage(im_data=HeatmapData(values=values, domain=(0, 20)))
+    rs = RectangularSelection(start=(1, 1), lengths=(2, 2))
+    values, make_mask = roi_values(msg)
+    mask = make_mask(rs)
+
+    d = Derivation(plot_id="a", target_id="b", derivation_type="column_profile")
+    dl = DerivedLine(d)
+    update = dl.derive(msg, values, rs, mask, 1, 0)
+    assert update is not None and update.plot_id == "b"
+    line = update.update_lines[0]
+    assert line.key == d.id
+    np.testing.assert_allclose(line.x, [1.5, 2.5])
+    np.testing.assert_allclose(line.y, [8.5, 9.5])
+    assert dl.derive(msg, values, rs, mask, 1, 0) is None  # unchanged
+
+    dl = DerivedLine(d.model_copy(update={"derivation_type": "row_profile"}))
+    line = dl.derive(msg, values, rs, mask, 1, 0).update_lines[0]
+    np.testing.assert_allclose(line.x, [1.5, 2.5])
+    np.testing.assert_allclose(line.y, [6.5, 11.5])
+
+    # sums of data are appended while region is unchanged
+    dl = DerivedLine(d.model_copy(update={"derivation_type": "sum"}))
+    first = dl.derive(msg, values, rs, mask, 1, 0)
+    assert not first.append and first.update_lines[0].y[0] == 36
+    second = dl.derive(msg, 2 * values, rs, mask, 2, 0)
+    assert second.append and second.update_lines[0].x[0] == 1
+    moved = RectangularSelection(start=(0, 0), lengths=(1, 1))
+    restarted = dl.derive(msg, values, moved, make_mask(moved), 2, 0)
+    assert not restarted.append and restarted.update_lines[0].x[0] == 0
+
+
+def test_derived_stack_sum():
+    stack = np.arange(3 * 4 * 5, dtype=np.float64).reshape(3, 4, 5)
+    msg = ImageStackMessage(stack_data=HeatmapData(values=stack, domain=(0, 60)))
+    rs = RectangularSelection(start=(0, 0), lengths=(2, 1))
+    values, make_mask = roi_values(msg, 1)
+    mask = make_mask(rs)
+
+    dl = DerivedLine(Derivation(plot_id="a", target_id="b", derivation_type="sum"))
+    line = dl.derive(msg, values, rs, mask, 1, 1).update_lines[0]
+    np.testing.assert_allclose(line.y, stack[:, 0, :2].sum(axis=1))
+    assert dl.derive(msg, values, rs, mask, 1, 2) is None  # over all frames
+
+
+@pytest.mark.asyncio
+async def test_plot_server_derivations():
+    ps = PlotServer()
+    values = np.ones((16, 16))
+    await ps.update(
+        ImageMessage(
+            plot_id="plot_0", im_data=HeatmapData(values=values, domain=(0, 1))
+        )
+    )
+    with pytest.raises(ValueError):
+        await ps.add_derivation(
+            Derivation(plot_id="plot_0", target_id="plot_0", derivation_type="sum")
+        )
+
+    with mock.patch.object(derivations, "DEBOUNCE_INTERVAL", 0.01):
+        profile = await ps.add_derivation(
+            Derivation(
+                plot_id="plot_0",
+                target_id="plot_1",
+                derivation_type=DerivationType.column_profile,
+            )
+        )
+        total = await ps.add_derivation(
+            Derivation(plot_id="plot_0", target_id="plot_1", derivation_type="sum")
+        )
+        # burst of regions is derived once
+        for i in range(1, 5):
+            rs = RectangularSelection(start=(0, 0), lengths=(i, 2))
+            await ps.update(SelectionsMessage(plot_id="plot_0", set_selections=[rs]))
+        await asyncio.sleep(0.05)
+        assert len(ps.masks) == 1
+
+        lines = ps.plot_states["plot_1"].current_data
+        assert isinstance(lines, MultiLineMessage)
+        by_key = {d.key: d for d in lines.ml_data}
+        np.testing.assert_allclose(by_key[profile].y, np.ones(4))
+        np.testing.assert_allclose(by_key[total].y, [8])
+
+        # both derivations and statistics share mask
+        with mock.patch.object(SelectionMask, "of_image", side_effect=AssertionError):
+            stats = await ps.get_roi_stats("plot_0")
+        assert stats[0].count == 8
+
+        await ps.update(
+            ImageMessage(
+                plot_id="plot_0", im_data=HeatmapData(values=2 * values, domain=(0, 2))
+            )
+        )
+        await asyncio.sleep(0.05)
+        assert len(ps.masks) == 2
+        lines = ps.plot_states["plot_1"].current_data
+        by_key = {d.key: d for d in lines.ml_data}
+        np.testing.assert_allclose(by_key[total].y, [8, 16])
+
+        assert await ps.remove_derivation(total)
+        assert not await ps.remove_derivation(total)
+        lines = ps.plot_states["plot_1"].current_data
+        assert [d.key for d in lines.ml_data] == [profile]
+
+
+@pytest.mark.asyncio
+async def test_derivations_run_in_one_task(caplog):
+    ps = PlotServer()
+    await ps.update(
+        ImageMessage(
+            plot_id="plot_0", im_data=HeatmapData(values=np.ones((8, 8)), domain=(0, 1))
+        )
+    )
+    calls = []
+    running = []
+    overlapped = False
+
+    async def derive_lines(plot_id: str):
+        nonlocal overlapped
+        overlapped = overlapped or bool(running)
+        calls.append(plot_id)
+        running.append(plot_id)
+        await asyncio.sleep(0.03)
+        running.pop()
+
+    def select(i: int):
+        rs = RectangularSelection(start=(0, 0), lengths=(i, 2))
+        return ps.update(SelectionsMessage(plot_id="plot_0", set_selections=[rs]))
+
+    with (
+        mock.patch.object(derivations, "DEBOUNCE_INTERVAL", 0.01),
+        mock.patch.object(ps, "_derive_lines", side_effect=derive_lines),
+    ):
+        await ps.add_derivation(
+            Derivation(plot_id="plot_0", target_id="plot_1", derivation_type="sum")
+        )
+        await asyncio.sleep(0.02)  # now deriving lines
+        assert calls == ["plot_0"]
+        await select(1)
+        await select(2)
+        assert len(ps._derive_tasks) == 1
+        await asyncio.sleep(0.1)
+        assert calls == ["plot_0", "plot_0"]  # changes are derived once more
+        assert not overlapped and not ps._derive_tasks
+
+    with (
+        mock.patch.object(derivations, "DEBOUNCE_INTERVAL", 0.01),
+        mock.patch.object(ps, "_derive_lines", side_effect=RuntimeError("failed")),
+    ):
+        await select(3)
+        await asyncio.sleep(0.05)
+    assert "Could not derive lines of plot_0" in caplog.text
+    assert not ps._derive_tasks
+
+
+def test_derivation_end_points():
+    app = _create_bare_app()
+    with TestClient(app) as client:
+
+        def post(url, data=None, headers=None, timeout=None):
+            return client.post(url, content=data, headers=headers)
+
+        def put(url, data=None, headers=None, timeout=None):
+            return client.put(url, content=data, headers=headers)
+
+        with (
+            mock.patch("requests.Session.post", side_effect=post),
+            mock.patch("requests.Session.put", side_effect=put),
+            mock.patch.object(derivations, "DEBOUNCE_INTERVAL", 0.01),
+        ):
+            pc = PlotConnection("plot_0")
+            stack = np.arange(3 * 4 * 4, dtype=np.float64).reshape(3, 4, 4)
+            pc.image_stack(stack)
+            pc.region([RectangularSelection(start=(0, 0), lengths=(4, 4))])
+            derivation_id = pc.derive("plot_1", "sum")
+
+            ps = getattr(app, "_plot_server")
+            for _ in range(100):
+                lines = ps.plot_states["plot_1"].current_data
+                if lines is not None:
+                    break
+                time.sleep(0.01)  # let server run derivation
+            assert isinstance(lines, MultiLineMessage)
+            assert lines.ml_data[0].key == derivation_id
+            np.testing.assert_allclose(lines.ml_data[0].y, stack.sum(axis=(1, 2)))
+
+            with pytest.raises(Exception):
+                pc.derive("plot_0", "sum")
+            assert pc.remove_derivation(derivation_id).status_code == 200
+            assert pc.remove_derivation(derivation_id).status_code == 404
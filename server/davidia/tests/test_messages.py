@@ -4,17 +4,21 @@ import pytest
 from davidia.models.parameters import PlotConfig
 from davidia.models.messages import GlyphType
 from davidia.models.messages import (
+    ALL_MODELS,
     DvDNDArray,
     LineData,
     LineParams,
     MultiLineMessage,
 )
+from davidia.server.fastapi_utils import _candidate_models, as_model
 from davidia.server.plotserver import (
     add_indices,
     add_default_indices,
     add_colour_to_lines,
     check_line_names,
     combine_line_messages,
+    GrowableArray,
+    LineBuffers,
 )
 
 
@@ -453,6 +457,48 @@ def test_combine_line_messages(
     assert_line_data_messages_are_equal(al_msg, expected[1])
 
 
+def test_growable_array():
+    ga = GrowableArray(np.arange(3, dtype=np.uint8))
+    capacity = ga.capacity
+    first = ga.view
+    v = ga.extend(np.arange(3, 6, dtype=np.uint8))
+    assert v.dtype == np.uint8
+    assert np.array_equal(v, np.arange(6))
+    assert ga.capacity == capacity
+    assert np.array_equal(first, np.arange(3))
+
+    v = ga.extend(np.array([-1.5]))
+    assert v.dtype == np.float64
+    assert np.array_equal(v, [0, 1, 2, 3, 4, 5, -1.5])
+
+    v = ga.extend(np.arange(capacity, dtype=np.float64))
+    assert ga.capacity >= 2 * capacity
+    assert v.size == 7 + capacity
+    assert np.array_equal(v[7:], np.arange(capacity))
+
+
+@pytest.mark.parametrize("default_indices", [False, True])
+def test_combine_line_messages_reuses_buffers(default_indices: bool):
+    buffers = LineBuffers()
+    current = MultiLineMessage(
+        ml_data=[generate_test_data("100", default_indices=default_indices)]
+    )
+    expected_y = list(current.ml_data[0].y)
+    bases = []
+    for i in range(20):
+        batch = generate_test_data("010", x=not default_indices)
+        expected_y.extend(batch.y)
+        current, _ = combine_line_messages(
+            current, MultiLineMessage(append=True, ml_data=[batch]), buffers
+        )
+        line = current.ml_data[0]
+        assert line.key == "100"
+        assert np.array_equal(line.y, expected_y)
+        assert line.x is not None and line.x.size == line.y.size
+        bases.append(line.y.base)
+    assert all(b is bases[0] for b in bases[1:])
+
+
 @pytest.mark.parametrize(
     "name,msg,expected",
     [
@@ -643,3 +689,38 @@ def test_check_line_names(name, input: list[LineData], expected: list[LineData])
 
     for a, b in zip(expected, renamed_lines):
         assert_line_data_are_equal(a, b)
+
+
+@pytest.mark.parametrize(
+    "raw,expected",
+    [
+        ({"status": "ready"}, "ClientStatusMessage"),
+        ({"pixelWidth": 10, "x_range": [0, 1]}, "ClientViewportMessage"),
+        ({"mlData": [{"y": [1, 2], "lineParams": {}}]}, "MultiLineMessage"),
+        ({"plotId": "plot_0"}, "ClearPlotMessage"),
+        ({"values": np.eye(2), "domain": [0, 1]}, "HeatmapData"),
+        ({"values": np.eye(2)}, "ImageData"),
+        ({"xLabel": "x"}, "PlotConfig"),
+        ({"receiver": "a1b2"}, "BatonDonateMessage"),
+        ({"status": "ready", "other": 1}, "ClientStatusMessage"),
+        ({"values": np.eye(2), "other": 1}, None),
+        ({"unknown": 1}, None),
+    ],
+)
+def test_as_model_uses_key_signature(raw: dict, expected: str | None):
+    by_trial = None
+    for m in ALL_MODELS:
+        try:
+            by_trial = m.model_validate(raw)
+            break
+        except Exception:
+            pass
+
+    msg = as_model(raw)
+    assert type(msg) is type(by_trial)
+    candidates = _candidate_models(frozenset(raw))
+    if expected is None:
+        assert msg is None
+    else:
+        assert type(msg).__name__ == expected
+        assert candidates[0] is type(msg)  # validated once
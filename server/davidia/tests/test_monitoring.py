@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+from unittest import mock
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from davidia.main import _create_bare_app
+from davidia.models.messages import HeatmapData, ImageMessage
+from davidia.server import fastapi_utils
+from davidia.server.fastapi_utils import (
+    ArrayFormat,
+    PackedMessage,
+    array_nbytes,
+    offload,
+    ws_pack,
+)
+from davidia.server.monitoring import LoopLagMonitor
+from davidia.server.plotserver import PlotServer
+from davidia.server.queues import QueuePolicy
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_monitor():
+    monitor = LoopLagMonitor(interval=0.01)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    time.sleep(0.2)  # block event loop
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+
+    stats = monitor.stats
+    assert stats.samples > 2
+    assert stats.max >= 0.15
+    assert stats.mean < stats.max
+
+    monitor.reset()
+    assert monitor.stats.samples == 0
+
+
+def test_array_nbytes():
+    msg = ImageMessage(im_data=HeatmapData(values=np.zeros((10, 20)), domain=(0, 1)))
+    assert array_nbytes(msg) == 10 * 20 * 8
+    assert array_nbytes({"a": [np.zeros(3, dtype=np.uint8), 1]}) == 3
+
+
+@pytest.mark.asyncio
+async def test_offload():
+    main_thread = threading.get_ident()
+    assert await offload(10, threading.get_ident) == main_thread
+    with mock.patch.object(fastapi_utils, "OFFLOAD_THRESHOLD", 10):
+        assert await offload(10, threading.get_ident) != main_thread
+
+
+@pytest.mark.asyncio
+async def test_large_messages_packed_in_worker_thread():
+    threads = []
+
+    def recording_ws_pack(obj, *args):
+        threads.append(threading.get_ident())
+        return ws_pack(obj, *args)
+
+    ps = PlotServer()
+    client = await ps.add_client("plot_0", None, "0a0a0a0a")  # pyright: ignore
+    client.array_format = ArrayFormat.ext
+    msg = ImageMessage(
+        plot_id="plot_0", im_data=HeatmapData(values=np.zeros((8, 8)), domain=(0, 1))
+    )
+    with mock.patch.object(fastapi_utils, "OFFLOAD_THRESHOLD", 64):
+        with mock.patch("davidia.server.fastapi_utils.ws_pack", recording_ws_pack):
+            await ps.update(msg)
+    assert len(threads) == 1
+    assert threads[0] != threading.get_ident()
+
+    data_message = ps.plot_states["plot_0"].data_message
+    assert isinstance(data_message, PackedMessage)
+    assert data_message.nbytes == 8 * 8 * 8
+
+
+@pytest.mark.asyncio
+async def test_snapshot_for_full_queue_packed_in_worker_thread():
+    threads = []
+
+    def recording_ws_pack(obj, *args):
+        threads.append(threading.get_ident())
+        return ws_pack(obj, *args)
+
+    ps = PlotServer(QueuePolicy(max_size=2))
+    client = await ps.add_client("plot_0", None, "0a0a0a0a")  # pyright: ignore
+    client.clear_queue()
+    with mock.patch.object(fastapi_utils, "OFFLOAD_THRESHOLD", 64):
+        with mock.patch("davidia.server.fastapi_utils.ws_pack", recording_ws_pack):
+            for i in range(3):
+                await ps.update(
+                    ImageMessage(
+                        plot_id="plot_0",
+                        im_data=HeatmapData(values=np.full((8, 8), i), domain=(0, 1)),
+                    )
+                )
+                await client.add_message(b"control")  # fill queue
+    assert threads and all(t != threading.get_ident() for t in threads)
+    assert client.queue.dropped > 0
+
+
+def test_get_loop_lag_endpoint():
+    app = _create_bare_app()
+    with TestClient(app) as client:
+        time.sleep(0.2)
+        stats = client.get("/get_loop_lag", params={"reset": True}).json()
+        assert stats["samples"] > 0
+        assert client.get("/get_loop_lag").json()["samples"] < stats["samples"]
@@ -1,7 +1,9 @@
+import asyncio
 import datetime
 import logging
 import time
 from collections import defaultdict
+from unittest import mock
 from unittest.mock import AsyncMock, Mock
 
 import before_after
@@ -9,17 +11,27 @@ import numpy as np
 import pytest
 
 from davidia.models.messages import (
+    ClearLinesMessage,
     ClearSelectionsMessage,
+    ClientLineParametersMessage,
+    ClientScatterParametersMessage,
+    HeatmapData,
+    ImageMessage,
+    ImagePatchMessage,
     LineData,
     LineParams,
+    LineParamsMessage,
     MultiLineMessage,
+    ScatterData,
+    ScatterMessage,
+    ScatterParamsMessage,
     SelectionsMessage,
-    StatusType,
     TableData,
     TableMessage,
+    UpdateLinesMessage,
 )
 from davidia.models.selections import LinearSelection, RectangularSelection
-from davidia.server.fastapi_utils import ws_pack, ws_unpack
+from davidia.server.fastapi_utils import as_model, ws_pack, ws_unpack
 from davidia.server.plotserver import (
     PlotClient,
     PlotServer,
@@ -44,7 +56,6 @@ def no_error_logging(request, caplog):
 
 def test_initialise_plotserver():
     ps = PlotServer()
-    assert ps.client_status == StatusType.busy
     assert ps._clients == {}
     assert ps.plot_states == {}
     assert ps.client_total == 0
@@ -55,7 +66,6 @@ def test_initialise_plotserver():
 async def test_send_points():
     ps = PlotServer()
 
-    assert ps.client_status == StatusType.busy
     assert not ps.clients_available()
     assert ps.plot_states == {}
 
@@ -80,14 +90,10 @@ async def test_send_points():
     plot_state_0.new_data_message = msg
     assert not ps.clients_available()
 
-    assert ps.client_status == StatusType.busy
     assert plot_state_0.current_data == line_as_dict
     assert plot_state_0.new_data_message == msg
     assert not ps.clients_available()
 
-    await ps.send_next_message()
-
-    assert ps.client_status == StatusType.busy
     assert plot_state_0.current_data == line_as_dict
     assert plot_state_0.new_data_message == msg
     assert not ps.clients_available()
@@ -113,7 +119,7 @@ async def test_add_and_remove_clients(caplog):
     plot_state_0.current_data = data_0  # pyrefly: ignore[bad-argument-type]
     plot_state_0.current_selections = selection_0  # pyrefly: ignore[bad-argument-type]
 
-    def update_plot_state(pc, bytes):
+    def update_plot_state(pc, message, *args):
         time.sleep(2)
         if not plot_state_0.lock.locked():
             plot_state_0.clear()
@@ -393,3 +399,342 @@ async def test_update():
     ):
         await ps.update(append_line)
         assert isinstance(plot_state_0.current_data, MultiLineMessage)
+
+
+@pytest.mark.asyncio
+async def test_update_appends_to_current_data():
+    ps = PlotServer()
+    await ps.update(
+        MultiLineMessage(
+            plot_id="plot_0",
+            ml_data=[LineData(key="a", line_params=LineParams(), y=np.arange(5))],
+        )
+    )
+    for i in range(1, 4):
+        await ps.update(
+            MultiLineMessage(
+                plot_id="plot_0",
+                append=True,
+                ml_data=[
+                    LineData(line_params=LineParams(), y=np.arange(5 * i, 5 * (i + 1)))
+                ],
+            )
+        )
+
+    current_data = ps.plot_states["plot_0"].current_data
+    assert isinstance(current_data, MultiLineMessage)
+    assert not current_data.append
+    line = current_data.ml_data[0]
+    assert line.key == "a"
+    nppd_assert_equal(line.y, np.arange(20))
+    nppd_assert_equal(line.x, np.arange(20, dtype=np.uint8))
+
+    new_data_message = ps.plot_states["plot_0"].new_data_message
+    assert new_data_message is not None
+    unpacked = ws_unpack(new_data_message)
+    nppd_assert_equal(unpacked["mlData"][0]["y"], np.arange(20, dtype=np.uint8))
+
+    # replacing data releases buffers that backed appended lines
+    assert ps.plot_states["plot_0"].line_buffers._arrays
+    await ps.update(
+        MultiLineMessage(
+            plot_id="plot_0",
+            ml_data=[LineData(key="b", line_params=LineParams(), y=np.arange(3))],
+        )
+    )
+    assert not ps.plot_states["plot_0"].line_buffers._arrays
+
+
+@pytest.mark.asyncio
+async def test_new_data_message_packed_on_demand():
+    ps = PlotServer()
+    await ps.update(
+        MultiLineMessage(
+            plot_id="plot_0",
+            ml_data=[LineData(key="a", line_params=LineParams(), y=np.arange(5))],
+        )
+    )
+    plot_state = ps.plot_states["plot_0"]
+    packed = []
+
+    def counting_ws_pack(obj, *args):
+        packed.append(obj)
+        return ws_pack(obj, *args)
+
+    with mock.patch("davidia.server.fastapi_utils.ws_pack", counting_ws_pack):
+        for i in range(1, 4):
+            await ps.update(
+                MultiLineMessage(
+                    plot_id="plot_0",
+                    append=True,
+                    ml_data=[
+                        LineData(
+                            line_params=LineParams(), y=np.arange(5 * i, 5 * (i + 1))
+                        )
+                    ],
+                )
+            )
+        assert len(packed) == 0  # no clients to send append messages
+
+        snapshot = plot_state.new_data_message
+        assert snapshot is not None
+        assert plot_state.new_data_message is snapshot
+        assert len(packed) == 1
+        assert packed[-1] is plot_state.current_data
+
+    nppd_assert_equal(
+        ws_unpack(snapshot)["mlData"][0]["y"], np.arange(20, dtype=np.uint8)
+    )
+
+    plot_state.clear()
+    assert plot_state.new_data_message is None
+
+
+@pytest.mark.asyncio
+async def test_slow_client_does_not_delay_others():
+    unblock = asyncio.Event()
+
+    async def slow_send_bytes(_):
+        await unblock.wait()
+
+    slow_websocket = AsyncMock()
+    slow_websocket.send_bytes.side_effect = slow_send_bytes
+    fast_websocket = AsyncMock()
+
+    ps = PlotServer()
+    slow = await ps.add_client("plot_0", slow_websocket, "0f1e2d3c")
+    fast = await ps.add_client("plot_1", fast_websocket, "4b5a6978")
+    slow.start()
+    fast.start()
+
+    msgs = [ws_pack({"a": i}) for i in range(5)]
+    for m in msgs:
+        await slow.add_message(m)
+        await fast.add_message(m)
+    await asyncio.wait_for(fast.queue.join(), 1)
+
+    sent = [c.args[0] for c in fast_websocket.send_bytes.await_args_list]
+    assert sent[-5:] == msgs
+    assert slow_websocket.send_bytes.await_count == 1
+    assert slow.is_writing
+
+    unblock.set()
+    await asyncio.wait_for(slow.queue.join(), 1)
+    sent = [c.args[0] for c in slow_websocket.send_bytes.await_args_list]
+    assert sent[-5:] == msgs
+
+    await ps.remove_client("plot_0", slow)
+    await ps.remove_client("plot_1", fast)
+    assert not slow.is_writing
+    assert not fast.is_writing
+
+
+@pytest.mark.asyncio
+async def test_parameter_updates_sent_without_data():
+    ps = PlotServer()
+    sender = await ps.add_client("plot_0", AsyncMock(), "0f1e2d3c")
+    other = await ps.add_client("plot_0", AsyncMock(), "4b5a6978")
+    await ps.update(
+        MultiLineMessage(
+            plot_id="plot_0",
+            ml_data=[
+                LineData(key="a", line_params=LineParams(), y=np.arange(100_000)),
+                LineData(key="b", line_params=LineParams(), y=np.arange(100_000)),
+            ],
+        )
+    )
+    for c in (sender, other):
+        while not c.queue.empty():
+            c.queue.get_nowait()
+    plot_state = ps.plot_states["plot_0"]
+    old_lines = plot_state.current_data
+
+    await ps.prepare_client(
+        "plot_0",
+        ClientLineParametersMessage(key="b", line_params=LineParams(width=3)),
+        sender,
+    )
+    assert sender.queue.empty()
+    packed = other.queue.get_nowait()
+    assert len(packed) < 200
+    msg = as_model(ws_unpack(packed))
+    assert isinstance(msg, LineParamsMessage)
+    assert msg.key == "b" and msg.line_params.width == 3
+    assert msg.line_params.colour is not None  # given default colour
+
+    lines = plot_state.current_data.ml_data
+    assert lines[1].line_params == msg.line_params
+    assert old_lines.ml_data[1].line_params.width is None  # data is copied
+    assert lines[1].y is old_lines.ml_data[1].y
+    nppd_assert_equal(lines[1].y, np.arange(100_000))
+    snapshot = ws_unpack(plot_state.new_data_message)
+    assert snapshot["mlData"][1]["lineParams"]["width"] == 3
+
+    with pytest.raises(ValueError):
+        await ps.prepare_client(
+            "plot_0",
+            ClientLineParametersMessage(key="c", line_params=LineParams()),
+        )
+
+    await ps.update(
+        ScatterMessage(
+            plot_id="plot_0",
+            sc_data=ScatterData(
+                x=np.arange(10),
+                y=np.arange(10),
+                point_values=np.arange(10),
+                domain=(0, 9),
+            ),
+        )
+    )
+    for c in (sender, other):
+        while not c.queue.empty():
+            c.queue.get_nowait()
+    old_scatter = plot_state.current_data
+    await ps.prepare_client(
+        "plot_0", ClientScatterParametersMessage(point_size=4), sender
+    )
+    msg = as_model(ws_unpack(other.queue.get_nowait()))
+    assert isinstance(msg, ScatterParamsMessage)
+    assert msg.point_size == 4
+    assert plot_state.current_data.sc_data.point_size == 4
+    assert old_scatter.sc_data.point_size != 4
+    snapshot = ws_unpack(plot_state.new_data_message)
+    assert snapshot["scData"]["pointSize"] == 4
+
+
+@pytest.mark.asyncio
+async def test_keyed_line_updates():
+    ps = PlotServer()
+    client = await ps.add_client("plot_0", AsyncMock(), "0f1e2d3c")
+    await ps.update(
+        MultiLineMessage(
+            plot_id="plot_0",
+            ml_data=[
+                LineData(
+                    key=f"ch{i}",
+                    line_params=LineParams(),
+                    y=np.arange(10_000.0),
+                    default_indices=True,
+                )
+                for i in range(50)
+            ],
+        )
+    )
+    while not client.queue.empty():
+        client.queue.get_nowait()
+    plot_state = ps.plot_states["plot_0"]
+    assert plot_state.line_index["ch49"] == 49
+
+    # append to one channel
+    await ps.update(
+        UpdateLinesMessage(
+            plot_id="plot_0",
+            append=True,
+            update_lines=[
+                LineData(key="ch7", line_params=LineParams(), y=np.arange(5.0))
+            ],
+        )
+    )
+    packed = client.queue.get_nowait()
+    assert len(packed) < 500
+    sent = ws_unpack(packed)
+    assert sent["append"] and sent["updateLines"][0]["key"] == "ch7"
+    nppd_assert_equal(sent["updateLines"][0]["x"], np.arange(10_000, 10_005))
+
+    lines = plot_state.current_data.ml_data
+    nppd_assert_equal(lines[7].y[-5:], np.arange(5.0))
+    assert lines[7].y.size == 10_005 and lines[8].y.size == 10_000
+    assert lines[7].line_params.name == "Line 7"
+    assert ("ch7", "y") in plot_state.line_buffers._arrays
+
+    # replace one channel and add another
+    await ps.update(
+        UpdateLinesMessage(
+            plot_id="plot_0",
+            update_lines=[
+                LineData(key="ch7", line_params=LineParams(), y=np.arange(3.0)),
+                LineData(key="new", line_params=LineParams(), y=np.arange(4.0)),
+            ],
+        )
+    )
+    client.queue.get_nowait()
+    lines = plot_state.current_data.ml_data
+    assert len(lines) == 51
+    assert lines[7].y.size == 3 and lines[7].line_params.name == "Line 7"
+    assert lines[50].key == "new" and lines[50].line_params.colour is not None
+    assert plot_state.line_index["new"] == 50
+    assert ("ch7", "y") not in plot_state.line_buffers._arrays
+
+    # remove lines
+    await ps.update(ClearLinesMessage(plot_id="plot_0", line_keys=["ch0", "missing"]))
+    assert ws_unpack(client.queue.get_nowait())["lineKeys"] == ["ch0"]
+    assert len(plot_state.current_data.ml_data) == 50
+    assert "ch0" not in plot_state.line_index
+    assert plot_state.line_index["new"] == 49
+    await ps.update(ClearLinesMessage(plot_id="plot_0", line_keys=["ch0"]))
+    assert client.queue.empty()
+
+    snapshot = ws_unpack(plot_state.new_data_message)
+    assert [ld["key"] for ld in snapshot["mlData"]][:2] == ["ch1", "ch2"]
+
+    # keyed lines become data of plot without lines
+    await ps.update(
+        UpdateLinesMessage(
+            plot_id="plot_1",
+            update_lines=[
+                LineData(
+                    key="a",
+                    line_params=LineParams(),
+                    y=np.arange(4.0),
+                    default_indices=True,
+                )
+            ],
+        )
+    )
+    current_data = ps.plot_states["plot_1"].current_data
+    assert isinstance(current_data, MultiLineMessage)
+    nppd_assert_equal(current_data.ml_data[0].x, np.arange(4))
+
+
+@pytest.mark.asyncio
+async def test_image_patches():
+    ps = PlotServer()
+    client = await ps.add_client("plot_0", AsyncMock(), "0f1e2d3c")
+    frame = np.zeros((512, 512), dtype=np.uint16)
+    frame.flags.writeable = False
+    await ps.update(
+        ImageMessage(plot_id="plot_0", im_data=HeatmapData(values=frame, domain=(0, 1)))
+    )
+    while not client.queue.empty():
+        client.queue.get_nowait()
+
+    module = np.full((64, 128), 7, dtype=np.uint16)
+    await ps.update(
+        ImagePatchMessage(
+            plot_id="plot_0", offset=(128, 64), patch_values=module, domain=(0, 7)
+        )
+    )
+    packed = client.queue.get_nowait()
+    assert len(packed) < module.nbytes + 200
+    sent = ws_unpack(packed)
+    assert sent["offset"] == [128, 64]
+
+    values = ps.plot_states["plot_0"].current_data.im_data.values
+    assert not np.shares_memory(values, frame)  # read-only frame was copied
+    assert values[64:128, 128:256].min() == 7 and values.sum() == module.sum()
+    await ps.update(
+        ImagePatchMessage(plot_id="plot_0", offset=(0, 0), patch_values=module)
+    )
+    assert ps.plot_states["plot_0"].current_data.im_data.values is values
+
+    # late joiners get composed frame
+    snapshot = ws_unpack(ps.plot_states["plot_0"].new_data_message)
+    assert snapshot["imData"]["domain"] == [0, 7]
+    nppd_assert_equal(snapshot["imData"]["values"], values)
+    assert snapshot["imData"]["values"].sum() == 2 * module.sum()
+
+    with pytest.raises(ValueError):
+        await ps.update(
+            ImagePatchMessage(plot_id="plot_0", offset=(500, 0), patch_values=module)
+        )
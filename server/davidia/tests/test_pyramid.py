@@ -0,0 +1,173 @@
+import numpy as np
+import pytest
+
+from davidia.models.messages import (
+    ClientTilesRequestMessage,
+    HeatmapData,
+    ImageData,
+    ImageMessage,
+    ImagePatchMessage,
+    ImageTileMessage,
+    PlotConfig,
+)
+from davidia.server.fastapi_utils import as_model, ws_unpack
+from davidia.server.plotserver import PlotServer
+from davidia.server.pyramid import ImagePyramid, downsample
+
+
+def test_downsample():
+    values = np.arange(12, dtype=np.float32).reshape(3, 4)
+    small = downsample(values)
+    assert small.dtype == np.float32
+    np.testing.assert_array_equal(small, [[2.5, 4.5], [8.5, 10.5]])
+
+    rgb = np.zeros((5, 5, 3), dtype=np.uint8)
+    rgb[..., 0] = 255
+    small = downsample(rgb)
+    assert small.shape == (3, 3, 3) and small.dtype == np.uint8
+    assert np.all(small[..., 0] == 255) and np.all(small[..., 1:] == 0)
+
+
+def _image(rows: int, cols: int, tile_size: int | None = 64):
+    values = np.arange(rows * cols, dtype=np.float64).reshape(rows, cols)
+    return ImageMessage(
+        plot_id="plot_0",
+        im_data=HeatmapData(
+            values=values, domain=(0, rows * cols), tile_size=tile_size
+        ),
+        plot_config=PlotConfig(
+            x_values=np.arange(cols + 1, dtype=np.float64),
+            y_values=np.arange(rows, dtype=np.float64),
+        ),
+    )
+
+
+def test_pyramid_levels_and_tiles():
+    pyramid = ImagePyramid(_image(300, 200))
+    assert [lv.shape for lv in pyramid.levels] == [
+        (300, 200),
+        (150, 100),
+        (75, 50),
+        (38, 25),
+    ]
+
+    overview = pyramid.overview_message()
+    assert overview.pyramid is not None
+    assert overview.pyramid.shape == (300, 200)
+    assert overview.pyramid.levels == 4
+    assert overview.pyramid.level == 3
+    assert overview.im_data.values.shape == (38, 25)
+    assert overview.plot_config.x_values.size == 26
+    assert overview.plot_config.x_values[-1] == 200
+    assert overview.plot_config.y_values.size == 38
+    assert pyramid.msg.im_data.values.shape == (300, 200)
+
+    assert len(pyramid.tile_indices(0)) == 5 * 4
+    assert pyramid.tile_indices(0, (60, 0, 70, 10)) == [(0, 0), (0, 1)]
+    assert pyramid.tile_indices(1, (130, 130, 1000, 1000)) == [(1, 1), (2, 1)]
+    with pytest.raises(ValueError):
+        pyramid.tile_indices(4)
+
+    tile = pyramid.tile(0, 4, 3)
+    assert tile.shape == (44, 8)
+    np.testing.assert_array_equal(tile, pyramid.levels[0][256:, 192:])
+
+    packed = pyramid.packed_tile("plot_0", 0, 4, 3)
+    assert pyramid.packed_tile("plot_0", 0, 4, 3) is packed
+    msg = as_model(ws_unpack(packed.get()))
+    assert isinstance(msg, ImageTileMessage)
+    assert msg.offset == (192, 256)
+    np.testing.assert_array_equal(msg.tile_values, tile)
+
+
+def test_pyramid_update():
+    pyramid = ImagePyramid(_image(300, 201))
+    packed = pyramid.packed_tile("plot_0", 0, 0, 0)
+    kept = pyramid.packed_tile("plot_0", 0, 4, 3)
+    overview = pyramid.packed_tile("plot_0", 3, 0, 0)
+
+    patch = np.full((45, 70), -1.0)
+    pyramid.update(131, 3, patch)
+    expected = _image(300, 201)
+    expected.im_data.values[3:48, 131:201] = patch
+    for level, values in zip(pyramid.levels, ImagePyramid(expected).levels):
+        np.testing.assert_array_equal(level, values)
+
+    assert pyramid.packed_tile("plot_0", 0, 0, 0) is packed  # not covered
+    assert pyramid.packed_tile("plot_0", 0, 4, 3) is kept
+    assert pyramid.packed_tile("plot_0", 3, 0, 0) is not overview
+
+
+def test_invalid_tile_size():
+    with pytest.raises(ValueError):
+        ImageData(values=np.zeros((2, 2)), tile_size=0)
+
+
+def test_tiles_request_decoded():
+    msg = as_model({"level": 1, "region": [0, 0, 10, 10]})
+    assert isinstance(msg, ClientTilesRequestMessage)
+    assert msg.region == (0, 0, 10, 10)
+
+
+@pytest.mark.asyncio
+async def test_clients_receive_overview_and_requested_tiles():
+    ps = PlotServer()
+    client = await ps.add_client(
+        "plot_0",
+        None,  # pyright: ignore
+        "0a0a0a0a",
+        tiles=True,
+    )
+    full = await ps.add_client("plot_0", None, "0c0c0c0c")  # pyright: ignore
+    client.clear_queue()
+    full.clear_queue()
+
+    await ps.update(_image(300, 200))
+    received = ws_unpack(client.queue.get_nowait())
+    assert received["imData"]["values"].shape == (38, 25)
+    assert received["pyramid"]["levels"] == 4
+    assert ps.plot_states["plot_0"].current_data.im_data.values.shape == (300, 200)
+
+    # clients that do not request tiles get full resolution image and patches
+    received = ws_unpack(full.queue.get_nowait())
+    assert received["imData"]["values"].shape == (300, 200)
+    assert received.get("pyramid") is None
+    await ps.update(
+        ImagePatchMessage(
+            plot_id="plot_0", offset=(0, 0), patch_values=np.zeros((2, 2))
+        )
+    )
+    received = ws_unpack(full.queue.get_nowait())
+    assert received["patchValues"].shape == (2, 2)
+    received = ws_unpack(client.queue.get_nowait())
+    assert received["imData"]["values"].shape == (38, 25)
+
+    await ps.send_tiles(
+        "plot_0", client, ClientTilesRequestMessage(level=0, region=(0, 0, 64, 128))
+    )
+    tiles = [ws_unpack(client.queue.get_nowait()) for _ in range(2)]
+    assert client.queue.empty()
+    assert [t["offset"] for t in tiles] == [[0, 0], [0, 64]]
+
+    # new clients also get overview or full resolution image
+    other = await ps.add_client(
+        "plot_0",
+        None,  # pyright: ignore
+        "0b0b0b0b",
+        tiles=True,
+    )
+    received = ws_unpack(other.queue.get_nowait())
+    assert received["imData"]["values"].shape == (38, 25)
+    other = await ps.add_client("plot_0", None, "0d0d0d0d")  # pyright: ignore
+    received = ws_unpack(other.queue.get_nowait())
+    assert received["imData"]["values"].shape == (300, 200)
+    np.testing.assert_array_equal(received["imData"]["values"][:2, :2], 0)
+    client.clear_queue()
+
+    # images without tile size are sent in full and have no pyramid
+    await ps.update(_image(300, 200, None))
+    received = ws_unpack(client.queue.get_nowait())
+    assert received["imData"]["values"].shape == (300, 200)
+    assert ps.plot_states["plot_0"].pyramid is None
+    await ps.send_tiles("plot_0", client, ClientTilesRequestMessage(level=0))
+    assert client.queue.empty()
@@ -0,0 +1,141 @@
+import asyncio
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from davidia.main import _create_bare_app
+from davidia.models.messages import (
+    HeatmapData,
+    ImageMessage,
+    LineData,
+    LineParams,
+    MultiLineMessage,
+    SelectionsMessage,
+)
+from davidia.models.selections import RectangularSelection
+from davidia.server.plotserver import PlotClient, PlotServer, message_kind
+from davidia.server.queues import ClientQueue, MessageKind, QueuePolicy
+
+
+def _drain(q: ClientQueue) -> list[bytes]:
+    items = []
+    while not q.empty():
+        items.append(q.get_nowait())
+        q.task_done()
+    return items
+
+
+def test_message_kind():
+    line = LineData(line_params=LineParams(), y=np.arange(3))
+    assert message_kind(MultiLineMessage(ml_data=[line])) == MessageKind.replace
+    assert (
+        message_kind(MultiLineMessage(append=True, ml_data=[line]))
+        == MessageKind.append
+    )
+    image = ImageMessage(im_data=HeatmapData(values=np.eye(2), domain=(0, 1)))
+    assert message_kind(image) == MessageKind.replace
+    selections = SelectionsMessage(
+        set_selections=[RectangularSelection(start=(0, 0), lengths=(1, 1))]
+    )
+    assert message_kind(selections) == MessageKind.control
+
+
+@pytest.mark.asyncio
+async def test_coalesce_replacements():
+    q = ClientQueue()
+    await q.put((b"d0", MessageKind.replace))
+    await q.put(b"s0")
+    await q.put((b"a0", MessageKind.append))
+    await q.put((b"b0", MessageKind.control))
+    await q.put((b"d1", MessageKind.replace))
+    await q.put((b"a1", MessageKind.append))
+
+    assert q.coalesced == 2
+    assert q.dropped == 0
+    assert _drain(q) == [b"s0", b"b0", b"d1", b"a1"]
+    await asyncio.wait_for(q.join(), 1)
+
+
+@pytest.mark.asyncio
+async def test_no_coalesce():
+    q = ClientQueue(QueuePolicy(coalesce=False))
+    for i in range(4):
+        await q.put((f"d{i}".encode(), MessageKind.replace))
+    assert q.coalesced == 0
+    assert q.qsize() == 4
+
+
+@pytest.mark.asyncio
+async def test_full_queue_drops_oldest_data():
+    q = ClientQueue(QueuePolicy(max_size=3, coalesce=False))
+    await q.put(b"s0")
+    await q.put((b"d0", MessageKind.replace))
+    await q.put((b"d1", MessageKind.replace))
+    await q.put((b"d2", MessageKind.replace))
+    assert q.dropped == 1
+    await q.put(b"s1")
+    await q.put(b"s2")  # control messages are always added
+    await q.put((b"d3", MessageKind.replace))
+
+    assert q.dropped == 2
+    assert _drain(q) == [b"s0", b"d2", b"s1", b"s2", b"d3"]
+    await asyncio.wait_for(q.join(), 1)
+
+
+@pytest.mark.asyncio
+async def test_full_queue_uses_snapshot():
+    snapshots = []
+
+    async def snapshot():
+        snapshots.append(f"snap{len(snapshots)}".encode())
+        return snapshots[-1]
+
+    q = ClientQueue(QueuePolicy(max_size=3), snapshot)
+    await q.put((b"d0", MessageKind.replace))
+    await q.put((b"a0", MessageKind.append))
+    await q.put(b"s0")
+    await q.put((b"a1", MessageKind.append))  # superseded by snapshot
+    assert q.dropped == 3
+    assert len(snapshots) == 1
+    await q.put(b"s1")
+    await q.put(b"s2")  # control messages are always added
+    assert len(snapshots) == 1
+    await q.put((b"a2", MessageKind.append))
+    assert len(snapshots) == 2
+
+    assert q.dropped == 5
+    assert _drain(q) == [b"s0", b"s1", b"s2", b"snap1"]
+    await asyncio.wait_for(q.join(), 1)
+
+
+@pytest.mark.asyncio
+async def test_client_queue_stats():
+    ps = PlotServer(QueuePolicy(max_size=2))
+    client = await ps.add_client("plot_0", None, "a1b2c3d4")  # pyright: ignore
+    assert isinstance(client, PlotClient)
+    for i in range(3):
+        await ps.update(
+            ImageMessage(
+                plot_id="plot_0",
+                im_data=HeatmapData(values=np.full((4, 4), i), domain=(0, 2)),
+            )
+        )
+    stats = ps.get_queue_stats()
+    assert len(stats) == 1
+    assert stats[0].name == client.name
+    assert stats[0].size == 2  # baton and latest image
+    assert stats[0].coalesced == 2
+    assert stats[0].dropped == 0
+
+
+def test_get_queue_stats_endpoint():
+    app = _create_bare_app(queue_policy=QueuePolicy(max_size=8))
+    with TestClient(app) as client:
+        with client.websocket_connect("/plot/5e6f7a8b/plot_0"):
+            response = client.get("/get_queue_stats")
+            assert response.status_code == 200
+            stats = response.json()
+            assert len(stats) == 1
+            assert stats[0]["uuid"] == "5e6f7a8b"
+            assert stats[0]["dropped"] == 0
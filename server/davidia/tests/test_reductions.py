@@ -0,0 +1,119 @@
+from unittest import mock
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from davidia.main import _create_bare_app
+from davidia.models.messages import HeatmapData, ImageData, ImageStackMessage
+from davidia.plot import PlotConnection
+from davidia.server import reductions
+from davidia.server.reductions import (
+    FileFrames,
+    Reducer,
+    Reduction,
+    reduce_frames,
+    reduced_image,
+)
+
+EXPECTED = {
+    Reduction.sum: np.sum,
+    Reduction.mean: np.mean,
+    Reduction.max: np.max,
+    Reduction.min: np.min,
+}
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.int32, np.float32])
+def test_reduce_frames(dtype):
+    values = np.random.default_rng(2).integers(0, 200, (9, 5, 6)).astype(dtype)
+    with mock.patch.object(reductions, "REDUCTION_CHUNK_BYTES", values[0].nbytes * 2):
+        for r, f in EXPECTED.items():
+            np.testing.assert_allclose(reduce_frames(values, r), f(values, axis=0))
+
+    with pytest.raises(ValueError):
+        reduce_frames(np.zeros((0, 3, 4)), Reduction.sum)
+
+
+def test_file_frames(tmp_path):
+    data = np.arange(4 * 5 * 6, dtype=np.int16).reshape(4, 5, 6)
+    np.save(tmp_path / "stack.npy", data)
+    mm = np.load(tmp_path / "stack.npy", mmap_mode="r")
+
+    frames = FileFrames.of(mm[1:, :, 2:5])
+    assert frames is not None
+    np.testing.assert_array_equal(frames.load(1, 3), data[2:4, :, 2:5])
+    assert FileFrames.of(mm[::-1]) is None
+    assert FileFrames.of(data) is None
+
+
+@pytest.mark.asyncio
+async def test_reducer(tmp_path):
+    data = np.random.default_rng(3).random((12, 8, 10))
+    np.save(tmp_path / "stack.npy", data)
+    mm = np.load(tmp_path / "stack.npy", mmap_mode="r")
+
+    reducer = Reducer(max_workers=2)
+    try:
+        with (
+            mock.patch.object(reductions, "POOL_THRESHOLD", 0),
+            mock.patch.object(reductions, "REDUCTION_CHUNK_BYTES", data[0].nbytes * 5),
+        ):
+            mean = await reducer.reduce(("a", 1), data, Reduction.mean)
+            np.testing.assert_allclose(mean, data.mean(axis=0))
+            assert await reducer.reduce(("a", 1), data, Reduction.mean) is mean
+            assert await reducer.reduce(("a", 2), data, Reduction.mean) is not mean
+
+            mm_max = await reducer.reduce(("b", 1), mm[2:], Reduction.max)
+            np.testing.assert_array_equal(mm_max, data[2:].max(axis=0))
+
+        with pytest.raises(ValueError):
+            await reducer.reduce(("c", 1), np.zeros(4), Reduction.sum)
+    finally:
+        reducer.shutdown()
+
+
+def test_reduced_image():
+    rgb = np.full((3, 2, 2, 3), 200, dtype=np.uint8)
+    msg = ImageStackMessage(plot_id="plot_0", stack_data=ImageData(values=rgb))
+    summed = reduced_image(msg, reduce_frames(rgb, Reduction.sum), "plot_1")
+    assert summed.plot_id == "plot_1"
+    assert summed.im_data.values.dtype == np.uint8
+    assert np.all(summed.im_data.values == 255)
+
+
+def test_reduce_stack_end_point():
+    app = _create_bare_app()
+    values = np.arange(5 * 3 * 4, dtype=np.float64).reshape(5, 3, 4)
+    with TestClient(app) as client:
+
+        def post(url, data=None, headers=None, timeout=None):
+            return client.post(url, content=data, headers=headers)
+
+        def put(url, data=None, headers=None, timeout=None):
+            return client.put(url, content=data, headers=headers)
+
+        with mock.patch("requests.Session.post", side_effect=post):
+            with mock.patch("requests.Session.put", side_effect=put):
+                pc = PlotConnection("plot_0")
+                assert pc.reduce_stack("max", "plot_1").status_code == 400
+                assert pc.image_stack(values).status_code == 200
+                assert pc.reduce_stack("max", "plot_1").status_code == 200
+
+                ps = getattr(app, "_plot_server")
+                image = ps.plot_states["plot_1"].current_data
+                assert isinstance(image.im_data, HeatmapData)
+                np.testing.assert_array_equal(image.im_data.values, values[4])
+                assert image.im_data.domain == (48, 59)
+
+                # result is kept until stack changes
+                with mock.patch.object(
+                    reductions, "reduce_frames", side_effect=AssertionError
+                ):
+                    assert pc.reduce_stack("max", "plot_2").status_code == 200
+                assert pc.image_stack(values * 2).status_code == 200
+                assert pc.reduce_stack(Reduction.mean, "plot_1").status_code == 200
+                image = ps.plot_states["plot_1"].current_data
+                np.testing.assert_array_equal(
+                    image.im_data.values, 2 * values.mean(axis=0)
+                )
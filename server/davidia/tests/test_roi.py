@@ -0,0 +1,134 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from davidia.main import _create_bare_app
+from davidia.models.messages import (
+    HeatmapData,
+    ImageMessage,
+    ScatterData,
+    ScatterMessage,
+    SelectionsMessage,
+)
+from davidia.models.selections import CircularSelection, RectangularSelection
+from davidia.plot import PlotConnection
+from davidia.server.plotserver import PlotServer
+from davidia.server.roi import MaskCache, SelectionMask, roi_stats, roi_values
+
+
+def test_roi_stats():
+    values = np.arange(20.0).reshape(4, 5)
+    values[0, 1] = np.nan
+    msg = ImageMessage(im_data=HeatmapData(values=values, domain=(0, 20)))
+    rs = RectangularSelection(start=(0, 0), lengths=(2, 2))
+    values, make_mask = roi_values(msg)
+    stats = roi_stats(rs.id, values, make_mask(rs))
+    assert stats.count == 3  # NaN is ignored
+    assert stats.sum == 11 and stats.min == 0 and stats.max == 6
+    assert np.allclose(stats.centroid, ((0.5 * 5 + 1.5 * 6) / 11, 1.5))
+
+    empty = roi_stats(
+        "a", values, make_mask(CircularSelection(start=(-9, 0), radius=1))
+    )
+    assert empty.count == 0 and empty.centroid is None
+
+    x = np.array([0.0, 1, 2, 3])
+    msg = ScatterMessage(
+        sc_data=ScatterData(x=x, y=x, point_values=x * 10, domain=(0, 30))
+    )
+    values, make_mask = roi_values(msg)
+    stats = roi_stats("b", values, make_mask(CircularSelection(start=(0, 0), radius=2)))
+    assert (stats.count, stats.sum, stats.mean) == (2, 10, 5)
+    assert stats.centroid == (1, 1)
+
+    with pytest.raises(ValueError):
+        roi_values(None)
+
+
+def test_mask_cache():
+    cache = MaskCache(max_size=2)
+    made = []
+
+    def make(i):
+        made.append(i)
+        return SelectionMask((np.arange(i),), np.zeros(i), np.zeros(i))
+
+    assert cache.get(("a",), lambda: make(1)) is cache.get(("a",), lambda: make(2))
+    cache.get(("b",), lambda: make(3))
+    cache.get(("c",), lambda: make(4))
+    assert len(cache) == 2
+    cache.get(("a",), lambda: make(5))
+    assert made == [1, 3, 4, 5]
+
+
+def test_mask_cache_threads():
+    cache = MaskCache(max_size=4)
+
+    def get(i):
+        key = (i % 7,)
+        mask = cache.get(key, lambda: SelectionMask((np.arange(1),), key, key))
+        return mask.x == key
+
+    with ThreadPoolExecutor(8) as executor:
+        assert all(executor.map(get, range(2000)))
+    assert len(cache) == 4
+
+
+@pytest.mark.asyncio
+async def test_plot_server_roi_stats():
+    ps = PlotServer()
+    values = np.ones((64, 64))
+    await ps.update(
+        ImageMessage(
+            plot_id="plot_0", im_data=HeatmapData(values=values, domain=(0, 1))
+        )
+    )
+    rs = RectangularSelection(start=(8, 8), lengths=(16, 4))
+    cs = CircularSelection(start=(32, 32), radius=4)
+    await ps.update(SelectionsMessage(plot_id="plot_0", set_selections=[rs, cs]))
+
+    stats = await ps.get_roi_stats("plot_0")
+    assert [(s.selection_id, s.count) for s in stats] == [(rs.id, 64), (cs.id, 52)]
+    assert len(ps.masks) == 2
+
+    with mock.patch.object(SelectionMask, "of_image", side_effect=AssertionError):
+        again = await ps.get_roi_stats("plot_0", cs.id)
+    assert again == stats[1:]
+
+    await ps.update(
+        ImageMessage(
+            plot_id="plot_0", im_data=HeatmapData(values=2 * values, domain=(0, 2))
+        )
+    )
+    stats = await ps.get_roi_stats("plot_0", cs.id)
+    assert stats[0].sum == 104
+    assert len(ps.masks) == 3
+
+
+def test_roi_stats_end_point():
+    app = _create_bare_app()
+    with TestClient(app) as client:
+
+        def post(url, data=None, headers=None, timeout=None):
+            return client.post(url, content=data, headers=headers)
+
+        def get(url, timeout=None):
+            return client.get(url)
+
+        with mock.patch("requests.Session.post", side_effect=post):
+            with mock.patch("requests.Session.get", side_effect=get):
+                pc = PlotConnection("plot_0")
+                pc.image(np.arange(16.0).reshape(4, 4))
+                rs = RectangularSelection(start=(0, 0), lengths=(4, 1))
+                pc.region([rs])
+                stats = pc.roi_stats()
+                assert len(stats) == 1
+                assert (stats[0].count, stats[0].sum) == (4, 6)
+                assert pc.roi_stats("missing") == []
+
+                pc.line(None, np.arange(4.0), plot_config={})
+                with pytest.raises(Exception):
+                    pc.roi_stats()
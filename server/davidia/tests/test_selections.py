@@ -126,6 +126,76 @@ def test_degrees():
     assert all(np.isclose(cs.degrees, (45, 180)))
 
 
+contains_parameters = [
+    (
+        AxialSelection(start=(1, 2), dimension=0, length=3),
+        [(2, -50), (4, 9)],
+        [(0.5, 2), (4.5, 2)],
+    ),
+    (
+        LinearSelection(start=(1, 1), length=4, degrees=90),
+        [(1, 3), (1.4, 5)],
+        [(1, 5.6), (2, 3)],
+    ),
+    (
+        RectangularSelection(start=(1, 1), lengths=(4, 2), degrees=90),
+        [(0, 4), (-0.5, 1.5)],
+        [(2, 2), (0, 5.5)],
+    ),
+    (
+        PolygonalSelection(points=[(0, 0), (4, 0), (4, 4), (2, 1), (0, 4)]),
+        [(1, 1), (3.5, 3)],
+        [(2, 3), (5, 1)],
+    ),
+    (
+        PolygonalSelection(points=[(0, 0), (4, 0)], closed=False),
+        [(2, 0.3)],
+        [(2, 1)],
+    ),
+    (CircularSelection(start=(1, 2), radius=3), [(3, 4)], [(4, 4)]),
+    (
+        EllipticalSelection(start=(0, 0), semi_axes=(4, 1), degrees=90),
+        [(0, 3.5), (0.5, 0)],
+        [(3.5, 0)],
+    ),
+    (
+        CircularSectorialSelection(start=(0, 0), radii=(1, 2), degrees=(80, 190)),
+        [(0, 1.5), (-1.5, -0.2)],
+        [(0, 0.5), (1.5, 0), (0, -1.5)],
+    ),
+]
+
+
+@pytest.mark.parametrize("selection,inside,outside", contains_parameters)
+def test_contains(selection: SelectionBase, inside, outside):
+    assert selection.contains(inside).all()
+    assert not selection.contains(outside).any()
+    points = np.array(inside + outside).reshape(1, -1, 2)
+    assert selection.contains(points).shape == points.shape[:2]
+
+    x = np.linspace(-6, 6, 25)
+    y = np.linspace(-5, 7, 13)
+    mask = selection.mask((13, 24), x_values=x, y_values=y)
+    assert mask.shape == (13, 24)
+    xx, yy = np.meshgrid(0.5 * (x[:-1] + x[1:]), y)
+    expected = selection.contains(np.stack((xx, yy), axis=-1), tolerance=0.5)
+    np.testing.assert_array_equal(mask, expected)
+
+    with pytest.raises(ValueError):
+        selection.contains([1, 2, 3])
+
+
+def test_mask_default_pixels():
+    rs = RectangularSelection(start=(1, 2), lengths=(2, 3))
+    mask = rs.mask((6, 5))
+    assert mask.sum() == 6
+    assert mask[2:5, 1:3].all()
+    with pytest.raises(ValueError):
+        rs.mask((6, 5), x_values=np.arange(3))
+    with pytest.raises(NotImplementedError):
+        SelectionBase(start=(0, 0)).mask((2, 2))
+
+
 class MySBModel(BaseModel):
     base: SelectionBase
     any_sel: AnySelection
@@ -0,0 +1,197 @@
+from multiprocessing.shared_memory import SharedMemory
+from unittest import mock
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from davidia.main import _create_bare_app
+from davidia.models.messages import HeatmapData, ImageMessage
+from davidia.plot import PlotConnection, npy_file
+from davidia.server.fastapi_utils import ws_pack
+from davidia.server.shared import (
+    SharedBlocks,
+    discard_blocks,
+    pack_shared,
+    unpack_shared,
+)
+
+
+def _exists(name: str) -> bool:
+    try:
+        shm = SharedMemory(name)
+    except FileNotFoundError:
+        return False
+    shm.close()
+    return True
+
+
+def test_pack_shared_round_trip():
+    values = np.arange(100_000, dtype=np.float32).reshape(200, 500)
+    small = np.arange(10)
+    packed, created = pack_shared({"values": values, "small": small})
+    assert len(created) == 1
+    assert len(packed) < 200
+    name = created[0].name
+    discard_blocks(created)
+
+    blocks = SharedBlocks()
+    unpacked = unpack_shared(packed, blocks)
+    assert len(blocks) == 1
+    np.testing.assert_array_equal(unpacked["values"], values)
+    np.testing.assert_array_equal(unpacked["small"], small)
+    assert not unpacked["values"].flags.owndata  # views block
+
+    del unpacked
+    blocks.release()
+    assert not _exists(name)
+
+
+def test_unpack_shared_missing_block():
+    packed, created = pack_shared({"values": np.zeros(100_000)})
+    discard_blocks(created, unlink=True)
+    with pytest.raises(ValueError):
+        unpack_shared(packed, SharedBlocks())
+
+
+def test_attach_invalid_array():
+    packed, created = pack_shared({"values": np.zeros(100_000)})
+    name = created[0].name
+    discard_blocks(created)
+    blocks = SharedBlocks()
+    try:
+        for dtype, shape in [("xyz", (10,)), ("O", (10,)), ("<f8", (2.5, 2))]:
+            with pytest.raises(ValueError):
+                blocks.attach(name, dtype, shape)  # pyright: ignore
+        assert blocks.attach(name, "<f8", (10, 10)).shape == (10, 10)
+    finally:
+        blocks.release()
+
+    with pytest.raises(ValueError):
+        SharedBlocks(enabled=False).attach(name, "<f8", (10,))
+
+
+def test_plot_connection_shared_memory():
+    app = _create_bare_app(shared_memory=True)
+    names = []
+
+    with TestClient(app) as client:
+
+        def post(url, data=None, headers=None, timeout=None):
+            return client.post(url, content=data, headers=headers)
+
+        def recording_pack_shared(obj):
+            packed, blocks = pack_shared(obj)
+            names.extend(b.name for b in blocks)
+            return packed, blocks
+
+        with mock.patch("requests.Session.post", side_effect=post):
+            with mock.patch("davidia.plot.pack_shared", recording_pack_shared):
+                pc = PlotConnection("plot_0", shared_memory=True)
+                first = np.random.default_rng(1).random((256, 256))
+                assert pc.image(first).status_code == 200
+                assert len(names) == 1 and _exists(names[0])
+
+                ps = getattr(app, "_plot_server")
+                plot_state = ps.plot_states["plot_0"]
+                values = plot_state.current_data.im_data.values
+                np.testing.assert_array_equal(values, first)
+                assert not values.flags.owndata
+                del values
+
+                # replacing data releases block
+                assert pc.image(np.ones((256, 256))).status_code == 200
+                assert len(names) == 2
+                assert not _exists(names[0]) and _exists(names[1])
+
+                plot_state.clear()
+                assert not _exists(names[1])
+
+        # blocks of messages that cannot be used are released
+        packed, created = pack_shared({"values": np.zeros(100_000)})
+        discard_blocks(created)
+        response = client.post(
+            "/push_shared",
+            content=packed,
+            headers={"Content-Type": "application/x-msgpack"},
+        )
+        assert response.status_code == 400
+        assert not _exists(created[0].name)
+
+        response = client.post(
+            "/push_shared",
+            content=ws_pack(
+                ImageMessage(
+                    plot_id="plot_1",
+                    im_data=HeatmapData(values=np.ones((4, 4)), domain=(0, 1)),
+                )
+            ),
+            headers={"Content-Type": "application/x-msgpack"},
+        )
+        assert response.status_code == 200
+
+
+def test_npy_file_references(tmp_path):
+    data = np.arange(600.0).reshape(3, 10, 20)
+    np.save(tmp_path / "frames.npy", data)
+    (tmp_path / "other").mkdir()
+    np.save(tmp_path / "other" / "a.npy", data)
+
+    frame = npy_file(tmp_path / "frames.npy", (1, slice(2, 8)))
+    np.testing.assert_array_equal(frame, data[1, 2:8])
+    assert (frame * 2).npy_path is None  # derived arrays are not references
+    packed, created = pack_shared({"values": frame})
+    assert not created
+    assert len(packed) < 200
+
+    root = tmp_path / "other"
+    with pytest.raises(ValueError):
+        unpack_shared(packed, SharedBlocks())  # not enabled
+    with pytest.raises(ValueError):
+        unpack_shared(packed, SharedBlocks(), root)  # outside root
+
+    values = unpack_shared(packed, SharedBlocks(), tmp_path)["values"]
+    assert isinstance(values, np.memmap)
+    np.testing.assert_array_equal(values, data[1, 2:8])
+
+    app = _create_bare_app(data_dir=tmp_path)
+    with TestClient(app) as client:
+
+        def post(url, data=None, headers=None, timeout=None):
+            return client.post(url, content=data, headers=headers)
+
+        with mock.patch("requests.Session.post", side_effect=post):
+            pc = PlotConnection("plot_0", shared_memory=True)
+            response = pc.image(
+                npy_file(tmp_path / "frames.npy", 2), domain=(0.0, 600.0)
+            )
+            assert response.status_code == 200
+
+    values = getattr(app, "_plot_server").plot_states["plot_0"].current_data
+    assert isinstance(values.im_data.values, np.memmap)
+    np.testing.assert_array_equal(values.im_data.values, data[2])
+
+
+@pytest.mark.parametrize("data_dir", [False, True])
+def test_shared_memory_not_enabled(tmp_path, data_dir):
+    app = _create_bare_app(data_dir=tmp_path if data_dir else None)
+    names = []
+
+    with TestClient(app) as client:
+
+        def post(url, data=None, headers=None, timeout=None):
+            return client.post(url, content=data, headers=headers)
+
+        def recording_pack_shared(obj):
+            packed, blocks = pack_shared(obj)
+            names.extend(b.name for b in blocks)
+            return packed, blocks
+
+        with mock.patch("requests.Session.post", side_effect=post):
+            with mock.patch("davidia.plot.pack_shared", recording_pack_shared):
+                pc = PlotConnection("plot_0", shared_memory=True)
+                response = pc.image(np.ones((256, 256)))
+                assert response.status_code == (400 if data_dir else 403)
+
+    assert len(names) == 1 and not _exists(names[0])  # producer unlinked block
+    assert "plot_0" not in getattr(app, "_plot_server").plot_states
@@ -0,0 +1,174 @@
+from unittest import mock
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from davidia.main import _create_bare_app
+from davidia.models.messages import (
+    ClientFrameMessage,
+    HeatmapData,
+    ImageFrameMessage,
+    ImageMessage,
+    ImageStackMessage,
+    StackFrameMessage,
+)
+from davidia.plot import PlotConnection, npy_file
+from davidia.server.fastapi_utils import as_model, ws_unpack
+from davidia.server.plotserver import PlotServer
+from davidia.server.queues import QueuePolicy
+from davidia.server.stack import MAX_PACKED_FRAMES, ImageStack
+
+
+def _stack(frames: int, frame: int = 0):
+    values = np.arange(frames * 12, dtype=np.float64).reshape(frames, 3, 4)
+    return ImageStackMessage(
+        plot_id="plot_0",
+        stack_data=HeatmapData(values=values, domain=(0, frames * 12)),
+        frame=frame,
+    )
+
+
+def _received(client) -> list:
+    received = []
+    while not client.queue.empty():
+        received.append(as_model(ws_unpack(client.queue.get_nowait())))
+    return received
+
+
+def test_image_stack():
+    stack = ImageStack(_stack(40))
+    assert stack.frames == 40
+    assert stack.clamp(-3) == 0 and stack.clamp(45) == 39
+    assert stack.neighbours(0) == [1, 2]
+    assert stack.neighbours(10) == [11, 9, 12, 8]
+    assert stack.neighbours(39, 1) == [38]
+
+    msg = stack.frame_message(5)
+    assert msg.stack is not None
+    assert (msg.stack.frame, msg.stack.frames) == (5, 40)
+    np.testing.assert_array_equal(msg.im_data.values, stack.msg.stack_data.values[5])
+
+    packed = stack.packed_frame("plot_0", 5)
+    assert stack.packed_frame("plot_0", 5) is packed
+    for f in range(MAX_PACKED_FRAMES):
+        stack.packed_frame("plot_0", 10 + f)
+    assert stack.packed_frame("plot_0", 5) is not packed
+
+    with pytest.raises(ValueError):
+        ImageStack(
+            ImageStackMessage(
+                stack_data=HeatmapData(values=np.zeros((3, 4)), domain=(0, 1))
+            )
+        )
+
+
+@pytest.mark.asyncio
+async def test_clients_receive_selected_and_prefetched_frames():
+    ps = PlotServer()
+    client = await ps.add_client("plot_0", None, "0a0a0a0a")  # pyright: ignore
+    client.clear_queue()
+
+    await ps.update(_stack(10, 4))
+    received = _received(client)
+    assert isinstance(received[0], ImageMessage)
+    assert received[0].stack.frame == 4
+    np.testing.assert_array_equal(
+        received[0].im_data.values, np.arange(48, 60).reshape(3, 4)
+    )
+    prefetched = [m.frame for m in received[1:]]
+    assert prefetched == [5, 3, 6, 2]
+    assert all(isinstance(m, ImageFrameMessage) for m in received[1:])
+
+    await ps.select_frame("plot_0", 5)
+    received = _received(client)
+    assert isinstance(received[0], StackFrameMessage)  # frame was prefetched
+    assert received[0].frame == 5
+    assert [m.frame for m in received[1:]] == [4, 7]
+
+    await ps.select_frame("plot_0", 20)
+    received = _received(client)
+    assert [type(m) for m in received[:2]] == [ImageFrameMessage, StackFrameMessage]
+    assert received[1].frame == 9
+    assert [m.frame for m in received[2:]] == [8]
+
+    # new clients get frame at cursor
+    other = await ps.add_client("plot_0", None, "0b0b0b0b")  # pyright: ignore
+    received = [m for m in _received(other) if isinstance(m, ImageMessage)]
+    assert received[0].stack.frame == 9
+
+    # new stack resets frames kept by clients
+    await ps.update(_stack(3))
+    client.clear_queue()
+    await ps.select_frame("plot_0", 1)
+    received = _received(client)
+    assert isinstance(received[0], StackFrameMessage)
+    assert [m.frame for m in received[1:]] == [0]  # shown frame not tracked
+
+    await ps.update(
+        ImageMessage(
+            plot_id="plot_0", im_data=HeatmapData(values=np.ones((3, 4)), domain=(0, 1))
+        )
+    )
+    assert ps.plot_states["plot_0"].stack is None
+
+
+@pytest.mark.asyncio
+async def test_frames_are_bounded_data_messages():
+    ps = PlotServer(QueuePolicy(max_size=4))
+    client = await ps.add_client("plot_0", None, "0a0a0a0a")  # pyright: ignore
+    client.clear_queue()
+    await ps.update(_stack(40))
+    _received(client)
+
+    # frames are dropped in favour of snapshot at cursor when queue is full
+    await ps.update(_stack(40))
+    await ps.select_frame("plot_0", 20)
+    assert client.queue.qsize() <= 4 and client.queue.dropped > 0
+    received = _received(client)
+    assert [type(m) for m in received] == [ImageMessage]
+    assert received[0].stack.frame == 20
+    assert 20 not in client.stack_frames  # lost frames are not tracked
+
+    # frames kept by client are bounded
+    ps = PlotServer(QueuePolicy(max_size=0))
+    client = await ps.add_client("plot_0", None, "0a0a0a0a")  # pyright: ignore
+    await ps.update(_stack(40))
+    for f in range(40):
+        await ps.select_frame("plot_0", f)
+        assert len(client.stack_frames) <= MAX_PACKED_FRAMES
+    client.clear_queue()
+    await ps.select_frame("plot_0", 1)
+    received = _received(client)
+    assert isinstance(received[0], ImageFrameMessage)  # evicted frame is resent
+    assert received[0].frame == 1
+
+
+def test_frame_selection(tmp_path):
+    data = np.arange(5 * 6 * 7, dtype=np.float32).reshape(5, 6, 7)
+    np.save(tmp_path / "stack.npy", data)
+    assert as_model({"frame": 3}) == ClientFrameMessage(frame=3)
+
+    app = _create_bare_app(data_dir=tmp_path)
+    with TestClient(app) as client:
+
+        def post(url, data=None, headers=None, timeout=None):
+            return client.post(url, content=data, headers=headers)
+
+        def put(url, data=None, headers=None, timeout=None):
+            return client.put(url, content=data, headers=headers)
+
+        with mock.patch("requests.Session.post", side_effect=post):
+            with mock.patch("requests.Session.put", side_effect=put):
+                pc = PlotConnection("plot_0", shared_memory=True)
+                response = pc.image_stack(
+                    npy_file(tmp_path / "stack.npy"), domain=(0, 210)
+                )
+                assert response.status_code == 200
+                assert pc.select_frame(3).status_code == 200
+
+    plot_state = getattr(app, "_plot_server").plot_states["plot_0"]
+    assert isinstance(plot_state.current_data.stack_data.values, np.memmap)
+    assert plot_state.frame == 3
+    snapshot = ws_unpack(plot_state.new_data_message)
+    np.testing.assert_array_equal(snapshot["imData"]["values"], data[3])
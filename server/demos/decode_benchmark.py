@@ -0,0 +1,91 @@
+import logging
+from functools import partial
+from timeit import repeat
+
+import numpy as np
+from pydantic import BaseModel
+
+from davidia.models.messages import (
+    ALL_MODELS,
+    BatonDonateMessage,
+    ClientSelectionMessage,
+    ClientStatusMessage,
+    ClientViewportMessage,
+    HeatmapData,
+    ImageMessage,
+    LineData,
+    LineParams,
+    MultiLineMessage,
+    StatusType,
+)
+from davidia.models.selections import RectangularSelection
+from davidia.server.fastapi_utils import as_model, ws_pack, ws_unpack
+
+logger = logging.getLogger("benchmark")
+
+
+def as_model_by_trial(raw: dict) -> BaseModel | None:
+    """Validate dict by trying every model in turn (as done previously)"""
+    for m in ALL_MODELS:
+        try:
+            return m.model_validate(raw)
+        except Exception:
+            pass
+    return None
+
+
+def sample_messages() -> dict[str, bytes]:
+    """Create packed messages typical of those received by plot server"""
+    messages = {
+        "status": ClientStatusMessage(status=StatusType.ready),
+        "viewport": ClientViewportMessage(pixel_width=800, x_range=(0, 10)),
+        "selection": ClientSelectionMessage(
+            selection=RectangularSelection(start=(1, 2), lengths=(3, 4))
+        ),
+        "baton donate": BatonDonateMessage(receiver="a1b2c3d4"),
+        "lines": MultiLineMessage(
+            ml_data=[
+                LineData(key=str(i), line_params=LineParams(), y=np.arange(1000.0))
+                for i in range(3)
+            ]
+        ),
+        "image": ImageMessage(
+            im_data=HeatmapData(values=np.ones((256, 256)), domain=(0, 1))
+        ),
+    }
+    return {n: ws_pack(m) for n, m in messages.items()}  # pyright: ignore
+
+
+def run(number: int = 200) -> dict[str, tuple[float, float]]:
+    """Time decoding of sample messages
+
+    Parameters
+    ----------
+    number : int
+        number of decodes in each timing
+
+    Returns
+    -------
+    dict of message name to times (in microseconds) per decode by trial and by
+    key signature
+    """
+    results = {}
+    for name, packed in sample_messages().items():
+        raw = ws_unpack(packed)
+        assert type(as_model(raw)) is type(as_model_by_trial(raw))
+        times = []
+        for decoder in (as_model_by_trial, as_model):
+            best = min(repeat(partial(decoder, raw), number=number, repeat=5))
+            times.append(best * 1e6 / number)
+        results[name] = (times[0], times[1])
+    return results
+
+
+def main():
+    print(f"{'message':>14} {'by trial/us':>12} {'by keys/us':>12} {'speed-up':>9}")
+    for name, (before, after) in run().items():
+        print(f"{name:>14} {before:12.1f} {after:12.1f} {before / after:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
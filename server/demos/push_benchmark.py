@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import requests
+import uvicorn
+
+from davidia.main import _create_bare_app
+from davidia.models.messages import LineData, LineParams, MultiLineMessage
+from davidia.plot import PlotConnection
+from davidia.server.fastapi_utils import ws_pack
+
+logger = logging.getLogger("benchmark")
+
+
+def small_line(plot_id: str) -> MultiLineMessage:
+    """Create message of a small line like those pushed by scans"""
+    return MultiLineMessage(
+        plot_id=plot_id,
+        ml_data=[LineData(key="a", line_params=LineParams(), y=np.arange(10.0))],
+    )
+
+
+def calls_per_second(push, duration: float) -> float:
+    """Call push repeatedly for given duration and return rate of calls"""
+    calls = 0
+    start = time.perf_counter()
+    end = start + duration
+    while (now := time.perf_counter()) < end:
+        push()
+        calls += 1
+    return calls / (now - start)
+
+
+def run(host: str, port: int, duration: float = 2.0) -> dict[str, float]:
+    """Measure calls per second of small line pushes to plot server
+
+    Parameters
+    ----------
+    host : str
+    port : int
+    duration : float
+        time in seconds for each measurement
+
+    Returns
+    -------
+    dict of method name to calls per second
+    """
+    url = f"http://{host}:{port}/push_data"
+    headers = {"Content-Type": "application/x-msgpack"}
+    packed = ws_pack(small_line("plot_0"))
+
+    def new_connection():
+        requests.post(url, data=packed, headers=headers)
+
+    pc = PlotConnection("plot_0", host, port)
+    msg = small_line("plot_0")
+
+    results = {
+        "connection per call": calls_per_second(new_connection, duration),
+        "pooled session": calls_per_second(lambda: pc._post(msg), duration),
+    }
+    return results
+
+
+def start_server(host: str, port: int) -> uvicorn.Server:
+    """Start plot server in a background thread"""
+    server = uvicorn.Server(
+        uvicorn.Config(_create_bare_app(), host=host, port=port, log_level="warning")
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark rate of small line pushes")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8123)
+    parser.add_argument(
+        "--external", action="store_true", help="use running plot server"
+    )
+    parser.add_argument("--duration", type=float, default=2.0)
+    args = parser.parse_args()
+
+    server = None if args.external else start_server(args.host, args.port)
+    results = run(args.host, args.port, args.duration)
+    if server is not None:
+        server.should_exit = True
+
+    print(f"{'method':>20} {'calls/s':>9}")
+    for name, rate in results.items():
+        print(f"{name:>20} {rate:9.1f}")
+
+
+if __name__ == "__main__":
+    main()